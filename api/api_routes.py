@@ -1,13 +1,24 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, UploadFile, File, Request, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 import asyncio
-import cv2
-import numpy as np
-import base64
+import time
 from typing import List
 
+from src.frame_protocol import (
+    PROTOCOL_TEXT, FrameProtocolError, decode_binary_frame, decode_data_url,
+    decode_image, negotiate_protocol, parse_control_message
+)
+from src.stream_session import IncomingFrame
+from src.change_detector import CHANGED
+from src.load_scheduler import CLOSE_TRY_AGAIN_LATER
+from src.frame_context import FrameContext
+from src.vision_pipeline import Stage, run_stages
+from src.metrics import FRAME_SECONDS, FRAMES, REGISTRY, observe_stage
+
 api_router = APIRouter()
 
-from src.face_recontition_system import FaceRecognitionSystem
+# A frame whose faces are not known by then is dropped
+FACE_DEADLINE_S = 5.0
 
 @api_router.get("/")
 async def read_root():
@@ -16,36 +27,189 @@ async def read_root():
 @api_router.websocket("/ws/video")
 async def video_websocket(websocket: WebSocket):
     manager = websocket.app.state.manager
-    face_system = websocket.app.state.face_system
-    vision_pipeline = websocket.app.state.vision_pipeline
+    if not websocket.app.state.face_system.ready:
+        # Until the gallery is loaded every enrolled person would come back as Unknown
+        await websocket.accept()
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason="Server starting, try again later")
+        return
 
-    if not await manager.connect(websocket):
+    session = await manager.connect(websocket)
+    if session is None:
         return
+    # Face detector preset of face_recognition.detectors, e.g. /ws/video?detector=coarse_to_fine
+    session.detector, session.face_processor.detector = websocket.app.state.face_system.detector_spec(
+        websocket.query_params.get("detector")
+    )
+    # Initial send rate and JPEG quality; updated whenever the quality level changes
+    if session.rate_controller.enabled:
+        session.outbox.put_control(session.rate_controller.client_message())
 
+    # Receiving, processing and sending run concurrently: a slow inference never
+    # backs up the socket, and the processor always picks the newest frame
+    tasks = [
+        asyncio.ensure_future(_receive_frames(websocket, session)),
+        asyncio.ensure_future(_process_frames(websocket, session)),
+        asyncio.ensure_future(_send_results(websocket, session)),
+    ]
     try:
-        while await manager.is_connected(websocket):
-            try:
-                data = await asyncio.wait_for(websocket.receive_text(), timeout=120.0)
-                encoded_data = data.split(',')[1]
-                frame = cv2.imdecode(np.frombuffer(base64.b64decode(encoded_data), np.uint8), cv2.IMREAD_COLOR)
-                if frame is None:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        print(f"{session}: {session.frames_received} received, {session.frames_processed} processed, "
+              f"{session.frames_dropped} dropped")
+        websocket.app.state.vision_pipeline.forget_session(session)
+        await manager.disconnect(websocket)
+
+async def _receive_frames(websocket: WebSocket, session):
+    manager = websocket.app.state.manager
+    protocol = PROTOCOL_TEXT
+    while await manager.is_connected(websocket):
+        try:
+            message = await asyncio.wait_for(websocket.receive(), timeout=120.0)
+            if message["type"] == "websocket.disconnect":
+                return
+
+            received = time.perf_counter()
+            if message.get("bytes") is not None:
+                # Binary mode: small header plus the raw JPEG/WebP bytes
+                header, payload = decode_binary_frame(message["bytes"])
+                session.frames_received += 1
+                frame = IncomingFrame(payload, header.frame_id, time.time(), header.capture_ts)
+            else:
+                data = message.get("text") or ""
+                control = parse_control_message(data)
+                if control is not None:
+                    if control.get("type") == "hello":
+                        protocol = negotiate_protocol(control)
+                        session.outbox.put_control({"type": "hello", "protocol": protocol})
                     continue
+                # Text mode kept for old clients sending data URLs; frames get a server-side id
+                payload = decode_data_url(data)
+                observe_stage("decode_base64", time.perf_counter() - received)
+                frame = IncomingFrame(payload, session.next_frame_id(), time.time())
 
-                await manager.add_frame(websocket, frame)
+            if session.recorder is not None:
+                session.recorder.write(frame)
 
-                analysis_type = getattr(websocket.app.state, 'analysis_type', None)
-                face_results = await asyncio.wait_for(face_system.process_frame(frame), timeout=5.0)
-                vision_results = await vision_pipeline.process_frame(frame, analysis_type) if analysis_type else {}
+            # Overwrites the previous frame if the processor has not taken it yet
+            FRAMES.inc("received")
+            if session.inbox.put(frame):
+                FRAMES.inc("dropped")
+            observe_stage("receive", time.perf_counter() - received)
+        except asyncio.TimeoutError:
+            print("WebSocket timeout")
+        except FrameProtocolError as e:
+            print(f"Invalid frame ({protocol} mode): {e}")
+        except (WebSocketDisconnect, RuntimeError):
+            return
+        except Exception as e:
+            print(f"Error receiving frame: {e}")
 
-                response = {"face_results": face_results, "vision_results": vision_results}
-                if not await manager.send_json(websocket, response):
-                    break
-            except asyncio.TimeoutError:
-                print("WebSocket timeout")
-            except Exception as e:
-                print(f"Error in WebSocket loop: {e}")
-    finally:
-        await manager.disconnect(websocket)
+async def _process_frames(websocket: WebSocket, session):
+    face_system = websocket.app.state.face_system
+    vision_pipeline = websocket.app.state.vision_pipeline
+    while True:
+        incoming = await session.inbox.get()
+        try:
+            # Duplicate or static frames reuse the last results without being decoded
+            decision = session.change_gate.check(incoming.payload, can_skip=session.last_response is not None)
+            if decision != CHANGED:
+                response = dict(session.last_response, frame_id=incoming.frame_id, skipped=decision,
+                                dropped_frames=session.frames_dropped,
+                                server_latency_ms=round((time.time() - incoming.received_at) * 1000, 1))
+                response.pop("capture_ts", None)
+                if incoming.capture_ts is not None:
+                    response["capture_ts"] = incoming.capture_ts
+                session.outbox.put_result(response)
+                FRAMES.inc("skipped")
+                FRAME_SECONDS.observe(time.time() - incoming.received_at, "true")
+                continue
+
+            rate_controller = session.rate_controller
+            started = time.perf_counter()
+            frame = decode_image(incoming.payload)
+            if frame is None:
+                continue
+            decoded = time.perf_counter()
+            _record_stage(session, "decode", decoded - started)
+
+            # Conversions done once here are shared by the face system, the analyses and the log
+            frame = FrameContext(frame, session.frame_buffers)
+
+            analysis_type = getattr(websocket.app.state, 'analysis_type', None)
+            if session.analyses_shed:
+                analysis_type = None
+            # Face recognition and the analysis run as a graph: whole-frame analyses overlap
+            # detection, per-face ones start once the faces are known and may miss their deadline
+            face_stage = Stage("faces", lambda: face_system.process_frame(frame, session),
+                               deadline=FACE_DEADLINE_S, optional=False)
+            analysis_stages = vision_pipeline.analysis_stages(frame, analysis_type, session) if analysis_type else []
+            results, status = await run_stages(
+                [_timed(session, "face", face_stage)] + [_timed(session, "vision", s) for s in analysis_stages]
+            )
+            face_results = results["faces"]
+            vision_results = {s.name: results[s.name] for s in analysis_stages if results.get(s.name) is not None}
+            missed_stages = [name for name, state in status.items() if state != "ok"]
+            finished = time.perf_counter()
+            session.busy_seconds += finished - started
+            rate_controller.record_frame(time.time() - incoming.received_at)
+            session.frames_processed += 1
+
+            # Degrade or recover this stream's quality level from the measured latency
+            if rate_controller.update():
+                session.apply_quality(rate_controller.level)
+                session.outbox.put_control(rate_controller.client_message())
+
+            response = {
+                "face_results": face_results,
+                "vision_results": vision_results,
+                # Lets the client match results to frames and measure end-to-end lag
+                "frame_id": incoming.frame_id,
+                "server_latency_ms": round((time.time() - incoming.received_at) * 1000, 1),
+                "dropped_frames": session.frames_dropped,
+                "analyses_shed": session.analyses_shed,
+                # Optional stages left out of this frame (deadline missed or failed)
+                "missed_stages": missed_stages
+            }
+            if incoming.capture_ts is not None:
+                response["capture_ts"] = incoming.capture_ts
+            session.last_response = response
+            session.outbox.put_result(response)
+            FRAMES.inc("processed")
+            FRAME_SECONDS.observe(time.time() - incoming.received_at, "false")
+        except asyncio.TimeoutError:
+            print("Frame processing timeout")
+        except Exception as e:
+            print(f"Error processing frame: {e}")
+
+def _timed(session, metric: str, stage: Stage) -> Stage:
+    # Records how long the stage itself ran, whatever it overlapped with
+    run = stage.run
+
+    async def timed(*args):
+        started = time.perf_counter()
+        try:
+            return await run(*args)
+        finally:
+            _record_stage(session, metric, time.perf_counter() - started)
+    stage.run = timed
+    return stage
+
+def _record_stage(session, stage: str, seconds: float):
+    # Feeds both the stream's rate controller and the /metrics histograms
+    session.rate_controller.record(stage, seconds)
+    observe_stage(stage, seconds)
+
+async def _send_results(websocket: WebSocket, session):
+    manager = websocket.app.state.manager
+    while True:
+        message = await session.outbox.get()
+        started = time.perf_counter()
+        if not await manager.send_json(websocket, message):
+            return
+        observe_stage("send", time.perf_counter() - started)
 
 @api_router.post("/users")
 async def add_user(request: Request, username: str, images: List[UploadFile] = File(...)):
@@ -53,7 +217,6 @@ async def add_user(request: Request, username: str, images: List[UploadFile] = F
     print(f"Number of images received: {len(images)}")
     for image in images:
         print(f"Image: {image.filename}, Content-Type: {image.content_type}")
-    face_system = FaceRecognitionSystem()
     # Validaciones
     if not username or len(username) < 3:
         raise HTTPException(status_code=422, detail="Username must be at least 3 characters long")
@@ -65,6 +228,7 @@ async def add_user(request: Request, username: str, images: List[UploadFile] = F
     
     # Lógica de procesamiento
     face_system = request.app.state.face_system
+    await _wait_for_gallery(face_system)
     return await face_system.add_user(username, images)
 
 @api_router.get("/users")
@@ -73,10 +237,94 @@ async def get_users(request: Request):
     users = [dir.name for dir in face_system.dataset_path.iterdir() if dir.is_dir()]
     return {"users": users}
 
+@api_router.delete("/users/{username}")
+async def delete_user(request: Request, username: str):
+    face_system = request.app.state.face_system
+    await _wait_for_gallery(face_system)
+    return await face_system.remove_user(username)
+
+async def _wait_for_gallery(face_system):
+    # Enrollments made while the startup load runs would be overwritten by it
+    if not await face_system.wait_ready():
+        raise HTTPException(status_code=503, detail="The gallery is still loading, try again later",
+                            headers={"Retry-After": "5"})
+
+
+@api_router.get("/health/live")
+async def liveness():
+    # The process is up and serving requests
+    return {"status": "alive"}
+
+
+@api_router.get("/health/ready")
+async def readiness(request: Request):
+    # Ready once the gallery is loaded and every model marked `warmup: true` is built
+    face_system = request.app.state.face_system
+    registry = request.app.state.vision_pipeline.registry
+    ready = face_system.ready and registry.ready()
+    body = {
+        "status": "ready" if ready else "starting",
+        "gallery_loaded": face_system.ready,
+        "gallery_generation": face_system.gallery_generation,
+        "models": registry.status()
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+
+@api_router.post("/models/warmup")
+async def warmup_models(request: Request, data: dict = None):
+    # Builds the given models now (all available ones by default) instead of on first use
+    registry = request.app.state.vision_pipeline.registry
+    names = (data or {}).get("models")
+    unknown = [name for name in names or [] if name not in registry.available()]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown or disabled model(s): {', '.join(unknown)}")
+    return {"models": await registry.warm_up(names)}
+
+
+@api_router.get("/streams")
+async def streams(request: Request):
+    # Per-connection counters, including the change-detection skip ratio
+    return {"streams": request.app.state.manager.stats()}
+
+
+@api_router.get("/load")
+async def load(request: Request):
+    # Server-wide load, current shed level and the latest shedding/admission decisions
+    manager = request.app.state.manager
+    streams = manager.active_connections.values()
+    return {
+        "scheduler": manager.scheduler.stats(),
+        "streams": len(manager.active_connections),
+        "by_priority": {
+            priority: sum(1 for session in streams if session.priority == priority)
+            for priority in ("high", "normal", "low")
+        },
+        "shed_streams": [
+            {"session_id": s.session_id, "priority": s.priority, "analyses_shed": s.analyses_shed,
+             "min_quality_level": s.rate_controller.min_level}
+            for s in streams if s.analyses_shed or s.rate_controller.min_level
+        ]
+    }
+
+
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@api_router.get("/vision/stats")
+async def vision_stats(request: Request):
+    return request.app.state.vision_pipeline.stats()
+
 
 @api_router.post("/set-analysis")
 async def set_analysis(request: Request, data: dict):
     analysis_type = data.get("type", "none")
+    registry = request.app.state.vision_pipeline.registry
+    if analysis_type != "none" and analysis_type not in registry.available():
+        raise HTTPException(status_code=404, detail=f"Unknown or disabled model: {analysis_type}")
     request.app.state.analysis_type = analysis_type
     print(f'Analysis type set to {analysis_type}')
     return {
@@ -4,7 +4,9 @@ let ws = null;
 let stream = null;
 const capturedImages = [];
 let lastFrameTime = 0;
-const FRAME_INTERVAL = 200; // Increased to 200ms for better stability
+// Send rate and JPEG quality; the server adjusts them with "control" messages
+let frameInterval = 200;
+let jpegQuality = 0.6;
 let reconnectAttempts = 0;
 const MAX_RECONNECT_ATTEMPTS = 5;
 let lastReceivedResults = [];
@@ -12,6 +14,17 @@ let lastVisionState = null;
 let animationFrameId = null;
 let reconnectTimeout = null;
 
+// Binary frame protocol (see src/frame_protocol.py), negotiated on connect
+const FRAME_HEADER_SIZE = 20;
+const FRAME_MAGIC = [0x46, 0x52]; // "FR"
+const FRAME_PROTOCOL_VERSION = 1;
+const CODEC_JPEG = 0;
+let binaryMode = false;
+let frameId = 0;
+let sendInFlight = false;
+let lastLagMs = null; // capture -> results, only known in binary mode
+const captureCanvas = document.createElement('canvas');
+
 // DOM Elements
 const video = document.getElementById('video');
 const overlay = document.getElementById('overlay');
@@ -36,9 +49,13 @@ function setupWebSocket() {
     }
 
     ws = new WebSocket('ws://localhost:8000/ws/video');
+    ws.binaryType = 'arraybuffer';
+    binaryMode = false;
     
     ws.onopen = () => {
         console.log('WebSocket connected');
+        // Ask for binary frames; we keep sending data URLs until the server agrees
+        ws.send(JSON.stringify({ type: 'hello', protocol: 'binary', version: FRAME_PROTOCOL_VERSION }));
         reconnectAttempts = 0; // Reset reconnect attempts on successful connection
         if (reconnectTimeout) {
             clearTimeout(reconnectTimeout);
@@ -53,8 +70,14 @@ function setupWebSocket() {
         reconnectAttempts++;
     };
     
-    ws.onclose = () => {
+    ws.onclose = (event) => {
         console.log('WebSocket disconnected');
+        if (event.code === 1013 && isStreaming) {
+            // Server overloaded: wait longer before trying again
+            console.warn(`Connection refused: ${event.reason}`);
+            reconnectTimeout = setTimeout(setupWebSocket, 10000);
+            return;
+        }
         if (isStreaming && reconnectAttempts < MAX_RECONNECT_ATTEMPTS) {
             // Exponential backoff for reconnection
             const delay = Math.min(1000 * Math.pow(2, reconnectAttempts), 10000);
@@ -149,28 +172,30 @@ function sendFrame() {
     }
 
     const currentTime = performance.now();
-    if (currentTime - lastFrameTime < FRAME_INTERVAL) {
+    if (currentTime - lastFrameTime < frameInterval) {
         animationFrameId = requestAnimationFrame(sendFrame);
         return;
     }
 
     try {
-        const canvas = document.createElement('canvas');
-        canvas.width = video.videoWidth;
-        canvas.height = video.videoHeight;
-        const ctx = canvas.getContext('2d', { alpha: false });
-        
         if (!video.videoWidth || !video.videoHeight) {
             animationFrameId = requestAnimationFrame(sendFrame);
             return;
         }
-        
-        ctx.drawImage(video, 0, 0);
-        const base64Frame = canvas.toDataURL('image/jpeg', 0.6);
-        
-        if (ws.bufferedAmount === 0) {
-            ws.send(base64Frame);
+
+        if (ws.bufferedAmount === 0 && !sendInFlight) {
+            const canvas = captureCanvas;
+            canvas.width = video.videoWidth;
+            canvas.height = video.videoHeight;
+            const ctx = canvas.getContext('2d', { alpha: false });
+            ctx.drawImage(video, 0, 0);
             lastFrameTime = currentTime;
+
+            if (binaryMode) {
+                sendBinaryFrame(canvas);
+            } else {
+                ws.send(canvas.toDataURL('image/jpeg', jpegQuality));
+            }
         }
     } catch (error) {
         console.error('Error sending frame:', error);
@@ -179,9 +204,60 @@ function sendFrame() {
     animationFrameId = requestAnimationFrame(sendFrame);
 }
 
+function sendBinaryFrame(canvas) {
+    sendInFlight = true;
+    const captureTs = Date.now();
+    const width = canvas.width;
+    const height = canvas.height;
+
+    canvas.toBlob(async (blob) => {
+        try {
+            if (!blob || !ws || ws.readyState !== WebSocket.OPEN) return;
+            const payload = new Uint8Array(await blob.arrayBuffer());
+            const message = new Uint8Array(FRAME_HEADER_SIZE + payload.length);
+            const view = new DataView(message.buffer);
+            view.setUint8(0, FRAME_MAGIC[0]);
+            view.setUint8(1, FRAME_MAGIC[1]);
+            view.setUint8(2, FRAME_PROTOCOL_VERSION);
+            view.setUint8(3, CODEC_JPEG);
+            view.setUint32(4, frameId++ >>> 0, true);
+            view.setFloat64(8, captureTs, true);
+            view.setUint16(16, width, true);
+            view.setUint16(18, height, true);
+            message.set(payload, FRAME_HEADER_SIZE);
+            ws.send(message.buffer);
+        } catch (error) {
+            console.error('Error sending binary frame:', error);
+        } finally {
+            sendInFlight = false;
+        }
+    }, 'image/jpeg', jpegQuality);
+}
+
 function handleWsMessage(event) {
     try {
         const data = JSON.parse(event.data);
+
+        if (data.type === 'hello') {
+            binaryMode = data.protocol === 'binary';
+            console.log(`Frame protocol: ${data.protocol}`);
+            return;
+        }
+
+        if (data.type === 'control') {
+            frameInterval = data.send_interval_ms;
+            jpegQuality = data.jpeg_quality;
+            console.log(`Stream quality: one frame every ${frameInterval} ms, JPEG quality ${jpegQuality}`);
+            return;
+        }
+
+        if (data.capture_ts !== undefined) {
+            lastLagMs = Date.now() - data.capture_ts;
+            if (data.frame_id % 50 === 0) {
+                console.debug(`Frame ${data.frame_id}: ${lastLagMs.toFixed(0)} ms end-to-end, ` +
+                    `${data.server_latency_ms} ms on server, ${data.dropped_frames} dropped`);
+            }
+        }
         
         // Update vision state based on received results
         if (data.vision_results) {
@@ -203,6 +279,12 @@ function handleWsMessage(event) {
     }
 }
 
+function visionForFace(analysis, faceIndex) {
+    if (!analysis) return null;
+    if (!Array.isArray(analysis)) return analysis; // whole-frame result
+    return analysis.find(entry => entry.face_index === faceIndex) || null;
+}
+
 function drawResults(results) {
     const offscreenCanvas = document.createElement('canvas');
     offscreenCanvas.width = overlay.width;
@@ -264,11 +346,14 @@ function drawResults(results) {
         // Generate vision analysis text based on available results
         let visionText = '';
         if (vision_results) {
-            if (vision_results.emotion) {
-                visionText = `Emotion: ${vision_results.emotion.emotion} (${(vision_results.emotion.confidence * 100).toFixed(1)}%)`;
-            } else if (vision_results.mask) {
-                const maskStatus = vision_results.mask.wearing_mask ? 'Wearing Mask' : 'No Mask';
-                visionText = `Mask: ${maskStatus} (${(vision_results.mask.confidence * 100).toFixed(1)}%)`;
+            // Emotion and mask come per face, matched by face_index
+            const emotion = visionForFace(vision_results.emotion, index);
+            const mask = visionForFace(vision_results.mask, index);
+            if (emotion) {
+                visionText = `Emotion: ${emotion.emotion} (${(emotion.confidence * 100).toFixed(1)}%)`;
+            } else if (mask) {
+                const maskStatus = mask.wearing_mask ? 'Wearing Mask' : 'No Mask';
+                visionText = `Mask: ${maskStatus} (${(mask.confidence * 100).toFixed(1)}%)`;
             } else if (vision_results.people) {
                 visionText = `People Count: ${vision_results.people.count}`;
             }
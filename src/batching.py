@@ -0,0 +1,132 @@
+import asyncio
+import time
+from collections import Counter, deque
+from concurrent.futures import Executor
+from typing import Any, Callable, List, Optional, Sequence
+
+
+class BatchStats:
+    """Batch-size distribution and per-request latency of a MicroBatcher."""
+
+    def __init__(self, window: int = 1000):
+        self.requests = 0
+        self.batches = 0
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=window)  # seconds, submit -> result
+        self.batch_times = deque(maxlen=window)  # seconds spent in batch_fn
+
+    def record_batch(self, size: int, batch_time: float):
+        self.batches += 1
+        self.requests += size
+        self.batch_sizes[size] += 1
+        self.batch_times.append(batch_time)
+
+    @staticmethod
+    def _percentile(values, q) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def to_dict(self):
+        mean_batch = self.requests / self.batches if self.batches else 0.0
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": round(mean_batch, 2),
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "latency_ms": {
+                f"p{int(q * 100)}": round(value * 1000, 1) if value is not None else None
+                for q, value in ((q, self._percentile(self.latencies, q)) for q in (0.5, 0.95, 0.99))
+            },
+            "mean_batch_time_ms": round(1000 * sum(self.batch_times) / len(self.batch_times), 1)
+            if self.batch_times else None
+        }
+
+
+class MicroBatcher:
+    """
+    Collects single-item requests from every connection and runs them as
+    one batched call.
+
+    A batch is flushed as soon as the executor is free, with every request
+    queued by then (the crops of one frame arrive together). While the
+    previous batch still runs, the next one keeps filling until it reaches
+    `max_batch_size`, the executor frees up or its oldest request has waited
+    `max_wait_ms`; so a single stream pays no wait, and under load batches
+    fill up on their own.
+    `batch_fn` receives a list of items and must return one result per item.
+    """
+
+    def __init__(self, batch_fn: Callable[[Sequence[Any]], List[Any]], executor: Executor,
+                 max_batch_size: int = 8, max_wait_ms: float = 10.0, name: str = "batcher"):
+        self.batch_fn = batch_fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self.stats = BatchStats()
+        self._queue: Optional[asyncio.Queue] = None
+        self._runner: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, item) -> Any:
+        if self._runner is None or self._runner.done():
+            self._queue = asyncio.Queue()
+            self._runner = asyncio.get_event_loop().create_task(self._run())
+
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        running: Optional[asyncio.Future] = None
+        while True:
+            batch = [await self._queue.get()]
+            # Requests submitted together (the crops of one frame) are all queued by now
+            await asyncio.sleep(0)
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                # An idle executor takes the batch at once; only a busy one is worth waiting for
+                timeout = deadline - loop.time()
+                if running is None or running.done() or timeout <= 0:
+                    break
+                getter = asyncio.ensure_future(self._queue.get())
+                await asyncio.wait({getter, running}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    batch.append(getter.result())
+                else:
+                    getter.cancel()
+
+            # Requests cancelled while queued (their frame was answered without them) are not run
+            batch = [entry for entry in batch if not entry[1].done()]
+            if batch:
+                running = asyncio.ensure_future(self._execute(batch))
+
+    async def _execute(self, batch):
+        loop = asyncio.get_event_loop()
+        items = [item for item, _, _ in batch]
+        start = time.perf_counter()
+        try:
+            results = await loop.run_in_executor(self.executor, self.batch_fn, items)
+            if len(results) != len(items):
+                raise RuntimeError(f"{self.name}: batch_fn returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        done = time.perf_counter()
+        self.stats.record_batch(len(items), done - start)
+        for (_, future, submitted), result in zip(batch, results):
+            self.stats.latencies.append(done - submitted)
+            if not future.done():
+                future.set_result(result)
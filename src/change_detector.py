@@ -0,0 +1,102 @@
+import hashlib
+import time
+from typing import Optional, Union
+
+import cv2
+import numpy as np
+
+CHANGED = "changed"
+DUPLICATE = "duplicate"
+STATIC = "static"
+
+
+class ChangeGate:
+    """
+    Cheap per-stream pre-filter in front of decode and detection.
+
+    1. Byte-identical payloads (same JPEG as the last processed one) are
+       skipped from a hash, without decoding anything.
+    2. Otherwise the JPEG is decoded at 1/8 scale in grayscale (libjpeg only
+       reconstructs the low-frequency DCT terms, so this costs a fraction of
+       a full decode) and shrunk to a thumbnail. Its absolute difference
+       with the thumbnail of the last processed frame is averaged over the
+       blocks of a `grid`; when even the most changed block stays below
+       `motion_threshold` (gray levels) the frame is considered static.
+       Scoring the worst block rather than the whole frame keeps a small
+       face entering one corner from being diluted by the static rest.
+
+    Static frames are still let through every `max_static_seconds` so slow
+    changes (lighting, someone standing very still) eventually get processed.
+    """
+
+    def __init__(self, motion_threshold: float = 3.0, max_static_seconds: float = 5.0,
+                 thumb_size=(32, 24), grid=(8, 6), enabled: bool = True):
+        self.enabled = enabled
+        self.motion_threshold = motion_threshold
+        self.max_static_seconds = max_static_seconds
+        self.thumb_size = tuple(thumb_size)
+        self.grid = tuple(grid)
+        self._last_digest: Optional[bytes] = None
+        self._reference: Optional[np.ndarray] = None
+        self._last_pass_time = 0.0
+        self.last_motion_score: Optional[float] = None
+        self.frames = 0
+        self.duplicates = 0
+        self.static = 0
+
+    def check(self, payload: Union[bytes, memoryview], now: Optional[float] = None, can_skip: bool = True) -> str:
+        """
+        Returns CHANGED when the frame should be decoded and processed. With
+        `can_skip` False (the caller has no results to reuse yet) the frame
+        always passes and becomes the reference, and no skip is counted.
+        """
+        self.frames += 1
+        if not self.enabled:
+            return CHANGED
+        now = time.time() if now is None else now
+        must_pass = not can_skip or now - self._last_pass_time >= self.max_static_seconds
+
+        digest = hashlib.blake2b(payload, digest_size=16).digest()
+        if digest == self._last_digest and not must_pass:
+            self.duplicates += 1
+            return DUPLICATE
+
+        thumb = self._thumbnail(payload)
+        if thumb is None:
+            # Let the full decode report the broken frame
+            return CHANGED
+
+        if self._reference is not None and thumb.shape == self._reference.shape:
+            self.last_motion_score = self.motion_score(thumb, self._reference)
+            if self.last_motion_score < self.motion_threshold and not must_pass:
+                self.static += 1
+                return STATIC
+        else:
+            self.last_motion_score = None
+
+        self._last_digest = digest
+        self._reference = thumb
+        self._last_pass_time = now
+        return CHANGED
+
+    def motion_score(self, thumb: np.ndarray, reference: np.ndarray) -> float:
+        """Mean gray-level difference of the most changed block of the grid."""
+        diff = cv2.absdiff(thumb, reference)
+        # Area interpolation down to the grid is the per-block mean
+        return float(cv2.resize(diff, self.grid, interpolation=cv2.INTER_AREA).max())
+
+    def _thumbnail(self, payload) -> Optional[np.ndarray]:
+        small = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if small is None:
+            return None
+        return cv2.resize(small, self.thumb_size, interpolation=cv2.INTER_AREA)
+
+    def stats(self) -> dict:
+        skipped = self.duplicates + self.static
+        return {
+            "frames": self.frames,
+            "duplicates": self.duplicates,
+            "static": self.static,
+            "skip_ratio": round(skipped / self.frames, 3) if self.frames else 0.0,
+            "last_motion_score": None if self.last_motion_score is None else round(self.last_motion_score, 2)
+        }
@@ -1,40 +1,57 @@
 from fastapi import WebSocket
 
-from typing import List
+from typing import Dict, Optional
 import asyncio
 from fastapi.websockets import WebSocketState
-from collections import deque
+
+from src.stream_session import StreamSession
+from src.load_scheduler import CLOSE_TRY_AGAIN_LATER, LoadScheduler, parse_priority
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.frame_buffers = {}
+    def __init__(self, session_config: Optional[dict] = None, scheduler: Optional[LoadScheduler] = None):
+        self.session_config = session_config or {}
+        self.scheduler = scheduler or LoadScheduler(enabled=False)
+        # One StreamSession per socket; dict lookups keep every check O(1)
+        self.active_connections: Dict[WebSocket, StreamSession] = {}
         self._connection_lock = asyncio.Lock()
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket) -> Optional[StreamSession]:
         try:
             await websocket.accept()
+            client = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else None
+            priority = parse_priority(websocket.query_params.get("priority"))
+            if not self.scheduler.admit(priority, len(self.active_connections)):
+                # Accepted first so the client gets the close code instead of a bare HTTP 403
+                await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason="Server overloaded, try again later")
+                print(f"Connection from {client} refused ({priority} priority): server overloaded")
+                return None
+            session = StreamSession(client, self.session_config, priority)
+            self.scheduler.apply(session)
             async with self._connection_lock:
-                self.active_connections.append(websocket)
-                self.frame_buffers[websocket] = deque(maxlen=2)
-            print(f"Client connected. Total connections: {len(self.active_connections)}")
-            return True
+                self.active_connections[websocket] = session
+            print(f"Client connected ({session}). Total connections: {len(self.active_connections)}")
+            return session
         except Exception as e:
             print(f"Error during connection: {e}")
-            return False
+            return None
 
     async def disconnect(self, websocket: WebSocket):
         async with self._connection_lock:
-            if websocket in self.active_connections:
-                self.active_connections.remove(websocket)
-            if websocket in self.frame_buffers:
-                del self.frame_buffers[websocket]
+            session = self.active_connections.pop(websocket, None)
+        if session is not None:
+            session.close()
         try:
             await websocket.close()
         except Exception as e:
             print(f"Error during disconnect: {e}")
         print(f"Client disconnected. Total connections: {len(self.active_connections)}")
 
+    def get_session(self, websocket: WebSocket) -> Optional[StreamSession]:
+        return self.active_connections.get(websocket)
+
+    def stats(self) -> list:
+        return [session.stats() for session in self.active_connections.values()]
+
     async def is_connected(self, websocket: WebSocket) -> bool:
         try:
             return (
@@ -45,16 +62,6 @@ class ConnectionManager:
         except Exception:
             return False
 
-    async def add_frame(self, websocket: WebSocket, frame):
-        if await self.is_connected(websocket):
-            async with self._connection_lock:
-                self.frame_buffers[websocket].append(frame)
-
-    async def get_latest_frame(self, websocket: WebSocket):
-        if websocket in self.frame_buffers and self.frame_buffers[websocket]:
-            return self.frame_buffers[websocket][-1]
-        return None
-
     async def send_json(self, websocket: WebSocket, data: dict):
         if await self.is_connected(websocket):
             try:
@@ -64,4 +71,4 @@ class ConnectionManager:
                 print(f"Error sending JSON: {e}")
                 await self.disconnect(websocket)
                 return False
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import numpy as np
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.face_gallery import ENCODING_SIZE
+
+MANIFEST_VERSION = 1
+
+
+def file_digest(path: Path, chunk_size: int = 1 << 20) -> str:
+    """SHA-1 of the file contents, used to detect real changes behind a new mtime."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EncodingCache:
+    """
+    On-disk store of the face encodings of the dataset.
+
+    Encodings are kept in a float32 `encodings.npy` (read back memory-mapped)
+    and `manifest.json` maps every image, relative to the dataset, to its
+    size, mtime, content hash and row in the matrix. `sync` only encodes
+    images that are new or changed and drops the ones that were deleted.
+    """
+
+    def __init__(self, cache_dir="cache"):
+        self.cache_dir = Path(cache_dir)
+        self.manifest_path = self.cache_dir / "manifest.json"
+        self.encodings_path = self.cache_dir / "encodings.npy"
+
+    def _load(self) -> Tuple[Dict[str, dict], np.ndarray]:
+        empty = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        if not self.manifest_path.exists() or not self.encodings_path.exists():
+            return {}, empty
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") != MANIFEST_VERSION:
+                return {}, empty
+            encodings = np.load(self.encodings_path, mmap_mode="r")
+            return manifest.get("entries", {}), encodings
+        except Exception as e:
+            print(f"Ignoring unreadable encoding cache: {e}")
+            return {}, empty
+
+    def _save(self, entries: Dict[str, dict], encodings: np.ndarray):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Write to temporary files and swap them in so a crash never leaves a half-written cache
+        tmp_encodings = self.encodings_path.with_suffix(".tmp.npy")
+        np.save(tmp_encodings, np.ascontiguousarray(encodings, dtype=np.float32))
+        os.replace(tmp_encodings, self.encodings_path)
+
+        tmp_manifest = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_manifest, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "entries": entries}, f)
+        os.replace(tmp_manifest, self.manifest_path)
+
+    def add(self, dataset_path: Path, items: List[Tuple[str, Path, np.ndarray]]):
+        """
+        Records freshly enrolled images without rescanning the dataset.
+
+        `items` are (person name, image path, encoding) tuples for images that
+        were already encoded by the caller.
+        """
+        if not items:
+            return
+        dataset_path = Path(dataset_path)
+        entries, old_encodings = self._load()
+        rows = [np.array(old_encodings, dtype=np.float32)]
+        next_row = len(rows[0])
+        del old_encodings  # release the memory map before replacing the file
+
+        for name, image_path, encoding in items:
+            stat = image_path.stat()
+            entries[image_path.relative_to(dataset_path).as_posix()] = {
+                "name": name,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha1": file_digest(image_path),
+                "row": next_row,
+            }
+            rows.append(np.asarray(encoding, dtype=np.float32).reshape(1, ENCODING_SIZE))
+            next_row += 1
+
+        self._save(entries, np.concatenate(rows))
+
+    @staticmethod
+    def scan_dataset(dataset_path: Path) -> List[Tuple[str, Path]]:
+        """Lists (person name, image path) for every image of the dataset."""
+        images = []
+        for person_dir in sorted(dataset_path.iterdir()):
+            if person_dir.is_dir() and not person_dir.name.startswith("."):
+                for image_path in sorted(person_dir.glob("*.jpg")):
+                    images.append((person_dir.name, image_path))
+        return images
+
+    def sync(self, dataset_path: Path,
+             encode_fn: Callable[[Path], Optional[np.ndarray]]) -> Tuple[np.ndarray, List[str]]:
+        """
+        Brings the cache in line with the dataset and returns (encodings, names).
+
+        `encode_fn` is only called for images that are not in the cache or whose
+        contents changed. It returns None for images without a usable face;
+        those are remembered too so they are not retried on every start. An
+        image whose `encode_fn` raised is left out of the cache and retried.
+        """
+        dataset_path = Path(dataset_path)
+        old_entries, old_encodings = self._load()
+
+        entries = {}
+        rows = []
+        names = []
+        encoded = reused = 0
+        dirty = False
+
+        for name, image_path in self.scan_dataset(dataset_path):
+            key = image_path.relative_to(dataset_path).as_posix()
+            stat = image_path.stat()
+            entry = old_entries.get(key)
+            encoding = None
+            cached = False
+            digest = None
+
+            if entry is not None and entry["name"] == name:
+                if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                    cached = True
+                else:
+                    digest = file_digest(image_path)
+                    if digest == entry["sha1"]:
+                        cached = True
+                        entry = dict(entry, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                        dirty = True
+
+            if cached:
+                reused += 1
+                if entry["row"] is not None:
+                    encoding = old_encodings[entry["row"]]
+            else:
+                dirty = True
+                encoded += 1
+                try:
+                    encoding = encode_fn(image_path)
+                except Exception as e:
+                    # Not remembered: a transient failure (I/O error, file still being written)
+                    # must be retried on the next sync instead of leaving the image out for good
+                    print(f"Error processing {image_path}: {e}")
+                    continue
+                entry = {
+                    "name": name,
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "sha1": digest or file_digest(image_path),
+                }
+
+            entry = dict(entry, row=None)
+            if encoding is not None:
+                entry["row"] = len(rows)
+                rows.append(np.array(encoding, dtype=np.float32))
+                names.append(name)
+            entries[key] = entry
+
+        removed = len(set(old_entries) - set(entries))
+        if removed:
+            dirty = True
+
+        encodings = (np.stack(rows) if rows
+                     else np.empty((0, ENCODING_SIZE), dtype=np.float32))
+        del old_encodings  # release the memory map before replacing the file
+        if dirty:
+            self._save(entries, encodings)
+
+        print(f"Encoding cache: {reused} reused, {encoded} encoded, {removed} removed")
+        return encodings, names
@@ -0,0 +1,192 @@
+import json
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from src.face_tracker import Box, box_iou
+
+DEFAULT_DETECTOR = {"type": "hog", "upsample": 1}
+
+# Cascade names resolved against the data directory of the installed OpenCV
+CASCADE_FILES = {
+    "haar": "haarcascade_frontalface_default.xml",
+    "haar_alt2": "haarcascade_frontalface_alt2.xml",
+    "lbp": "lbpcascade_frontalface_improved.xml",
+}
+
+
+def _to_box(x: float, y: float, w: float, h: float, width: int, height: int) -> Box:
+    left, top = max(0, int(x)), max(0, int(y))
+    right, bottom = min(width, int(x + w)), min(height, int(y + h))
+    return top, right, bottom, left
+
+
+def dedupe(boxes: List[Box], iou_threshold: float = 0.5) -> List[Box]:
+    """Drops boxes overlapping an earlier one, e.g. a face found from two neighbouring candidates."""
+    kept: List[Box] = []
+    for box in boxes:
+        if all(box_iou(box, other) < iou_threshold for other in kept):
+            kept.append(box)
+    return kept
+
+
+class HogDetector:
+    """dlib HOG through face_recognition; the original detector."""
+
+    name = "hog"
+
+    def __init__(self, upsample: int = 1):
+        import face_recognition
+        self._face_locations = face_recognition.face_locations
+        self.upsample = upsample
+
+    def detect(self, rgb_frame: np.ndarray) -> List[Box]:
+        return self._face_locations(rgb_frame, model="hog", number_of_times_to_upsample=self.upsample)
+
+
+class CascadeDetector:
+    """
+    OpenCV Haar or LBP cascade on the equalized gray frame. Much faster than
+    HOG, less robust to pose and lighting. `cascade` is one of CASCADE_FILES
+    or a path to a cascade XML.
+    """
+
+    name = "cascade"
+
+    def __init__(self, cascade: str = "haar", scale_factor: float = 1.1, min_neighbors: int = 5,
+                 min_size: int = 30):
+        if not hasattr(cv2, "CascadeClassifier"):
+            raise RuntimeError(f"OpenCV {cv2.__version__} has no CascadeClassifier")
+        path = self._resolve(cascade)
+        self._classifier = cv2.CascadeClassifier(str(path))
+        if self._classifier.empty():
+            raise ValueError(f"Could not load cascade {path}")
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = (min_size, min_size)
+
+    @staticmethod
+    def _resolve(cascade: str) -> Path:
+        if cascade not in CASCADE_FILES:
+            path = Path(cascade)
+            if not path.is_file():
+                raise FileNotFoundError(f"Cascade file {cascade} not found")
+            return path
+        data_dir = Path(cv2.data.haarcascades)
+        # pip wheels only ship haarcascades/; LBP files live next to it in source installs
+        for path in (data_dir / CASCADE_FILES[cascade], data_dir.parent / "lbpcascades" / CASCADE_FILES[cascade]):
+            if path.is_file():
+                return path
+        raise FileNotFoundError(f"{CASCADE_FILES[cascade]} is not installed with OpenCV; pass its path as `cascade`")
+
+    def detect(self, rgb_frame: np.ndarray) -> List[Box]:
+        gray = cv2.equalizeHist(cv2.cvtColor(rgb_frame, cv2.COLOR_RGB2GRAY))
+        height, width = gray.shape
+        faces = self._classifier.detectMultiScale(
+            gray, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors, minSize=self.min_size
+        )
+        return [_to_box(x, y, w, h, width, height) for x, y, w, h in faces]
+
+
+class YuNetDetector:
+    """
+    OpenCV DNN face detector (cv2.FaceDetectorYN). Needs a local YuNet ONNX
+    model, e.g. face_detection_yunet_2023mar.onnx from the OpenCV model zoo;
+    nothing is downloaded.
+    """
+
+    name = "yunet"
+
+    def __init__(self, model_path: str, score_threshold: float = 0.8, nms_threshold: float = 0.3,
+                 top_k: int = 50):
+        if not Path(model_path).is_file():
+            raise FileNotFoundError(f"YuNet model {model_path} not found")
+        if not hasattr(cv2, "FaceDetectorYN"):
+            raise RuntimeError(f"OpenCV {cv2.__version__} has no FaceDetectorYN (4.5.4 or later needed)")
+        self._net = cv2.FaceDetectorYN.create(str(model_path), "", (320, 320), score_threshold, nms_threshold, top_k)
+        self._input_size = None
+
+    def detect(self, rgb_frame: np.ndarray) -> List[Box]:
+        height, width = rgb_frame.shape[:2]
+        if self._input_size != (width, height):
+            self._net.setInputSize((width, height))
+            self._input_size = (width, height)
+        _, faces = self._net.detect(cv2.cvtColor(rgb_frame, cv2.COLOR_RGB2BGR))
+        if faces is None:
+            return []
+        return [_to_box(x, y, w, h, width, height) for x, y, w, h in faces[:, :4]]
+
+
+class CoarseToFineDetector:
+    """
+    Finds candidates with a cheap detector on a `coarse_width` copy of the
+    frame, then runs the accurate one only on each candidate's region (grown
+    by `margin` on every side) at full detection resolution. Candidates the
+    fine detector does not confirm are dropped unless `keep_unconfirmed`.
+    """
+
+    name = "coarse_to_fine"
+
+    def __init__(self, coarse: Optional[dict] = None, fine: Optional[dict] = None, coarse_width: int = 320,
+                 margin: float = 0.4, keep_unconfirmed: bool = False):
+        self.coarse = create_detector(**(coarse or {"type": "cascade", "min_size": 20, "min_neighbors": 3}))
+        self.fine = create_detector(**(fine or DEFAULT_DETECTOR))
+        self.coarse_width = coarse_width
+        self.margin = margin
+        self.keep_unconfirmed = keep_unconfirmed
+
+    def detect(self, rgb_frame: np.ndarray) -> List[Box]:
+        height, width = rgb_frame.shape[:2]
+        scale = min(1.0, self.coarse_width / width)
+        small = rgb_frame
+        if scale < 1.0:
+            small = cv2.resize(rgb_frame, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        found: List[Box] = []
+        for top, right, bottom, left in self.coarse.detect(small):
+            top, right, bottom, left = top / scale, right / scale, bottom / scale, left / scale
+            grow_y, grow_x = (bottom - top) * self.margin, (right - left) * self.margin
+            y0, y1 = max(0, int(top - grow_y)), min(height, int(bottom + grow_y))
+            x0, x1 = max(0, int(left - grow_x)), min(width, int(right + grow_x))
+            refined = self.fine.detect(np.ascontiguousarray(rgb_frame[y0:y1, x0:x1]))
+            if refined:
+                found.extend((t + y0, r + x0, b + y0, l + x0) for t, r, b, l in refined)
+            elif self.keep_unconfirmed:
+                found.append((int(top), int(right), int(bottom), int(left)))
+        return dedupe(found)
+
+
+DETECTORS = {
+    HogDetector.name: HogDetector,
+    CascadeDetector.name: CascadeDetector,
+    YuNetDetector.name: YuNetDetector,
+    CoarseToFineDetector.name: CoarseToFineDetector,
+}
+
+
+def create_detector(type: str = "hog", **options):
+    """Builds a detector from a spec of face_recognition.detectors in pipeline_config.yml."""
+    if type not in DETECTORS:
+        raise ValueError(f"Unknown detector '{type}', expected one of {sorted(DETECTORS)}")
+    return DETECTORS[type](**options)
+
+
+# Detectors hold native objects that are not safe to share between threads,
+# so every thread (and every detection worker process) builds its own
+_local = threading.local()
+
+
+def get_detector(spec: Optional[dict] = None):
+    """Detector for `spec`, built once per thread and reused."""
+    spec = spec or DEFAULT_DETECTOR
+    key = json.dumps(spec, sort_keys=True)
+    cache: Dict[str, object] = getattr(_local, "detectors", None)
+    if cache is None:
+        cache = _local.detectors = {}
+    detector = cache.get(key)
+    if detector is None:
+        detector = cache[key] = create_detector(**spec)
+    return detector
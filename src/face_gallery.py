@@ -0,0 +1,163 @@
+import threading
+import numpy as np
+from typing import Any, List, NamedTuple, Optional, Sequence
+
+from src.face_matchers import ExactMatcher, create_matcher
+
+ENCODING_SIZE = 128
+
+
+class GallerySnapshot(NamedTuple):
+    encodings: np.ndarray  # (N, 128) float32, read-only
+    names: np.ndarray      # (N,) object
+    sq_norms: np.ndarray   # (N,) float32
+    index: Any             # matcher state built for exactly these rows
+
+
+class FaceGallery:
+    """
+    Contiguous float32 index of known face encodings.
+
+    Encodings live in a single (N, 128) matrix with the names in a parallel
+    array, so every face in a frame can be matched against the whole gallery
+    with one matrix product instead of a face_distance call per face. Search
+    goes through a matcher (see src/face_matchers.py): exact by default, or
+    an approximate index for very large galleries.
+    """
+
+    def __init__(self, match_threshold: float = 0.6, top_k: int = 1, matcher=None):
+        self.match_threshold = match_threshold
+        self.top_k = top_k
+        self.matcher = matcher or ExactMatcher()
+        # Arrays and matcher index published as one immutable snapshot, so
+        # readers never lock and always see a consistent gallery
+        self._snapshot = self._build([], [])
+        self._write_lock = threading.Lock()
+        self.version = 0  # bumped on every change, lets copies elsewhere know they are stale
+
+    @classmethod
+    def from_config(cls, config: Optional[dict] = None) -> "FaceGallery":
+        """Gallery for face_recognition.matcher in pipeline_config.yml."""
+        options = dict(config or {})
+        threshold = options.pop("threshold", 0.6)
+        top_k = options.pop("top_k", 1)
+        return cls(threshold, top_k, create_matcher(**options))
+
+    def __len__(self):
+        return len(self._snapshot[1])
+
+    @property
+    def encodings(self) -> np.ndarray:
+        return self._snapshot[0]
+
+    @property
+    def names(self) -> np.ndarray:
+        return self._snapshot[1]
+
+    @staticmethod
+    def _arrays(encodings, names):
+        if len(encodings) != len(names):
+            raise ValueError("encodings and names must have the same length")
+
+        matrix = np.ascontiguousarray(
+            np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        )
+        matrix.setflags(write=False)
+        names = np.asarray(list(names), dtype=object)
+        sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+        return matrix, names, sq_norms
+
+    def _build(self, encodings, names) -> GallerySnapshot:
+        snapshot = GallerySnapshot(*self._arrays(encodings, names), None)
+        return snapshot._replace(index=self.matcher.build(snapshot))
+
+    def replace(self, encodings: Sequence[np.ndarray], names: Sequence[str]):
+        """Replaces the whole gallery with the given encodings and names."""
+        snapshot = self._build(encodings, names)
+        with self._write_lock:
+            self._snapshot = snapshot
+            self.version += 1
+
+    def append(self, encodings: Sequence[np.ndarray], names: Sequence[str]):
+        """
+        Adds encodings to the live gallery as one atomic publish.
+
+        The new arrays are built aside and swapped in with a single assignment,
+        so recognitions running meanwhile keep matching against the previous
+        snapshot instead of waiting.
+        """
+        added = self._arrays(encodings, names)
+        with self._write_lock:
+            current = self._snapshot
+            matrix = np.concatenate([current.encodings, added[0]])
+            matrix.setflags(write=False)
+            snapshot = GallerySnapshot(
+                matrix,
+                np.concatenate([current.names, added[1]]),
+                np.concatenate([current.sq_norms, added[2]]),
+                None,
+            )
+            # The matcher only indexes the new rows
+            self._snapshot = snapshot._replace(
+                index=self.matcher.insert(current.index, snapshot, len(current.names))
+            )
+            self.version += 1
+
+    def remove(self, names: Sequence[str]) -> int:
+        """Drops every encoding of the given identities; returns how many were removed."""
+        with self._write_lock:
+            current = self._snapshot
+            keep = ~np.isin(current.names, np.asarray(list(names), dtype=object))
+            removed = int(len(keep) - keep.sum())
+            if removed == 0:
+                return 0
+            matrix = np.ascontiguousarray(current.encodings[keep])
+            matrix.setflags(write=False)
+            snapshot = GallerySnapshot(matrix, current.names[keep], current.sq_norms[keep], None)
+            self._snapshot = snapshot._replace(index=self.matcher.delete(current.index, snapshot, keep))
+            self.version += 1
+            return removed
+
+    def export(self):
+        """Consistent (version, encodings, names) triple, e.g. to ship to worker processes."""
+        with self._write_lock:
+            return self.version, self._snapshot.encodings, list(self._snapshot.names)
+
+    def search(self, face_encodings: Sequence[np.ndarray], top_k: Optional[int] = None, snapshot=None):
+        """Raw matcher output: (row indices, distances), both (num_faces, top_k); -1 / inf pad."""
+        snapshot = snapshot or self._snapshot
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        return self.matcher.search(snapshot, queries, self.top_k if top_k is None else top_k)
+
+    def match(self, face_encodings: Sequence[np.ndarray], top_k: Optional[int] = None,
+              threshold: Optional[float] = None) -> List[List[dict]]:
+        """
+        Matches all faces of a frame against the gallery in one pass.
+
+        Returns, for each query face, up to `top_k` candidates sorted by
+        distance. Each candidate is a dict with `name`, `distance` and
+        `matched` (distance below the threshold).
+        """
+        threshold = self.match_threshold if threshold is None else threshold
+        snapshot = self._snapshot
+        names = snapshot.names
+        num_faces = len(face_encodings)
+        if num_faces == 0:
+            return []
+        if len(names) == 0:
+            return [[] for _ in range(num_faces)]
+
+        candidates, candidate_dists = self.search(face_encodings, top_k, snapshot)
+
+        matches = []
+        for row_idx, row_dists in zip(candidates, candidate_dists):
+            matches.append([
+                {
+                    "name": names[idx],
+                    "distance": float(dist),
+                    "matched": bool(dist < threshold),
+                }
+                for idx, dist in zip(row_idx, row_dists)
+                if idx >= 0
+            ])
+        return matches
@@ -0,0 +1,263 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Gallery rows per block in exact search; bounds the (faces, block) distance matrix
+DEFAULT_BLOCK_SIZE = 8192
+
+
+def squared_distances(queries: np.ndarray, query_sq: np.ndarray, matrix: np.ndarray,
+                      sq_norms: np.ndarray) -> np.ndarray:
+    """(num_queries, num_rows) squared euclidean distances, via ||q||^2 + ||g||^2 - 2 q.g."""
+    sq = query_sq[:, None] + sq_norms[None, :]
+    sq -= 2.0 * (queries @ matrix.T)
+    np.maximum(sq, 0.0, out=sq)
+    return sq
+
+
+def top_k(dists: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Column indices and values of the k smallest entries of every row, sorted."""
+    n = dists.shape[1]
+    k = min(k, n)
+    if k < n:
+        idx = np.argpartition(dists, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.broadcast_to(np.arange(n), dists.shape)
+    values = np.take_along_axis(dists, idx, axis=1)
+    order = np.argsort(values, axis=1)
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+def _pad(rows: List[Tuple[np.ndarray, np.ndarray]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Queries may get fewer than k candidates; missing ones are -1 / inf
+    idx = np.full((len(rows), k), -1, dtype=np.int64)
+    dists = np.full((len(rows), k), np.inf, dtype=np.float32)
+    for i, (row_idx, row_dists) in enumerate(rows):
+        idx[i, :len(row_idx)] = row_idx
+        dists[i, :len(row_dists)] = row_dists
+    return idx, dists
+
+
+def _search_rows(query: np.ndarray, query_sq: np.ndarray, snapshot, rows: np.ndarray, k: int):
+    """Exact top-k of one query restricted to the given gallery rows."""
+    if len(rows) == 0:
+        return rows, np.empty(0, dtype=np.float32)
+    sq = squared_distances(query[None, :], query_sq[None], snapshot.encodings[rows], snapshot.sq_norms[rows])
+    idx, values = top_k(sq, k)
+    return rows[idx[0]], values[0]
+
+
+class ExactMatcher:
+    """
+    Brute force over the whole gallery, in blocks of `block_size` rows so the
+    distance matrix stays small however large the gallery grows. The
+    reference the approximate matchers are measured against.
+    """
+
+    name = "exact"
+
+    def __init__(self, block_size: int = DEFAULT_BLOCK_SIZE):
+        self.block_size = block_size
+
+    def build(self, snapshot) -> Any:
+        return None
+
+    def insert(self, state, snapshot, start: int) -> Any:
+        return None
+
+    def delete(self, state, snapshot, keep: np.ndarray) -> Any:
+        return None
+
+    def search(self, snapshot, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        query_sq = np.einsum("ij,ij->i", queries, queries)
+        best_idx = np.empty((len(queries), 0), dtype=np.int64)
+        best_sq = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(snapshot.encodings), self.block_size):
+            stop = start + self.block_size
+            sq = squared_distances(queries, query_sq, snapshot.encodings[start:stop], snapshot.sq_norms[start:stop])
+            idx, values = top_k(sq, k)
+            # Merge the block's best with the running best
+            best_idx = np.concatenate([best_idx, idx + start], axis=1)
+            best_sq = np.concatenate([best_sq, values], axis=1)
+            keep, best_sq = top_k(best_sq, k)
+            best_idx = np.take_along_axis(best_idx, keep, axis=1)
+        return best_idx, np.sqrt(best_sq)
+
+
+class CentroidMatcher:
+    """
+    Per-identity centroid pre-filter.
+
+    Queries are first compared with the mean encoding of every identity; only
+    the encodings of the `shortlist` closest identities are then searched
+    exactly. Exact whenever the right identity makes the shortlist, and the
+    first pass is as many times cheaper as there are images per person.
+    """
+
+    name = "centroid"
+
+    def __init__(self, shortlist: int = 16):
+        self.shortlist = shortlist
+
+    def build(self, snapshot) -> Dict[str, Any]:
+        identities: Dict[str, int] = {}
+        members: List[List[int]] = []
+        for row, name in enumerate(snapshot.names):
+            i = identities.setdefault(name, len(identities))
+            if i == len(members):
+                members.append([])
+            members[i].append(row)
+        members = [np.asarray(rows, dtype=np.int64) for rows in members]
+        return self._state(identities, members, snapshot)
+
+    @staticmethod
+    def _state(identities, members, snapshot, centroids=None, touched=None) -> Dict[str, Any]:
+        if centroids is None:
+            centroids = np.zeros((len(members), snapshot.encodings.shape[1]), dtype=np.float32)
+            touched = range(len(members))
+        for i in touched:
+            centroids[i] = snapshot.encodings[members[i]].mean(axis=0)
+        return {
+            "identities": identities,
+            "members": members,
+            "centroids": centroids,
+            "centroid_sq": np.einsum("ij,ij->i", centroids, centroids),
+        }
+
+    def insert(self, state, snapshot, start: int) -> Dict[str, Any]:
+        # Only the identities that got new encodings are recomputed
+        identities = dict(state["identities"])
+        members = list(state["members"])
+        touched = set()
+        for row in range(start, len(snapshot.names)):
+            name = snapshot.names[row]
+            i = identities.get(name)
+            if i is None:
+                i = identities[name] = len(members)
+                members.append(np.empty(0, dtype=np.int64))
+            members[i] = np.append(members[i], row)
+            touched.add(i)
+        centroids = np.zeros((len(members), snapshot.encodings.shape[1]), dtype=np.float32)
+        centroids[:len(state["centroids"])] = state["centroids"]
+        return self._state(identities, members, snapshot, centroids, touched)
+
+    def delete(self, state, snapshot, keep: np.ndarray) -> Dict[str, Any]:
+        return self.build(snapshot)
+
+    def search(self, snapshot, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        query_sq = np.einsum("ij,ij->i", queries, queries)
+        state = snapshot.index
+        shortlist, _ = top_k(squared_distances(queries, query_sq, state["centroids"], state["centroid_sq"]),
+                             self.shortlist)
+        rows = []
+        for query, q_sq, identities in zip(queries, query_sq, shortlist):
+            candidates = np.concatenate([state["members"][i] for i in identities])
+            rows.append(_search_rows(query, q_sq, snapshot, candidates, k))
+        idx, sq = _pad(rows, k)
+        return idx, np.sqrt(sq)
+
+
+class IVFMatcher:
+    """
+    Inverted file index: the gallery is clustered with k-means into `n_lists`
+    cells (sqrt(N) by default) and a query only visits the encodings of its
+    `n_probe` closest cells. New encodings go to their nearest cell; the
+    clustering is retrained once the gallery has doubled since the last
+    training. Galleries below `min_train_size` are searched exactly.
+    """
+
+    name = "ivf"
+
+    def __init__(self, n_lists: Optional[int] = None, n_probe: int = 8, train_iterations: int = 10,
+                 min_train_size: int = 1000, seed: int = 0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.train_iterations = train_iterations
+        self.min_train_size = min_train_size
+        self.seed = seed
+        self._exact = ExactMatcher()
+
+    def build(self, snapshot) -> Optional[Dict[str, Any]]:
+        data = snapshot.encodings
+        if len(data) == 0 or len(data) < self.min_train_size:
+            return None
+        n_lists = self.n_lists or max(1, int(round(np.sqrt(len(data)))))
+        rng = np.random.default_rng(self.seed)
+        centroids = data[rng.choice(len(data), n_lists, replace=False)].astype(np.float32)
+        for _ in range(self.train_iterations):
+            assignment = self._assign(data, snapshot.sq_norms, centroids)
+            counts = np.bincount(assignment, minlength=n_lists)
+            sums = np.stack([np.bincount(assignment, weights=data[:, j], minlength=n_lists)
+                             for j in range(data.shape[1])], axis=1)
+            empty = counts == 0
+            centroids = (sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+            # Empty cells restart from random encodings
+            centroids[empty] = data[rng.choice(len(data), int(empty.sum()))]
+        assignment = self._assign(data, snapshot.sq_norms, centroids)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+        lists = [order[bounds[i]:bounds[i + 1]] for i in range(n_lists)]
+        return self._state(centroids, lists, len(data))
+
+    @staticmethod
+    def _state(centroids, lists, trained_size) -> Dict[str, Any]:
+        return {
+            "centroids": centroids,
+            "centroid_sq": np.einsum("ij,ij->i", centroids, centroids),
+            "lists": lists,
+            "trained_size": trained_size,
+        }
+
+    @staticmethod
+    def _assign(data, sq_norms, centroids, block: int = 16384) -> np.ndarray:
+        centroid_sq = np.einsum("ij,ij->i", centroids, centroids)
+        assignment = np.empty(len(data), dtype=np.int64)
+        for start in range(0, len(data), block):
+            sq = squared_distances(data[start:start + block], sq_norms[start:start + block], centroids, centroid_sq)
+            assignment[start:start + block] = sq.argmin(axis=1)
+        return assignment
+
+    def insert(self, state, snapshot, start: int) -> Optional[Dict[str, Any]]:
+        if state is None or len(snapshot.encodings) >= 2 * state["trained_size"]:
+            return self.build(snapshot)
+        new = snapshot.encodings[start:]
+        assignment = self._assign(new, snapshot.sq_norms[start:], state["centroids"])
+        lists = list(state["lists"])
+        for cell in np.unique(assignment):
+            lists[cell] = np.concatenate([lists[cell], start + np.flatnonzero(assignment == cell)])
+        return self._state(state["centroids"], lists, state["trained_size"])
+
+    def delete(self, state, snapshot, keep: np.ndarray) -> Optional[Dict[str, Any]]:
+        if state is None or len(snapshot.encodings) < max(1, self.min_train_size):
+            return None
+        # Rows after a deleted one move up; renumber the lists accordingly
+        new_row = np.cumsum(keep) - 1
+        lists = [new_row[rows[keep[rows]]] for rows in state["lists"]]
+        return self._state(state["centroids"], lists, state["trained_size"])
+
+    def search(self, snapshot, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        state = snapshot.index
+        if state is None:
+            return self._exact.search(snapshot, queries, k)
+        query_sq = np.einsum("ij,ij->i", queries, queries)
+        cells, _ = top_k(squared_distances(queries, query_sq, state["centroids"], state["centroid_sq"]), self.n_probe)
+        rows = []
+        for query, q_sq, query_cells in zip(queries, query_sq, cells):
+            candidates = np.concatenate([state["lists"][cell] for cell in query_cells])
+            rows.append(_search_rows(query, q_sq, snapshot, candidates, k))
+        idx, sq = _pad(rows, k)
+        return idx, np.sqrt(sq)
+
+
+MATCHERS = {
+    ExactMatcher.name: ExactMatcher,
+    CentroidMatcher.name: CentroidMatcher,
+    IVFMatcher.name: IVFMatcher,
+}
+
+
+def create_matcher(type: str = "exact", **options):
+    """Builds the matcher selected under face_recognition.matcher in pipeline_config.yml."""
+    if type not in MATCHERS:
+        raise ValueError(f"Unknown matcher '{type}', expected one of {sorted(MATCHERS)}")
+    return MATCHERS[type](**options)
@@ -1,18 +1,82 @@
-import cv2
 import face_recognition
-import numpy as np
 import time
 import threading
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.face_detectors import DEFAULT_DETECTOR, get_detector
+from src.frame_context import as_context
+from src.face_tracker import FaceTracker, select_for_encoding
+from src.metrics import FACES_DETECTED, FACES_ENCODED, time_stage
+
+
+@dataclass
+class DetectionJob:
+    """A keyframe to detect and identify, plus the tracks it is checked against."""
+    rgb_frame: np.ndarray  # downscaled RGB frame used for detection
+    scale: float
+    tracked: List[Tuple[tuple, bool]]  # FaceTracker.snapshot()
+    iou_threshold: float
+    detector: Optional[dict] = None  # face_detectors spec, HOG when None
+
+
+def identity_from_match(candidates) -> dict:
+    name = "Unknown"
+    access_status = "DENIED"
+    confidence = 0  # Set to 0 for unknown faces
+    if candidates and candidates[0]["matched"]:
+        name = candidates[0]["name"]
+        access_status = "AUTHORIZED"
+        # Calculate confidence percentage (face_distance of 0 = 100% match, 1 = 0% match)
+        confidence = (1 - candidates[0]["distance"]) * 100
+    return {"name": name, "status": access_status, "confidence": confidence}
+
+
+def detect_and_identify(job: DetectionJob, gallery) -> Tuple[List[tuple], List[Optional[dict]]]:
+    """
+    Detects faces on the job frame and identifies the ones that need it.
+
+    Returns full-frame boxes and, for each of them, a fresh identity or None
+    when the associated track's cached identity is still valid. Pure function
+    of its inputs so it can run in a thread or in a detection worker process.
+    """
+    rgb_frame, scale = job.rgb_frame, job.scale
+    with time_stage("detect"):
+        face_locations = get_detector(job.detector).detect(rgb_frame)
+    FACES_DETECTED.inc(amount=len(face_locations))
+    boxes = [tuple(int(v / scale) for v in location) for location in face_locations]
+
+    # Only faces that are new, lost or due for re-verification are encoded
+    needs_encoding = select_for_encoding(boxes, job.tracked, job.iou_threshold)
+    to_encode = [location for location, needed in zip(face_locations, needs_encoding) if needed]
+    face_encodings = []
+    if to_encode:
+        with time_stage("encode"):
+            face_encodings = face_recognition.face_encodings(rgb_frame, to_encode, num_jitters=1)
+        FACES_ENCODED.inc(amount=len(to_encode))
+
+    # Match every face of the frame against the whole gallery in one pass
+    with time_stage("match"):
+        matches = iter(gallery.match(face_encodings))
+    identities = [identity_from_match(next(matches)) if needed else None for needed in needs_encoding]
+    return boxes, identities
+
 
 class FaceProcessor:
-    def __init__(self):
+    def __init__(self, verify_interval=2.0, use_optical_flow=True):
         self.last_processed_time = 0
         self.processing_interval = 0.2  # Process every 200ms
+        self.max_width = 640  # Frames are downscaled to this width before detection
+        self.detector = DEFAULT_DETECTOR  # spec passed to face_detectors.get_detector
+        self.tracking_detection_interval = 1.0  # Detect less often while faces are being tracked
         self.last_results = []
         self.processing = False
         self.frame_skip = 2  # Process every nth frame
         self.frame_count = 0
         self.processing_lock = threading.Lock()
+        self.tracker = FaceTracker(verify_interval=verify_interval, use_optical_flow=use_optical_flow)
 
     def should_process_frame(self):
         current_time = time.time()
@@ -20,8 +84,10 @@ class FaceProcessor:
         
         if self.processing:
             return False
-            
-        if (current_time - self.last_processed_time) < self.processing_interval:
+
+        # Optical flow keeps tracked boxes up to date, so full detection can wait longer
+        interval = self.tracking_detection_interval if self.tracker.active else self.processing_interval
+        if (current_time - self.last_processed_time) < interval:
             return False
             
         if self.frame_count % self.frame_skip != 0:
@@ -29,65 +95,57 @@ class FaceProcessor:
             
         return True
 
-    def process_frame(self, frame, known_face_encodings, known_face_names):
-        if not self.should_process_frame():
-            return self.last_results
+    def begin(self, frame) -> Tuple[Optional[list], Optional[DetectionJob]]:
+        """
+        First half of process_frame. Returns (results, None) when the frame
+        needs no detection, or (None, job) for a keyframe; in that case the
+        processor stays busy until `complete` or `abort` is called. `frame`
+        is a FrameContext or a bare BGR array.
+        """
+        frame = as_context(frame)
+        detect = self.should_process_frame()
 
         with self.processing_lock:
             if self.processing:
-                return self.last_results
+                return self.last_results, None
             self.processing = True
 
         try:
+            if not detect:
+                # Intermediate frame: move the tracked boxes, no detection nor encoding
+                self.last_results = self.tracker.propagate(frame)
+                self.processing = False
+                return self.last_results, None
+
             # Resize frame for faster processing
-            frame_height, frame_width = frame.shape[:2]
-            scale = 1.0
-            if frame_width > 640:
-                scale = 640 / frame_width
-                frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale)
-
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            face_locations = face_recognition.face_locations(rgb_frame, model="hog", number_of_times_to_upsample=1)
-            
-            if not face_locations:
-                self.last_results = []
-                return []
+            with time_stage("resize"):
+                rgb_frame, scale = frame.small_rgb(self.max_width)
+            return None, DetectionJob(rgb_frame, scale, self.tracker.snapshot(), self.tracker.iou_threshold,
+                                      self.detector)
+        except Exception:
+            self.processing = False
+            raise
 
-            face_encodings = face_recognition.face_encodings(rgb_frame, face_locations, num_jitters=1)
-            
-            results = []
-            for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
-                if len(known_face_encodings) > 0:
-                    face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
-                    best_match_index = np.argmin(face_distances)
-                    
-                    # Calculate confidence percentage (face_distance of 0 = 100% match, 1 = 0% match)
-                    confidence = (1 - face_distances[best_match_index]) * 100
-
-                    if face_distances[best_match_index] < 0.6:
-                        name = known_face_names[best_match_index]
-                        access_status = "AUTHORIZED"
-                    else:
-                        name = "Unknown"
-                        access_status = "DENIED"
-                        confidence = 0  # Set to 0 for unknown faces
-
-                if scale != 1.0:
-                    top = int(top / scale)
-                    right = int(right / scale)
-                    bottom = int(bottom / scale)
-                    left = int(left / scale)
-
-                results.append({
-                    "location": (top, right, bottom, left),
-                    "name": name,
-                    "status": access_status,
-                    "confidence": round(confidence, 1)  # Round to 1 decimal place
-                })
-
-            self.last_results = results
+    def complete(self, frame, boxes: Sequence[tuple], identities: Sequence[Optional[dict]]) -> list:
+        """Second half of process_frame: folds a detection pass into the tracks."""
+        try:
+            self.last_results = self.tracker.update(as_context(frame), boxes, identities)
             self.last_processed_time = time.time()
-            return results
-
+            return self.last_results
         finally:
-            self.processing = False
\ No newline at end of file
+            self.processing = False
+
+    def abort(self):
+        self.processing = False
+
+    def process_frame(self, frame, gallery):
+        frame = as_context(frame)
+        results, job = self.begin(frame)
+        if job is None:
+            return results
+        try:
+            boxes, identities = detect_and_identify(job, gallery)
+        except Exception:
+            self.abort()
+            raise
+        return self.complete(frame, boxes, identities)
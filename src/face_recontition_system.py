@@ -7,98 +7,220 @@ from typing import List
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 import threading
-
-import os
-from datetime import datetime
+import time
 
 from src.face_processor import FaceProcessor
-
-# DEFINE EL DIRECTORIO BASE PARA LOS LOGS
-LOG_DIR = "logs"
-os.makedirs(LOG_DIR, exist_ok=True)
+from src.face_detectors import DEFAULT_DETECTOR, create_detector
+from src.frame_context import FrameContext, as_context
+from src.face_gallery import FaceGallery
+from src.encoding_cache import EncodingCache
+from src.shared_gallery import SharedGalleryStore
+from src.recognition_logger import RecognitionLogWriter
+from src.metrics import time_stage
 
 class FaceRecognitionSystem:
-    def __init__(self, dataset_path="dataset"):
+    def __init__(self, dataset_path="dataset", cache_path="cache", engine="thread", workers=4,
+                 load_on_init=True, log_config=None, matcher_config=None, shared_gallery=None,
+                 detector=None, detectors=None, detection_timeout=10.0):
         self.dataset_path = Path(dataset_path)
         self.dataset_path.mkdir(exist_ok=True)
-        self.known_face_encodings = []
-        self.known_face_names = []
+        self.gallery = FaceGallery.from_config(matcher_config)
+        self.encoding_cache = EncodingCache(cache_path)
+        # Named detector specs streams can pick from; the unusable ones are left out
+        self.detectors = self._usable_detectors(detectors or {"hog": DEFAULT_DETECTOR})
+        self.default_detector = detector if detector in self.detectors else None
         self.face_processor = FaceProcessor()
+        self.face_processor.detector = self.detector_spec(None)[1]
         self.executor = ThreadPoolExecutor(max_workers=2)
+        self.enrollment_executor = ThreadPoolExecutor(max_workers=1)
         self.encoding_lock = threading.Lock()
-        self.detected_users = set()  # TRACK USERS WHOSE IMAGES ARE ALREADY LOGGED
-        self.load_known_faces()
+        # With several server workers the gallery lives in a memory-mapped segment they all attach to
+        self.shared_store = SharedGalleryStore(**shared_gallery) if shared_gallery is not None else None
+        self.gallery_generation = 0
+        # Recognition snapshots are encoded and written by a background thread
+        self.log_writer = RecognitionLogWriter(**(log_config or {}))
+        # Optional multi-process detection/encoding; None keeps it on self.executor
+        self.detection_engine = None
+        if engine == "process":
+            from src.process_engine import ProcessDetectionEngine
+            self.detection_engine = ProcessDetectionEngine(num_workers=workers, matcher_config=matcher_config)
+        # Longest wait for a worker's answer before the stream gives up on that keyframe
+        self.detection_timeout = detection_timeout
+        self.ready = False  # True once the gallery has been loaded
+        if load_on_init:
+            self.load_known_faces()
 
     def load_known_faces(self):
         print("Loading known faces...")
-        with self.encoding_lock:
-            temp_encodings = []
-            temp_names = []
-
-            for person_dir in self.dataset_path.iterdir():
-                if person_dir.is_dir():
-                    name = person_dir.name
-                    for image_path in person_dir.glob("*.jpg"):
-                        try:
-                            face_image = face_recognition.load_image_file(str(image_path))
-                            face_encoding = face_recognition.face_encodings(face_image)[0]
-                            temp_encodings.append(face_encoding)
-                            temp_names.append(name)
-                            print(f"Loaded face for: {name}")
-                        except Exception as e:
-                            print(f"Error processing {image_path}: {e}")
-
-            self.known_face_encodings = temp_encodings
-            self.known_face_names = temp_names
-
-        print(f"Loaded {len(self.known_face_names)} face(s)")
-
-    # NUEVO MÉTODO: GUARDA LA IMAGEN RECONOCIDA JUNTO CON LA HORA Y EL DÍA EN EL SISTEMA DE LOGS
-    def save_recognition_log(self, frame, name, location):
-        """Guarda la imagen reconocida junto con la hora y el día en el sistema de logs."""
-        try:
-            # OBTENER TIMESTAMP ACTUAL
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            # CREAR CARPETA PARA EL USUARIO
-            user_log_dir = os.path.join(LOG_DIR, name)
-            full_log_dir = os.path.join(user_log_dir, "full")
-            face_log_dir = os.path.join(user_log_dir, "face")
+        with self._cache_lock():
+            # Only new or changed images are encoded, the rest come from the on-disk cache
+            encodings, names = self.encoding_cache.sync(self.dataset_path, self._encode_image)
+            if self.shared_store is None:
+                self.gallery.replace(encodings, names)
+            else:
+                # The first worker to get here publishes; the others find the same contents
+                self.shared_store.publish_if_changed(encodings, names)
+        if self.shared_store is not None:
+            self._attach_shared_gallery()
+        self.ready = True
 
-            os.makedirs(full_log_dir, exist_ok=True)
-            os.makedirs(face_log_dir, exist_ok=True)
+        print(f"Loaded {len(self.gallery)} face(s)")
 
-            # EXTRAER LA REGIÓN DE LA CARA
-            top, right, bottom, left = location
-            face_image = frame[top:bottom, left:right]
+    async def load_known_faces_async(self):
+        """Loads the gallery on the enrollment thread so server startup is not blocked."""
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self.enrollment_executor, self.load_known_faces)
 
-            # GUARDAR LA IMAGEN COMPLETA Y LA REGIÓN DE LA CARA
-            image_path = os.path.join(full_log_dir, f"{timestamp}_full.jpg")
-            face_image_path = os.path.join(face_log_dir, f"{timestamp}_face.jpg")
+    async def wait_ready(self, timeout: float = 30.0) -> bool:
+        """Waits for the startup gallery load; False if it is still running after `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        while not self.ready and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        return self.ready
 
-            cv2.imwrite(image_path, frame)
-            cv2.imwrite(face_image_path, face_image)
+    @staticmethod
+    def _usable_detectors(presets: dict) -> dict:
+        usable = {}
+        for name, spec in presets.items():
+            try:
+                create_detector(**spec)
+                usable[name] = spec
+            except Exception as e:
+                print(f"Face detector '{name}' unavailable: {e}")
+        return usable
 
-            print(f"Logged recognition for {name} at {timestamp}")
-        except Exception as e:
-            print(f"Error saving log for {name}: {e}")
+    def detector_spec(self, name=None):
+        """(name, spec) of the requested detector preset, or of the default one."""
+        if name in self.detectors:
+            return name, self.detectors[name]
+        if name is not None:
+            print(f"Unknown face detector '{name}', using the default")
+        if self.default_detector is not None:
+            return self.default_detector, self.detectors[self.default_detector]
+        return "hog", DEFAULT_DETECTOR
+
+    def _cache_lock(self):
+        # The encoding cache is shared by all workers when the gallery is, so they
+        # serialize on the store's file lock instead of this process's lock
+        return self.shared_store.lock() if self.shared_store is not None else self.encoding_lock
+
+    def _attach_shared_gallery(self):
+        """Switches the gallery to the current shared generation, if it is not already on it."""
+        generation = self.shared_store.generation()
+        if generation == self.gallery_generation:
+            return
+        generation, encodings, names = self.shared_store.load()
+        # The memory-mapped encodings are used in place, only the matcher index is per worker
+        self.gallery.replace(encodings, names)
+        self.gallery_generation = generation
+        print(f"Attached to shared gallery generation {generation} ({len(names)} face(s))")
 
-    async def process_frame(self, frame):
+    async def follow_shared_gallery(self):
+        """Picks up generations published by other workers (enrollments, removals)."""
+        if self.shared_store is None:
+            return
         loop = asyncio.get_event_loop()
-        results = await loop.run_in_executor(
-            self.executor,
-            self.face_processor.process_frame,
-            frame,
-            self.known_face_encodings,
-            self.known_face_names
-        )
-
-        # NUEVA LÓGICA: SOLO GUARDAR IMÁGENES LA PRIMERA VEZ QUE SE DETECTA A UN USUARIO AUTORIZADO
+        while True:
+            await asyncio.sleep(self.shared_store.poll_interval)
+            if self.ready and self.shared_store.generation() != self.gallery_generation:
+                try:
+                    # Same thread as enrollment, so a worker never attaches halfway through its own change
+                    await loop.run_in_executor(self.enrollment_executor, self._attach_shared_gallery)
+                except Exception as e:
+                    print(f"Error attaching to the shared gallery: {e}")
+
+    @staticmethod
+    def _encode_image(image_path):
+        face_image = face_recognition.load_image_file(str(image_path))
+        face_encodings = face_recognition.face_encodings(face_image)
+        if not face_encodings:
+            print(f"No face found in {image_path}")
+            return None
+        print(f"Loaded face for: {image_path.parent.name}")
+        return face_encodings[0]
+
+    @property
+    def known_face_encodings(self):
+        return self.gallery.encodings
+
+    @property
+    def known_face_names(self):
+        return self.gallery.names
+
+    async def process_frame(self, frame, session=None):
+        # Each stream throttles and tracks with its own FaceProcessor; the gallery is shared
+        face_processor = session.face_processor if session is not None else self.face_processor
+        frame = as_context(frame)
+        if self.detection_engine is not None:
+            results = await self._process_with_engine(face_processor, frame)
+        else:
+            loop = asyncio.get_event_loop()
+            results = await loop.run_in_executor(
+                self.executor,
+                face_processor.process_frame,
+                frame,
+                self.gallery
+            )
+
+        # GUARDAR IMÁGENES DE LOS USUARIOS AUTORIZADOS (una vez por ventana de tiempo y usuario)
         for result in results:
-            if result['status'] == "AUTHORIZED" and result['name'] not in self.detected_users:
-                self.save_recognition_log(frame, result['name'], result['location'])
-                self.detected_users.add(result['name'])
+            if result['status'] == "AUTHORIZED":
+                self.log_writer.submit(frame.bgr, result['name'], result['location'])
         return results
 
+    async def _process_with_engine(self, face_processor, frame):
+        # Shielded: when the face deadline cancels the frame, begin -> complete still
+        # runs to the end, otherwise the processor would stay `processing` and never
+        # detect again
+        return await asyncio.shield(self._engine_round_trip(face_processor, frame))
+
+    async def _engine_round_trip(self, face_processor, frame):
+        loop = asyncio.get_event_loop()
+        results, job = await loop.run_in_executor(self.executor, face_processor.begin, frame)
+        if job is None:
+            return results
+        try:
+            # Detect, encode and match happen in the worker; the parent sees the round trip
+            with time_stage("detect_remote"):
+                boxes, identities = await asyncio.wait_for(
+                    self.detection_engine.submit(job, self.gallery), self.detection_timeout
+                )
+            # Views of its own: a cancelled frame may finish after newer frames reused its FrameBuffers
+            frame = FrameContext(as_context(frame).bgr)
+            return await loop.run_in_executor(self.executor, face_processor.complete, frame, boxes, identities)
+        except BaseException:
+            face_processor.abort()
+            raise
+
+    def close(self):
+        if self.detection_engine is not None:
+            self.detection_engine.close()
+        self.executor.shutdown(wait=False)
+        self.enrollment_executor.shutdown(wait=False)
+        self.log_writer.close()
+
+    def _prepare_enrollment_image(self, content: bytes, idx: int, image_path: Path):
+        """Validates one uploaded image, writes it to disk and returns its encoding."""
+        nparr = np.frombuffer(content, np.uint8)
+        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+        if img is None:
+            raise HTTPException(status_code=400, detail=f"Could not decode image {idx+1}")
+
+        rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        face_locations = face_recognition.face_locations(rgb_img)
+
+        if len(face_locations) != 1:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Image {idx+1} contains {len(face_locations)} faces. Each image must contain exactly one face."
+            )
+
+        # Reuse the location found above instead of detecting the face a second time
+        face_encoding = face_recognition.face_encodings(rgb_img, face_locations)[0]
+        cv2.imwrite(str(image_path), img)
+        return face_encoding
+
     async def add_user(self, username: str, images: List[UploadFile]):
         user_path = self.dataset_path / username
         if user_path.exists():
@@ -106,30 +228,33 @@ class FaceRecognitionSystem:
         
         temp_path = self.dataset_path / f"temp_{username}"
         temp_path.mkdir(parents=True)
+        loop = asyncio.get_event_loop()
         
         try:
+            file_names = []
+            encodings = []
             for idx, image in enumerate(images):
                 content = await image.read()
-                nparr = np.frombuffer(content, np.uint8)
-                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                
-                if img is None:
-                    raise HTTPException(status_code=400, detail=f"Could not decode image {idx+1}")
-                
-                rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                face_locations = face_recognition.face_locations(rgb_img)
-                
-                if len(face_locations) != 1:
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"Image {idx+1} contains {len(face_locations)} faces. Each image must contain exactly one face."
-                    )
-                
-                image_path = temp_path / f"{username}_{idx+1}.jpg"
-                cv2.imwrite(str(image_path), img)
+                file_name = f"{username}_{idx+1}.jpg"
+                # Detection and encoding run off the event loop so connected cameras keep streaming
+                encoding = await loop.run_in_executor(
+                    self.enrollment_executor,
+                    self._prepare_enrollment_image,
+                    content,
+                    idx,
+                    temp_path / file_name
+                )
+                file_names.append(file_name)
+                encodings.append(encoding)
             
             temp_path.rename(user_path)
-            self.load_known_faces()
+            await loop.run_in_executor(
+                self.enrollment_executor,
+                self._record_enrollment,
+                username,
+                [user_path / file_name for file_name in file_names],
+                encodings
+            )
             return {"message": f"Successfully added user {username}"}
             
         except Exception as e:
@@ -138,3 +263,45 @@ class FaceRecognitionSystem:
                 shutil.rmtree(temp_path)
             raise e
 
+    def _record_enrollment(self, username, image_paths, encodings):
+        with self._cache_lock():
+            self.encoding_cache.add(
+                self.dataset_path,
+                [(username, image_path, encoding) for image_path, encoding in zip(image_paths, encodings)]
+            )
+            if self.shared_store is not None:
+                # Built on the latest generation, which may already hold other workers' enrollments
+                _, current, names = self.shared_store.load()
+                self.shared_store.publish(
+                    np.concatenate([current, np.asarray(encodings, dtype=np.float32).reshape(-1, current.shape[1])]),
+                    list(names) + [username] * len(encodings)
+                )
+        if self.shared_store is not None:
+            self._attach_shared_gallery()
+            print(f"Added {len(encodings)} face(s) for {username}")
+            return
+        # Recognitions in flight keep using the previous snapshot until this returns
+        self.gallery.append(encodings, [username] * len(encodings))
+        print(f"Added {len(encodings)} face(s) for {username}")
+
+    async def remove_user(self, username: str):
+        user_path = self.dataset_path / username
+        if not user_path.is_dir() or user_path.parent != self.dataset_path:
+            raise HTTPException(status_code=404, detail="User not found")
+        # Stop recognizing the user right away; the files and the cache follow off the event loop
+        removed = self.gallery.remove([username])
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self.enrollment_executor, self._delete_enrollment, user_path)
+        return {"message": f"Successfully removed user {username}", "encodings_removed": removed}
+
+    def _delete_enrollment(self, user_path: Path):
+        import shutil
+        shutil.rmtree(user_path)
+        with self._cache_lock():
+            # Nothing left to encode: the sync only drops the entries of the deleted files
+            encodings, names = self.encoding_cache.sync(self.dataset_path, self._encode_image)
+            if self.shared_store is not None:
+                self.shared_store.publish(encodings, names)
+        if self.shared_store is not None:
+            self._attach_shared_gallery()
+        print(f"Removed {user_path.name} from the dataset")
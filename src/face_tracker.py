@@ -0,0 +1,244 @@
+import cv2
+import numpy as np
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+from src.frame_context import as_context
+
+Box = Tuple[int, int, int, int]  # (top, right, bottom, left), face_recognition order
+
+
+def box_iou(a: Sequence[float], b: Sequence[float]) -> float:
+    top, right, bottom, left = max(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0.0, right - left) * max(0.0, bottom - top)
+    if inter <= 0:
+        return 0.0
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+def _centroid_close(a: Sequence[float], b: Sequence[float]) -> bool:
+    """True when the centres are closer than half the size of the smaller box."""
+    ay, ax = (a[0] + a[2]) / 2, (a[1] + a[3]) / 2
+    by, bx = (b[0] + b[2]) / 2, (b[1] + b[3]) / 2
+    size = min(a[1] - a[3], b[1] - b[3], a[2] - a[0], b[2] - b[0])
+    return (ay - by) ** 2 + (ax - bx) ** 2 < (size / 2) ** 2
+
+
+def associate(detections: Sequence[Box], tracked: Sequence[Box],
+              iou_threshold: float = 0.3) -> List[Tuple[int, int]]:
+    """
+    Greedy one-to-one association of detections to tracked boxes.
+
+    Pairs are taken by decreasing IoU; pairs without enough overlap are still
+    accepted when their centroids are close, which covers fast moves between
+    two detections. Returns (detection index, track index) pairs.
+    """
+    candidates = []
+    for d, det in enumerate(detections):
+        for t, box in enumerate(tracked):
+            iou = box_iou(det, box)
+            if iou >= iou_threshold or _centroid_close(det, box):
+                candidates.append((iou, d, t))
+    candidates.sort(reverse=True)
+
+    pairs = []
+    used_d, used_t = set(), set()
+    for _, d, t in candidates:
+        if d not in used_d and t not in used_t:
+            pairs.append((d, t))
+            used_d.add(d)
+            used_t.add(t)
+    return pairs
+
+
+def select_for_encoding(boxes: Sequence[Box], tracked: Sequence[Tuple[Box, bool]],
+                        iou_threshold: float = 0.3) -> List[bool]:
+    """
+    Tells, for each detected box, whether its identity has to be (re)computed.
+
+    `tracked` holds (box, fresh) for every known track, as returned by
+    `FaceTracker.snapshot`; a detection associated to a fresh track reuses
+    the cached identity. Plain data in and out, so detection workers in other
+    processes can apply the same rule.
+    """
+    needs = [True] * len(boxes)
+    for d, t in associate(boxes, [box for box, _ in tracked], iou_threshold):
+        needs[d] = not tracked[t][1]
+    return needs
+
+
+@dataclass
+class Track:
+    track_id: int
+    box: np.ndarray  # float (top, right, bottom, left) in full frame coordinates
+    name: str = "Unknown"
+    status: str = "DENIED"
+    confidence: float = 0.0
+    last_verified: float = 0.0
+    misses: int = 0
+    points: Optional[np.ndarray] = field(default=None, repr=False)
+
+    def to_result(self) -> dict:
+        top, right, bottom, left = (int(round(v)) for v in self.box)
+        return {
+            "location": (top, right, bottom, left),
+            "name": self.name,
+            "status": self.status,
+            "confidence": round(self.confidence, 1),
+            "track_id": self.track_id
+        }
+
+
+class FaceTracker:
+    """
+    Per-stream face tracker.
+
+    Detections are associated to existing tracks by IoU/centroid so a known
+    face keeps its identity without being encoded again; identities are only
+    re-verified every `verify_interval` seconds or when the track is lost.
+    Between detections, boxes are moved with sparse Lucas-Kanade optical flow
+    on a small grayscale frame.
+    """
+
+    def __init__(self, iou_threshold=0.3, verify_interval=2.0, max_misses=2,
+                 use_optical_flow=True, flow_width=320):
+        self.iou_threshold = iou_threshold
+        self.verify_interval = verify_interval
+        self.max_misses = max_misses
+        self.use_optical_flow = use_optical_flow
+        self.flow_width = flow_width
+        self.tracks: List[Track] = []
+        self._next_id = 1
+        self._prev_gray = None
+        self._flow_scale = 1.0
+
+    @property
+    def active(self) -> bool:
+        return any(track.misses == 0 for track in self.tracks)
+
+    def reset(self):
+        self.tracks = []
+        self._prev_gray = None
+
+    def snapshot(self, now: Optional[float] = None) -> List[Tuple[Box, bool]]:
+        """(box, identity still fresh) for every track, in track order."""
+        now = time.time() if now is None else now
+        return [
+            (tuple(float(v) for v in track.box), now - track.last_verified < self.verify_interval)
+            for track in self.tracks
+        ]
+
+    def needs_encoding(self, boxes: Sequence[Box], now: Optional[float] = None) -> List[bool]:
+        """Tells, for each detected box, whether its identity has to be (re)computed."""
+        return select_for_encoding(boxes, self.snapshot(now), self.iou_threshold)
+
+    def update(self, frame, boxes: Sequence[Box], identities: Sequence[Optional[dict]],
+               now: Optional[float] = None) -> List[dict]:
+        """
+        Applies a detection pass. `identities[i]` is the fresh result for
+        `boxes[i]` (name/status/confidence) or None when the cached identity
+        of the associated track should be kept.
+        """
+        now = time.time() if now is None else now
+        pairs = dict(associate(boxes, [track.box for track in self.tracks], self.iou_threshold))
+        seen = set()
+        updated = []
+
+        for d, box in enumerate(boxes):
+            t = pairs.get(d)
+            if t is None:
+                track = Track(track_id=self._next_id, box=np.asarray(box, dtype=np.float32))
+                self._next_id += 1
+            else:
+                track = self.tracks[t]
+                track.box = np.asarray(box, dtype=np.float32)
+                track.misses = 0
+                seen.add(t)
+
+            identity = identities[d]
+            if identity is not None:
+                track.name = identity["name"]
+                track.status = identity["status"]
+                track.confidence = identity["confidence"]
+                track.last_verified = now
+            updated.append(track)
+
+        # Keep unmatched tracks a little while in case the detector flickered
+        for t, track in enumerate(self.tracks):
+            if t not in seen:
+                track.misses += 1
+                if track.misses <= self.max_misses:
+                    updated.append(track)
+        self.tracks = updated
+
+        if self.use_optical_flow:
+            self._prev_gray = self._small_gray(frame)
+            for track in self.tracks:
+                track.points = self._sample_points(self._prev_gray, track.box)
+
+        return self.results()
+
+    def propagate(self, frame) -> List[dict]:
+        """Moves the visible tracks to the current frame without detecting."""
+        if not self.use_optical_flow or self._prev_gray is None or not self.active:
+            return self.results()
+
+        gray = self._small_gray(frame)
+        if gray.shape != self._prev_gray.shape:
+            return self.results()
+
+        visible = [track for track in self.tracks if track.misses == 0 and track.points is not None]
+        if not visible:
+            return self.results()
+
+        prev_points = np.concatenate([track.points for track in visible]).reshape(-1, 1, 2)
+        next_points, status, _ = cv2.calcOpticalFlowPyrLK(
+            self._prev_gray, gray, prev_points, None, winSize=(15, 15), maxLevel=2
+        )
+        status = status.reshape(-1).astype(bool)
+        prev_points = prev_points.reshape(-1, 2)
+        next_points = next_points.reshape(-1, 2)
+
+        offset = 0
+        for track in visible:
+            count = len(track.points)
+            ok = status[offset:offset + count]
+            moved = next_points[offset:offset + count][ok]
+            if len(moved) < 3:
+                # Lost: hide it until the next detection re-acquires and re-verifies it
+                track.misses += 1
+                track.points = None
+            else:
+                dx, dy = np.median(moved - prev_points[offset:offset + count][ok], axis=0) / self._flow_scale
+                track.box += np.array([dy, dx, dy, dx], dtype=np.float32)
+                track.points = moved
+            offset += count
+
+        self._prev_gray = gray
+        return self.results()
+
+    def results(self) -> List[dict]:
+        return [track.to_result() for track in self.tracks if track.misses == 0]
+
+    def _small_gray(self, frame):
+        # The FrameContext shares the view (and its buffer) with other consumers of the frame
+        gray, self._flow_scale = as_context(frame).small_gray(self.flow_width)
+        return gray
+
+    def _sample_points(self, gray, box) -> Optional[np.ndarray]:
+        top, right, bottom, left = (int(v * self._flow_scale) for v in box)
+        top, left = max(top, 0), max(left, 0)
+        bottom, right = min(bottom, gray.shape[0]), min(right, gray.shape[1])
+        if bottom - top < 4 or right - left < 4:
+            return None
+        mask = np.zeros_like(gray)
+        mask[top:bottom, left:right] = 255
+        points = cv2.goodFeaturesToTrack(gray, maxCorners=25, qualityLevel=0.01, minDistance=3, mask=mask)
+        if points is None or len(points) < 3:
+            # Flat faces (low light) have few corners, fall back to a grid
+            ys, xs = np.mgrid[top:bottom:max(1, (bottom - top) // 4), left:right:max(1, (right - left) // 4)]
+            points = np.stack([xs.ravel(), ys.ravel()], axis=1)
+        return points.reshape(-1, 2).astype(np.float32)
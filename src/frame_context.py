@@ -0,0 +1,175 @@
+import threading
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from src.result_cache import dhash
+
+# Views of a frame stay valid until this many newer frames of the same stream exist
+DEFAULT_BUFFER_DEPTH = 3
+# Width of the gray copy hashed for whole-frame results; the tracker's default flow width, so it is shared
+HASH_WIDTH = 320
+
+
+class FrameBuffers:
+    """
+    Reusable output arrays for the derived views of one stream's frames.
+
+    Frames take turns over `depth` sets of arrays, so a view handed out for
+    a frame is only overwritten `depth` frames later (the tracker keeps the
+    previous frame's gray image, for instance). An array is reallocated only
+    when the requested shape changes, e.g. when the rate controller changes
+    the detection width.
+    """
+
+    def __init__(self, depth: int = DEFAULT_BUFFER_DEPTH):
+        self._sets = [{} for _ in range(max(2, depth))]
+        self._next = 0
+        self.allocated = 0
+        self.reused = 0
+
+    def next_set(self) -> Dict[str, np.ndarray]:
+        buffers = self._sets[self._next]
+        self._next = (self._next + 1) % len(self._sets)
+        return buffers
+
+    def array(self, buffers: Dict[str, np.ndarray], key: str, shape: tuple) -> np.ndarray:
+        array = buffers.get(key)
+        if array is None or array.shape != shape:
+            array = buffers[key] = np.empty(shape, dtype=np.uint8)
+            self.allocated += 1
+        else:
+            self.reused += 1
+        return array
+
+    def stats(self) -> dict:
+        return {"depth": len(self._sets), "allocated": self.allocated, "reused": self.reused}
+
+
+class FrameContext:
+    """
+    One decoded BGR frame plus the views derived from it, each computed the
+    first time it is asked for and shared by every consumer of the frame:
+    FaceProcessor (downscaled RGB), FaceTracker (small gray), the vision
+    models (RGB face crops, 224x224 inputs), their result cache (content
+    hashes) and the recognition log (BGR).
+
+    With a stream's FrameBuffers the views are written into reused arrays;
+    without, they are allocated once per frame. Safe to use from the face
+    and vision executor threads.
+    """
+
+    def __init__(self, bgr: np.ndarray, buffers: Optional[FrameBuffers] = None):
+        self.bgr = bgr
+        self._buffers = buffers
+        self._arrays = buffers.next_set() if buffers is not None else None
+        self._views: Dict[tuple, object] = {}
+        self._lock = threading.RLock()  # views are built from other views
+
+    @property
+    def shape(self):
+        return self.bgr.shape
+
+    def _out(self, key: str, shape: tuple) -> Optional[np.ndarray]:
+        if self._buffers is None:
+            return None
+        return self._buffers.array(self._arrays, key, shape)
+
+    def _memo(self, key: tuple, compute):
+        with self._lock:
+            view = self._views.get(key)
+            if view is None:
+                view = self._views[key] = compute()
+            return view
+
+    def _resize(self, image: np.ndarray, size: Tuple[int, int], key: str, interpolation=cv2.INTER_LINEAR):
+        width, height = size
+        if (image.shape[1], image.shape[0]) == (width, height):
+            return image
+        out = self._out(key, (height, width) + image.shape[2:])
+        return cv2.resize(image, (width, height), dst=out, interpolation=interpolation)
+
+    def _convert(self, image: np.ndarray, code: int, channels: int, key: str) -> np.ndarray:
+        shape = image.shape[:2] + ((channels,) if channels > 1 else ())
+        return cv2.cvtColor(image, code, dst=self._out(key, shape))
+
+    @property
+    def rgb(self) -> np.ndarray:
+        """Full-resolution RGB."""
+        return self._memo(("rgb",), lambda: self._convert(self.bgr, cv2.COLOR_BGR2RGB, 3, "rgb"))
+
+    def small_rgb(self, max_width: int) -> Tuple[np.ndarray, float]:
+        """(RGB no wider than `max_width`, scale from full frame), as used for face detection."""
+        def compute():
+            height, width = self.bgr.shape[:2]
+            if width <= max_width:
+                return self.rgb, 1.0
+            scale = max_width / width
+            size = (max_width, int(round(height * scale)))
+            small = self._resize(self.bgr, size, f"small_bgr_{max_width}")
+            return self._convert(small, cv2.COLOR_BGR2RGB, 3, f"small_rgb_{max_width}"), scale
+        return self._memo(("small_rgb", max_width), compute)
+
+    def small_gray(self, max_width: int) -> Tuple[np.ndarray, float]:
+        """(Gray no wider than `max_width`, scale from full frame), for optical flow."""
+        def compute():
+            height, width = self.bgr.shape[:2]
+            scale = min(1.0, max_width / float(width))
+            small = self.bgr
+            if scale < 1.0:
+                size = (int(round(width * scale)), int(round(height * scale)))
+                small = self._resize(self.bgr, size, f"flow_bgr_{max_width}", cv2.INTER_AREA)
+            return self._convert(small, cv2.COLOR_BGR2GRAY, 1, f"gray_{max_width}"), scale
+        return self._memo(("small_gray", max_width), compute)
+
+    def rgb_resized(self, size: Optional[Tuple[int, int]]) -> np.ndarray:
+        """Whole frame in RGB at `size` (width, height), e.g. (224, 224) for ViT classifiers."""
+        if size is None:
+            return self.rgb
+        return self._memo(("rgb_resized", size),
+                          lambda: self._resize(self.rgb, size, f"rgb_{size[0]}x{size[1]}"))
+
+    def crop(self, location, margin: float = 0.2) -> Optional[np.ndarray]:
+        """BGR view (no copy) of a (top, right, bottom, left) face box plus some context."""
+        return self._memo(("crop", tuple(location), margin), lambda: crop_face(self.bgr, location, margin))
+
+    def crop_rgb(self, location, margin: float = 0.2, size: Optional[Tuple[int, int]] = None) -> Optional[np.ndarray]:
+        """RGB face crop, resized to `size` (width, height) when given; None if the box is too small."""
+        def compute():
+            crop = self.crop(location, margin)
+            if crop is None:
+                return None
+            if size is not None:
+                # Resize first: converting 224x224 pixels is cheaper than the whole crop
+                crop = cv2.resize(crop, size)
+            return cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+        return self._memo(("crop_rgb", tuple(location), margin, size), compute)
+
+    def content_hash(self, location=None, margin: float = 0.2) -> Optional[int]:
+        """Perceptual hash (dHash) of a face crop, or of the downscaled frame; None if the box is too small."""
+        def compute():
+            if location is None:
+                return dhash(self.small_gray(HASH_WIDTH)[0])
+            crop = self.crop(location, margin)
+            return None if crop is None else dhash(cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY))
+        key = ("content_hash", tuple(location) if location is not None else None, margin)
+        return self._memo(key, compute)
+
+
+def crop_face(frame, location, margin: float = 0.2):
+    """Crops a (top, right, bottom, left) face box with some context around it."""
+    top, right, bottom, left = (int(v) for v in location)
+    pad_y = int((bottom - top) * margin)
+    pad_x = int((right - left) * margin)
+    height, width = frame.shape[:2]
+    top, bottom = max(0, top - pad_y), min(height, bottom + pad_y)
+    left, right = max(0, left - pad_x), min(width, right + pad_x)
+    if bottom - top < 8 or right - left < 8:
+        return None
+    return frame[top:bottom, left:right]
+
+
+def as_context(frame) -> FrameContext:
+    """Wraps a bare BGR array (tools, callers without a stream) so every consumer can take either."""
+    return frame if isinstance(frame, FrameContext) else FrameContext(frame)
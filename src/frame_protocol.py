@@ -0,0 +1,78 @@
+import base64
+import json
+import struct
+import cv2
+import numpy as np
+from dataclasses import dataclass
+from typing import Optional, Tuple, Union
+
+# Binary frame layout (little endian), followed by the encoded image bytes:
+#   magic "FR" | version u8 | codec u8 | frame_id u32 | capture_ts f64 (ms) | width u16 | height u16
+FRAME_HEADER = struct.Struct("<2sBBIdHH")
+FRAME_MAGIC = b"FR"
+PROTOCOL_VERSION = 1
+
+CODECS = {0: "jpeg", 1: "webp"}
+
+PROTOCOL_TEXT = "text"
+PROTOCOL_BINARY = "binary"
+
+
+class FrameProtocolError(ValueError):
+    pass
+
+
+@dataclass
+class FrameHeader:
+    frame_id: int
+    capture_ts: float
+    width: int
+    height: int
+    codec: str = "jpeg"
+
+
+def decode_binary_frame(payload: bytes) -> Tuple[FrameHeader, memoryview]:
+    """Splits a binary WebSocket message into its header and image bytes, without copying."""
+    if len(payload) < FRAME_HEADER.size:
+        raise FrameProtocolError("Binary frame shorter than its header")
+    magic, version, codec, frame_id, capture_ts, width, height = FRAME_HEADER.unpack_from(payload)
+    if magic != FRAME_MAGIC or version != PROTOCOL_VERSION:
+        raise FrameProtocolError(f"Unsupported binary frame (magic={magic!r}, version={version})")
+    if codec not in CODECS:
+        raise FrameProtocolError(f"Unknown codec id {codec}")
+    header = FrameHeader(frame_id, capture_ts, width, height, CODECS[codec])
+    return header, memoryview(payload)[FRAME_HEADER.size:]
+
+
+def encode_binary_frame(header: FrameHeader, image_bytes: bytes) -> bytes:
+    """Builds a binary frame message. Used by tools that talk to /ws/video."""
+    codec_id = next(k for k, v in CODECS.items() if v == header.codec)
+    return FRAME_HEADER.pack(FRAME_MAGIC, PROTOCOL_VERSION, codec_id, header.frame_id,
+                             header.capture_ts, header.width, header.height) + image_bytes
+
+
+def decode_data_url(data: str) -> bytes:
+    """Legacy text mode: `data:image/jpeg;base64,...` strings."""
+    return base64.b64decode(data[data.index(',') + 1:])
+
+
+def decode_image(image_bytes: Union[bytes, memoryview]) -> Optional[np.ndarray]:
+    return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+
+
+def parse_control_message(data: str) -> Optional[dict]:
+    """Returns the JSON control message carried by a text message, or None for a data URL frame."""
+    if not data.startswith("{"):
+        return None
+    try:
+        message = json.loads(data)
+    except json.JSONDecodeError:
+        return None
+    return message if isinstance(message, dict) else None
+
+
+def negotiate_protocol(hello: dict) -> str:
+    """Picks the frame protocol for a client `hello`; anything unknown falls back to text."""
+    if hello.get("protocol") == PROTOCOL_BINARY and hello.get("version", PROTOCOL_VERSION) == PROTOCOL_VERSION:
+        return PROTOCOL_BINARY
+    return PROTOCOL_TEXT
@@ -0,0 +1,86 @@
+import math
+import mmap
+import struct
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+# <name>.idx starts with this magic, then one fixed-size record per frame
+INDEX_MAGIC = b"FRIDX\x00\x01\x00"
+INDEX_RECORD = struct.Struct("<QIIdd")  # offset, length, frame_id, received_at, capture_ts (NaN if unknown)
+INDEX_DTYPE = np.dtype([
+    ("offset", "<u8"), ("length", "<u4"), ("frame_id", "<u4"),
+    ("received_at", "<f8"), ("capture_ts", "<f8"),
+])
+
+
+class FrameRecorder:
+    """
+    Appends the encoded frames of one stream, exactly as received, to
+    `<path>.frames` and one index record per frame to `<path>.idx`, so a
+    session can be replayed later (tools/replay_benchmark.py) without
+    decoding or re-encoding anything.
+    """
+
+    def __init__(self, path, max_frames: Optional[int] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_frames = max_frames
+        self.frames = 0
+        self._offset = 0
+        self._data = open(self.path.with_suffix(".frames"), "wb")
+        self._index = open(self.path.with_suffix(".idx"), "wb")
+        self._index.write(INDEX_MAGIC)
+
+    def write(self, frame) -> bool:
+        """Records an IncomingFrame; returns False once `max_frames` is reached."""
+        if self._data is None or (self.max_frames is not None and self.frames >= self.max_frames):
+            return False
+        payload = frame.payload
+        length = len(payload)
+        self._data.write(payload)
+        capture_ts = frame.capture_ts if frame.capture_ts is not None else math.nan
+        self._index.write(INDEX_RECORD.pack(self._offset, length, frame.frame_id, frame.received_at, capture_ts))
+        self._offset += length
+        self.frames += 1
+        return True
+
+    def close(self):
+        if self._data is None:
+            return
+        self._data.close()
+        self._index.close()
+        self._data = self._index = None
+        print(f"Recorded {self.frames} frame(s) to {self.path.with_suffix('.frames')}")
+
+
+class FrameRecording:
+    """Read side of FrameRecorder; payloads are sliced out of a memory map."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path.with_suffix(".idx"), "rb") as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise ValueError(f"{self.path.with_suffix('.idx')} is not a frame recording index")
+            self.index = np.fromfile(f, dtype=INDEX_DTYPE)
+        self._file = open(self.path.with_suffix(".frames"), "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if len(self.index) else None
+
+    def __len__(self):
+        return len(self.index)
+
+    def payload(self, i: int) -> bytes:
+        record = self.index[i]
+        start = int(record["offset"])
+        # A copy, so the map can be closed while payloads are still referenced
+        return self._map[start:start + int(record["length"])]
+
+    def __iter__(self) -> Iterator[Tuple[np.void, bytes]]:
+        for i in range(len(self.index)):
+            yield self.index[i], self.payload(i)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
@@ -0,0 +1,138 @@
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+ONNX_CACHE_DIR = "cache/onnx"
+
+
+class TransformersBackend:
+    """Full-precision PyTorch inference through `transformers.pipeline` (the original path)."""
+
+    name = "transformers"
+
+    def __init__(self, model_id: str, top_k: Optional[int] = None):
+        # Imported here so transformers/torch are only loaded when the model is used
+        from transformers import pipeline
+        kwargs = {"top_k": top_k} if top_k is not None else {}
+        self.pipeline = pipeline("image-classification", model=model_id, **kwargs)
+
+    def __call__(self, images, batch_size: int = 1) -> List[List[dict]]:
+        predictions = self.pipeline(images, batch_size=batch_size)
+        # A single image gives a flat list of predictions
+        if predictions and isinstance(predictions[0], dict):
+            predictions = [predictions]
+        return predictions
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime CPU inference of a Hugging Face image classifier.
+
+    The model is exported to ONNX once (and optionally int8 dynamically
+    quantized) into `cache_dir`, then run with an InferenceSession limited to
+    `threads` intra-op threads. Preprocessing uses the model's own image
+    processor so labels stay comparable with TransformersBackend.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_id: str, top_k: Optional[int] = None, quantize: bool = True,
+                 threads: int = 2, cache_dir: str = ONNX_CACHE_DIR):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("The onnx backend needs `onnxruntime` (and `onnx` to export): pip install onnx onnxruntime") from e
+        from transformers import AutoConfig, AutoImageProcessor
+
+        self.model_id = model_id
+        self.top_k = top_k
+        self.processor = AutoImageProcessor.from_pretrained(model_id)
+        config = AutoConfig.from_pretrained(model_id)
+        self.id2label: Dict[int, str] = {int(k): v for k, v in config.id2label.items()}
+
+        model_dir = Path(cache_dir) / re.sub(r"[^A-Za-z0-9_.-]", "_", model_id)
+        fp32_path = model_dir / "model.onnx"
+        if not fp32_path.exists():
+            self._export(model_id, fp32_path)
+        model_path = fp32_path
+        if quantize:
+            model_path = model_dir / "model.int8.onnx"
+            if not model_path.exists():
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                print(f"Quantizing {model_id} to int8...")
+                quantize_dynamic(str(fp32_path), str(model_path), weight_type=QuantType.QInt8)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.model_path = model_path
+        print(f"ONNX Runtime session ready for {model_id} ({model_path.name}, {threads} thread(s))")
+
+    def _export(self, model_id: str, path: Path):
+        import torch
+        from PIL import Image
+        from transformers import AutoModelForImageClassification
+
+        print(f"Exporting {model_id} to ONNX...")
+        model = AutoModelForImageClassification.from_pretrained(model_id).eval()
+
+        class LogitsOnly(torch.nn.Module):
+            def __init__(self, wrapped):
+                super().__init__()
+                self.wrapped = wrapped
+
+            def forward(self, pixel_values):
+                return self.wrapped(pixel_values=pixel_values).logits
+
+        # The processor tells the input size the model expects
+        dummy = self.processor(images=[Image.new("RGB", (224, 224))], return_tensors="pt")["pixel_values"]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp.onnx")
+        with torch.no_grad():
+            torch.onnx.export(
+                LogitsOnly(model), (dummy,), str(tmp_path),
+                input_names=["pixel_values"], output_names=["logits"],
+                dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+                opset_version=14
+            )
+        os.replace(tmp_path, path)
+
+    def __call__(self, images, batch_size: int = 1) -> List[List[dict]]:
+        if not isinstance(images, (list, tuple)):
+            images = [images]
+        pixel_values = self.processor(images=list(images), return_tensors="np")["pixel_values"].astype(np.float32)
+        logits = self.session.run(None, {self.input_name: pixel_values})[0]
+
+        # Softmax, then labels sorted by score like the transformers pipeline returns them
+        logits = logits - logits.max(axis=1, keepdims=True)
+        scores = np.exp(logits)
+        scores /= scores.sum(axis=1, keepdims=True)
+        top_k = scores.shape[1] if self.top_k is None else min(self.top_k, scores.shape[1])
+        order = np.argsort(-scores, axis=1)[:, :top_k]
+        return [
+            [{"label": self.id2label[int(idx)], "score": float(row[idx])} for idx in row_order]
+            for row, row_order in zip(scores, order)
+        ]
+
+
+BACKENDS = {
+    TransformersBackend.name: TransformersBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+
+def create_backend(model_id: str, backend: str = "transformers", top_k: Optional[int] = None, **options):
+    """Builds the inference backend selected for a model in pipeline_config.yml."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}', expected one of {sorted(BACKENDS)}")
+    start = time.time()
+    classifier = BACKENDS[backend](model_id, top_k=top_k, **options)
+    print(f"{backend} backend for {model_id} built in {time.time() - start:.1f}s")
+    return classifier
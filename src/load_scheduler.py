@@ -0,0 +1,146 @@
+import asyncio
+import time
+from collections import deque
+from typing import Dict, Iterable, Optional
+
+from src.rate_controller import cpu_monitor
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+DEFAULT_PRIORITY = "normal"
+
+# Shed levels, each one includes the previous ones
+SHED_NONE = 0
+SHED_ANALYSES = 1   # optional analyses (emotion/mask) off for non-high streams
+SHED_DETECTION = 2  # low-priority streams pinned to the most degraded quality level
+SHED_ADMISSION = 3  # new non-high connections refused
+SHED_NAMES = ["none", "analyses", "detection", "admission"]
+
+# WebSocket close code "Try Again Later"
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+def parse_priority(value: Optional[str]) -> str:
+    return value if value in PRIORITIES else DEFAULT_PRIORITY
+
+
+class LoadScheduler:
+    """
+    Server-wide admission control and load shedding.
+
+    Every `eval_period` seconds the load is computed as the higher of
+    - work: processing seconds spent by all streams per wall second,
+      divided by `work_budget` (how many seconds of processing the server
+      can do per second, roughly the cores given to detection), and
+    - cpu: server CPU utilisation divided by `cpu_budget`.
+
+    Above `high` the shed level goes up one step per evaluation; it only
+    comes down after `recover_after` evaluations below `low`. High-priority
+    streams are never shed and are always admitted (up to `max_streams`).
+    """
+
+    def __init__(self, work_budget: float = 2.0, cpu_budget: float = 0.9, high: float = 1.0,
+                 low: float = 0.7, eval_period: float = 2.0, recover_after: int = 3,
+                 max_streams: Optional[int] = None, enabled: bool = True):
+        self.enabled = enabled
+        self.work_budget = work_budget
+        self.cpu_budget = cpu_budget
+        self.high = high
+        self.low = low
+        self.eval_period = eval_period
+        self.recover_after = recover_after
+        self.max_streams = max_streams
+        self.shed_level = SHED_NONE
+        self.load = 0.0
+        self.work = 0.0
+        self.cpu = 0.0
+        self.refused = 0
+        self.decisions = deque(maxlen=20)
+        self._healthy_evaluations = 0
+        self._last_busy: Dict[int, float] = {}
+        self._last_eval = time.monotonic()
+
+    def admit(self, priority: str, active_streams: int) -> bool:
+        """Decides whether a new connection with `priority` is accepted."""
+        if self.max_streams is not None and active_streams >= self.max_streams:
+            admitted = False
+        else:
+            admitted = not self.enabled or priority == "high" or self.shed_level < SHED_ADMISSION
+        if not admitted:
+            self.refused += 1
+            self._record(f"refused {priority} connection")
+        return admitted
+
+    def update(self, sessions: Iterable, now: Optional[float] = None) -> bool:
+        """Measures the load and applies the shed level to `sessions`; True when it changed."""
+        now = time.monotonic() if now is None else now
+        elapsed = now - self._last_eval
+        if elapsed <= 0:
+            return False
+        self._last_eval = now
+
+        sessions = list(sessions)
+        busy = {session.session_id: session.busy_seconds for session in sessions}
+        spent = sum(seconds - self._last_busy.get(session_id, 0.0) for session_id, seconds in busy.items())
+        self._last_busy = busy
+        self.work = spent / elapsed
+        self.cpu = cpu_monitor.utilization()
+        self.load = max(self.work / self.work_budget, self.cpu / self.cpu_budget)
+
+        before = self.shed_level
+        if not self.enabled:
+            self.shed_level = SHED_NONE
+        elif self.load > self.high:
+            self._healthy_evaluations = 0
+            self.shed_level = min(self.shed_level + 1, SHED_ADMISSION)
+        elif self.load < self.low:
+            self._healthy_evaluations += 1
+            if self._healthy_evaluations >= self.recover_after:
+                self._healthy_evaluations = 0
+                self.shed_level = max(self.shed_level - 1, SHED_NONE)
+        else:
+            self._healthy_evaluations = 0
+
+        if self.shed_level != before:
+            self._record(f"shed level {SHED_NAMES[before]} -> {SHED_NAMES[self.shed_level]} "
+                         f"(load {self.load:.2f}, work {self.work:.2f}s/s, cpu {self.cpu:.2f})")
+        for session in sessions:
+            self.apply(session)
+        return self.shed_level != before
+
+    def apply(self, session):
+        """Sets the shedding flags of one stream from the current level and its priority."""
+        protected = session.priority == "high"
+        session.analyses_shed = not protected and self.shed_level >= SHED_ANALYSES
+        controller = session.rate_controller
+        pinned = session.priority == "low" and self.shed_level >= SHED_DETECTION
+        min_level = len(controller.levels) - 1 if pinned else 0
+        if min_level != controller.min_level:
+            controller.min_level = min_level
+            session.apply_quality(controller.level)
+            session.outbox.put_control(controller.client_message())
+
+    async def run(self, manager):
+        # Periodic evaluation, started with the server
+        while True:
+            await asyncio.sleep(self.eval_period)
+            try:
+                self.update(manager.active_connections.values())
+            except Exception as e:
+                print(f"Error updating load scheduler: {e}")
+
+    def _record(self, message: str):
+        print(f"Load scheduler: {message}")
+        self.decisions.append({"time": round(time.time(), 3), "decision": message})
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "shed_level": SHED_NAMES[self.shed_level],
+            "load": round(self.load, 3),
+            "work_seconds_per_second": round(self.work, 3),
+            "work_budget": self.work_budget,
+            "cpu": round(self.cpu, 3),
+            "cpu_budget": self.cpu_budget,
+            "refused_connections": self.refused,
+            "recent_decisions": list(self.decisions)
+        }
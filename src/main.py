@@ -1,8 +1,13 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from src.vision_pipeline import VisionPipeline
+from src.model_registry import ModelRegistry
 from src.connection_manager import ConnectionManager
+from src.load_scheduler import LoadScheduler
 from src.face_recontition_system import FaceRecognitionSystem
+from src.utils.config import load_pipeline_config
+from src.metrics import register_server_metrics
 from api.api_routes import api_router
 
 app = FastAPI(
@@ -21,13 +26,45 @@ app.add_middleware(
 )
 
 # Initialize shared resources
-app.state.vision_pipeline = VisionPipeline()
-app.state.manager = ConnectionManager()
-app.state.face_system = FaceRecognitionSystem()
+config = load_pipeline_config()
+face_config = config.get("face_recognition", {})
+# Nothing heavy is loaded at import: models are built on first use or warm-up,
+# and the gallery is loaded in the background once the server is up
+app.state.vision_pipeline = VisionPipeline(ModelRegistry(config.get("models", {})))
+streams_config = config.get("streams", {})
+server_config = config.get("server", {})
+# Several workers share one gallery through memory-mapped segments instead of each loading its own
+shared_gallery = dict(face_config.get("shared_gallery", {}))
+if not shared_gallery.pop("enabled", False) and server_config.get("workers", 1) <= 1:
+    shared_gallery = None
+app.state.manager = ConnectionManager(streams_config, LoadScheduler(**streams_config.get("load_shedding", {})))
+app.state.face_system = FaceRecognitionSystem(
+    engine=face_config.get("engine", "thread"),
+    workers=face_config.get("workers", 4),
+    detection_timeout=face_config.get("detection_timeout", 10.0),
+    load_on_init=False,
+    log_config=config.get("recognition_log", {}),
+    matcher_config=face_config.get("matcher", {}),
+    shared_gallery=shared_gallery,
+    detector=face_config.get("detector", "hog"),
+    detectors=face_config.get("detectors")
+)
+register_server_metrics(app.state.manager, app.state.face_system, app.state.vision_pipeline)
+
+@app.on_event("startup")
+async def startup():
+    app.state.startup_tasks = [
+        asyncio.ensure_future(app.state.face_system.load_known_faces_async()),
+        asyncio.ensure_future(app.state.vision_pipeline.registry.warm_up(
+            app.state.vision_pipeline.registry.warmup_names()
+        )),
+        asyncio.ensure_future(app.state.manager.scheduler.run(app.state.manager)),
+        asyncio.ensure_future(app.state.face_system.follow_shared_gallery()),
+    ]
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.face_system.close()
 
 # Include all API routes
 app.include_router(api_router)
-
-if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000, workers=1)
@@ -0,0 +1,265 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds; covers a cached lookup (~0.1 ms) up to a stalled HOG pass
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Sequence[str]) -> LabelValues:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {labels}")
+        return tuple(str(value) for value in labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> Iterable[str]:
+        return []
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+class Gauge(Metric):
+    """Gauge whose value is set directly or read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, *labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        if self.callback is not None:
+            values.update(self.callback())
+        for key, value in values.items():
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+class CallbackCounter(Gauge):
+    """Counter owned by someone else (e.g. a StreamSession), read at scrape time."""
+
+    kind = "counter"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (+Inf last), sum]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        key = labels if len(labels) == len(self.label_names) else self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def _samples(self):
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _format_labels(self.label_names, key, f'le="{_format_value(float(bound))}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            labels = _format_labels(self.label_names, key)
+            yield f"{self.name}_sum{labels} {total!r}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Hot-path stage durations: receive, decode, resize, detect, encode, match,
+# detect_remote (process engine round trip), classify, log_write, send
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "cv_stage_duration_seconds", "Duration of one processing stage", ["stage"]
+))
+FRAME_SECONDS = REGISTRY.register(Histogram(
+    "cv_frame_duration_seconds", "Time from receiving a frame to queuing its result", ["skipped"]
+))
+FACES_DETECTED = REGISTRY.register(Counter(
+    "cv_faces_detected_total", "Faces found by full detection passes"
+))
+FACES_ENCODED = REGISTRY.register(Counter(
+    "cv_faces_encoded_total", "Faces encoded and matched against the gallery"
+))
+FRAMES = REGISTRY.register(Counter(
+    "cv_frames_total", "Frames of all streams by outcome (received, processed, skipped, dropped)", ["state"]
+))
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage)
+
+
+def time_stage(stage: str):
+    """Context manager recording the duration of the block as `stage`."""
+    return STAGE_SECONDS.time(stage)
+
+
+def register_server_metrics(manager, face_system, vision_pipeline, registry: MetricsRegistry = REGISTRY):
+    """Gauges and per-stream counters read from the live server objects at scrape time."""
+
+    def sessions():
+        return list(manager.active_connections.values())
+
+    def stream_frames():
+        values = {}
+        for session in sessions():
+            stream = str(session.session_id)
+            gate = session.change_gate
+            values[(stream, "received")] = session.frames_received
+            values[(stream, "processed")] = session.frames_processed
+            values[(stream, "skipped")] = gate.duplicates + gate.static
+            values[(stream, "dropped")] = session.frames_dropped
+        return values
+
+    def queue_depths():
+        current = sessions()
+        depths = {
+            ("stream_inbox",): sum(session.inbox.depth for session in current),
+            ("stream_outbox",): sum(session.outbox.depth for session in current),
+            ("recognition_log",): face_system.log_writer.depth,
+        }
+        if face_system.detection_engine is not None:
+            depths[("detection_engine",)] = face_system.detection_engine.pending
+        for name, model in vision_pipeline.models.items():
+            depths[(f"batcher_{name}",)] = model.batcher.depth
+        return depths
+
+    def result_cache_lookups():
+        values = {}
+        for name, model in vision_pipeline.models.items():
+            values[(name, "hit")] = model.result_cache.hits
+            values[(name, "miss")] = model.result_cache.misses
+        return values
+
+    registry.register(Gauge(
+        "cv_active_connections", "Open /ws/video connections",
+        callback=lambda: {(): len(manager.active_connections)}
+    ))
+    registry.register(CallbackCounter(
+        "cv_stream_frames_total", "Frames of one stream by outcome", ["stream", "state"], callback=stream_frames
+    ))
+    registry.register(Gauge(
+        "cv_stream_quality_level", "Quality level chosen by the stream's rate controller (0 = best)", ["stream"],
+        callback=lambda: {(str(s.session_id),): max(s.rate_controller.level_index, s.rate_controller.min_level)
+                          for s in sessions()}
+    ))
+    registry.register(Gauge(
+        "cv_queue_depth", "Items waiting in a queue", ["queue"], callback=queue_depths
+    ))
+    registry.register(CallbackCounter(
+        "cv_result_cache_lookups_total", "Vision model result cache lookups by outcome", ["model", "outcome"],
+        callback=result_cache_lookups
+    ))
+    registry.register(Gauge(
+        "cv_load_shed_level", "Server-wide shed level (0 = none, 3 = refusing connections)",
+        callback=lambda: {(): manager.scheduler.shed_level}
+    ))
+    registry.register(Gauge(
+        "cv_gallery_faces", "Encodings in this worker's gallery",
+        callback=lambda: {(): len(face_system.gallery)}
+    ))
+    registry.register(Gauge(
+        "cv_gallery_generation", "Shared gallery generation this worker is attached to (0 = not shared)",
+        callback=lambda: {(): face_system.gallery_generation}
+    ))
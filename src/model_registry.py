@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+# Analyzer plugins, filled by @register_model at import time (cheap: no model is built)
+MODEL_PLUGINS: Dict[str, type] = {}
+
+# Keys of a model entry in pipeline_config.yml that are not constructor arguments
+_REGISTRY_KEYS = {"enabled", "warmup"}
+
+
+def register_model(name: str):
+    """Registers a BaseVisionModel subclass under the name used in pipeline_config.yml."""
+    def decorator(cls):
+        MODEL_PLUGINS[name] = cls
+        return cls
+    return decorator
+
+
+class ModelRegistry:
+    """
+    Builds the analyzers listed in `models:` of pipeline_config.yml on demand.
+
+    Only enabled entries with a registered plugin are available. A model is
+    instantiated the first time it is asked for (or by `warm_up`), on a
+    background thread, so importing the app never loads transformers/torch.
+    """
+
+    def __init__(self, models_config: Optional[Dict[str, dict]] = None):
+        self.config: Dict[str, dict] = {}
+        for name, options in (models_config or {}).items():
+            options = options or {}
+            if not options.get("enabled", False):
+                continue
+            if name not in MODEL_PLUGINS:
+                print(f"Model '{name}' is enabled in pipeline_config.yml but no analyzer is registered for it, skipping")
+                continue
+            self.config[name] = options
+
+        self._models: Dict[str, Any] = {}
+        self._errors: Dict[str, str] = {}
+        self._load_times: Dict[str, float] = {}
+        self._locks = {name: threading.Lock() for name in self.config}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+
+    def available(self) -> List[str]:
+        return list(self.config)
+
+    def loaded(self) -> Dict[str, Any]:
+        return dict(self._models)
+
+    def warmup_names(self) -> List[str]:
+        return [name for name, options in self.config.items() if options.get("warmup", False)]
+
+    def get(self, name: str):
+        """Returns the model, building it in the calling thread if needed."""
+        if name in self._models:
+            return self._models[name]
+        if name not in self.config:
+            raise KeyError(f"Model '{name}' is not available")
+
+        with self._locks[name]:
+            if name not in self._models:
+                options = {k: v for k, v in self.config[name].items() if k not in _REGISTRY_KEYS}
+                start = time.time()
+                try:
+                    self._models[name] = MODEL_PLUGINS[name](**options)
+                    self._errors.pop(name, None)
+                except Exception as e:
+                    self._errors[name] = str(e)
+                    raise
+                self._load_times[name] = time.time() - start
+                print(f"Model '{name}' loaded in {self._load_times[name]:.1f}s")
+        return self._models[name]
+
+    async def load(self, name: str):
+        """Builds the model off the event loop; concurrent callers share one load."""
+        if name in self._models:
+            return self._models[name]
+        future = self._loading.get(name)
+        if future is None:
+            loop = asyncio.get_event_loop()
+            future = self._loading[name] = loop.run_in_executor(self._executor, self.get, name)
+            future.add_done_callback(lambda _: self._loading.pop(name, None))
+        return await future
+
+    def get_if_loaded(self, name: str, start_loading: bool = True):
+        """
+        Non-blocking access for the frame path: returns None while the model
+        is still loading (and starts loading it on first use).
+        """
+        model = self._models.get(name)
+        if model is None and start_loading and name in self.config and name not in self._errors \
+                and name not in self._loading:
+            asyncio.ensure_future(self.load(name))
+        return model
+
+    async def warm_up(self, names: Optional[List[str]] = None) -> Dict[str, str]:
+        names = self.available() if names is None else names
+        for name in names:
+            try:
+                await self.load(name)
+            except Exception as e:
+                print(f"Error warming up model '{name}': {e}")
+        return self.status()
+
+    def status(self) -> Dict[str, str]:
+        status = {}
+        for name in self.config:
+            if name in self._models:
+                status[name] = "loaded"
+            elif name in self._loading:
+                status[name] = "loading"
+            elif name in self._errors:
+                status[name] = f"failed: {self._errors[name]}"
+            else:
+                status[name] = "not_loaded"
+        return status
+
+    def ready(self) -> bool:
+        """True once every model marked `warmup: true` is loaded."""
+        return all(name in self._models for name in self.warmup_names())
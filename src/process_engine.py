@@ -0,0 +1,248 @@
+import asyncio
+import itertools
+import multiprocessing as mp
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Largest downscaled RGB frame a slot can hold (FaceProcessor.max_width is at most 960 px)
+SLOT_SHAPE = (1280, 960, 3)
+# A worker dying this soon after starting, this many times in a row, is not restarted again
+QUICK_EXIT_SECONDS = 10.0
+MAX_QUICK_EXITS = 3
+
+
+def _worker_main(index, shm_name, slot_bytes, task_queue, control_queue, result_queue, matcher_config=None):
+    """
+    Detection worker. Holds its own read-only copy of the gallery and reads
+    frames straight out of the shared memory ring; only boxes and identities
+    travel back through the result queue. It announces every request it
+    takes, so the parent knows which one a crashed worker was holding.
+    """
+    # Heavy imports happen in the worker, not in the parent at import time
+    from src.face_gallery import FaceGallery
+    from src.face_processor import DetectionJob, detect_and_identify
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    gallery = FaceGallery.from_config(matcher_config)
+    gallery_version = 0
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            request_id, slot, shape, scale, tracked, iou_threshold, detector, wanted_version = task
+            result_queue.put(("start", index, request_id, None, None, None))
+
+            # Gallery updates are broadcast before the first job that needs them
+            while gallery_version < wanted_version:
+                gallery_version, encodings, names = control_queue.get()
+                gallery.replace(encodings, names)
+
+            try:
+                rgb_frame = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)
+                job = DetectionJob(rgb_frame, scale, tracked, iou_threshold, detector)
+                boxes, identities = detect_and_identify(job, gallery)
+                del rgb_frame, job
+                result_queue.put(("done", index, request_id, boxes, identities, None))
+            except Exception as e:
+                result_queue.put(("done", index, request_id, None, None, repr(e)))
+    finally:
+        shm.close()
+
+
+class ProcessDetectionEngine:
+    """
+    Runs dlib detection/encoding in N worker processes.
+
+    Frames are handed over through a ring of shared memory slots instead of
+    being pickled; each worker keeps a copy of the gallery which is refreshed
+    when the gallery version changes. Results come back on a single queue and
+    are routed to the asyncio future of the request that produced them.
+
+    A worker that dies (a crash in dlib, the OOM killer) fails the request it
+    was running and is replaced by a new one with the current gallery; one
+    that keeps dying right after starting is given up on.
+    """
+
+    def __init__(self, num_workers: int = 4, slots_per_worker: int = 2, matcher_config: Optional[dict] = None):
+        self.num_workers = max(1, num_workers)
+        self.slot_bytes = int(np.prod(SLOT_SHAPE))
+        self.num_slots = self.num_workers * slots_per_worker
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slot_bytes * self.num_slots)
+
+        # spawn: dlib and the server's threads do not survive a fork reliably
+        self._ctx = mp.get_context("spawn")
+        self._matcher_config = matcher_config
+        self._task_queue = self._ctx.Queue()
+        self._result_queue = self._ctx.Queue()
+        self._control_queues: List = [None] * self.num_workers
+        self._workers: List = [None] * self.num_workers  # None once given up on
+        self._started_at = [0.0] * self.num_workers
+        self._quick_exits = [0] * self.num_workers
+        self._gallery_version = 0
+        self._gallery_state = None  # last (version, encodings, names) sent, for replacement workers
+        self._gallery_lock = threading.Lock()
+        for index in range(self.num_workers):
+            self._spawn(index)
+
+        self._request_ids = itertools.count(1)
+        self._pending: Dict[int, Tuple[asyncio.AbstractEventLoop, asyncio.Future, int]] = {}
+        self._pending_lock = threading.Lock()
+        self._running: Dict[int, int] = {}  # worker index -> request id it took
+        self._free_slots: Optional[asyncio.Queue] = None
+        self.respawned = 0
+        self._closed = False
+        self._collector = threading.Thread(target=self._collect_results, daemon=True)
+        self._collector.start()
+        print(f"Detection engine started with {self.num_workers} worker process(es)")
+
+    @property
+    def pending(self) -> int:
+        with self._pending_lock:
+            return len(self._pending)
+
+    def _spawn(self, index: int):
+        control_queue = self._ctx.Queue()
+        worker = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self._shm.name, self.slot_bytes, self._task_queue, control_queue, self._result_queue,
+                  self._matcher_config),
+            daemon=True
+        )
+        with self._gallery_lock:
+            if self._gallery_state is not None:
+                control_queue.put(self._gallery_state)
+            self._control_queues[index] = control_queue
+            self._workers[index] = worker
+        self._started_at[index] = time.monotonic()
+        worker.start()
+
+    def _sync_gallery(self, gallery):
+        with self._gallery_lock:
+            if gallery.version == self._gallery_version:
+                return self._gallery_version
+            version, encodings, names = gallery.export()
+            self._gallery_state = (version, np.asarray(encodings), names)
+            for control_queue in self._control_queues:
+                control_queue.put(self._gallery_state)
+            self._gallery_version = version
+            return version
+
+    async def submit(self, job, gallery) -> Tuple[List[tuple], List[Optional[dict]]]:
+        """Runs detect_and_identify for `job` on a worker and awaits (boxes, identities)."""
+        rgb_frame = job.rgb_frame
+        if rgb_frame.nbytes > self.slot_bytes or rgb_frame.dtype != np.uint8:
+            raise ValueError(f"Frame {rgb_frame.shape} does not fit a shared memory slot")
+        if all(worker is None for worker in self._workers):
+            raise RuntimeError("No detection worker is running")
+
+        if self._free_slots is None:
+            self._free_slots = asyncio.Queue()
+            for slot in range(self.num_slots):
+                self._free_slots.put_nowait(slot)
+
+        slot = await self._free_slots.get()
+        try:
+            view = np.ndarray(rgb_frame.shape, dtype=np.uint8, buffer=self._shm.buf,
+                              offset=slot * self.slot_bytes)
+            np.copyto(view, rgb_frame)
+            del view
+
+            version = self._sync_gallery(gallery)
+            loop = asyncio.get_event_loop()
+            future = loop.create_future()
+            request_id = next(self._request_ids)
+            with self._pending_lock:
+                self._pending[request_id] = (loop, future, slot)
+            self._task_queue.put((request_id, slot, rgb_frame.shape, job.scale,
+                                  job.tracked, job.iou_threshold, job.detector, version))
+        except Exception:
+            self._free_slots.put_nowait(slot)
+            raise
+
+        return await future
+
+    def _collect_results(self):
+        while True:
+            try:
+                message = self._result_queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._closed:
+                    return
+                self._check_workers()
+                continue
+            if message is None:
+                return
+            kind, index, request_id, boxes, identities, error = message
+            if kind == "start":
+                self._running[index] = request_id
+                continue
+            if self._running.get(index) == request_id:
+                del self._running[index]
+            self._finish(request_id, boxes, identities, error)
+            self._check_workers()
+
+    def _finish(self, request_id, boxes, identities, error):
+        with self._pending_lock:
+            pending = self._pending.pop(request_id, None)
+        if pending is None:
+            return
+        loop, future, slot = pending
+        loop.call_soon_threadsafe(self._resolve, future, slot, boxes, identities, error)
+
+    def _check_workers(self):
+        # Collector thread only: fails what a dead worker was running and replaces it
+        for index, worker in enumerate(self._workers):
+            if self._closed or worker is None or worker.exitcode is None:
+                continue
+            request_id = self._running.pop(index, None)
+            if request_id is not None:
+                self._finish(request_id, None, None, f"worker exited with code {worker.exitcode}")
+            quick = time.monotonic() - self._started_at[index] < QUICK_EXIT_SECONDS
+            self._quick_exits[index] = self._quick_exits[index] + 1 if quick else 0
+            if self._quick_exits[index] >= MAX_QUICK_EXITS:
+                print(f"Detection worker {index} keeps exiting (code {worker.exitcode}), not restarting it")
+                with self._gallery_lock:
+                    self._workers[index] = None
+                continue
+            print(f"Detection worker {index} died (exit code {worker.exitcode}), restarting it")
+            self._spawn(index)
+            self.respawned += 1
+        if not self._closed and all(worker is None for worker in self._workers):
+            # Nobody is left to take the queued requests
+            with self._pending_lock:
+                request_ids = list(self._pending)
+            for request_id in request_ids:
+                self._finish(request_id, None, None, "no detection worker is running")
+
+    def _resolve(self, future, slot, boxes, identities, error):
+        # Runs on the event loop: the slot is only reused once the worker is done with it
+        self._free_slots.put_nowait(slot)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(RuntimeError(f"Detection worker failed: {error}"))
+        else:
+            future.set_result((boxes, identities))
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for _ in range(self.num_workers):
+            self._task_queue.put(None)
+        for worker in self._workers:
+            if worker is None:
+                continue
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self._result_queue.put(None)
+        self._collector.join(timeout=2)
+        self._shm.close()
+        self._shm.unlink()
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+
+@dataclass(frozen=True)
+class QualityLevel:
+    detection_interval: float  # seconds between face detections (FaceProcessor.processing_interval)
+    max_width: int             # frames are downscaled to this width before detection
+    classify_interval: float   # minimum seconds between emotion/mask runs on a changing face
+    send_interval_ms: int      # recommended client frame interval
+    jpeg_quality: float        # recommended client JPEG quality
+
+# From best quality to most degraded; level 2 matches the former fixed constants
+QUALITY_LEVELS: List[QualityLevel] = [
+    QualityLevel(0.1, 960, 0.5, 100, 0.8),
+    QualityLevel(0.15, 800, 1.0, 150, 0.7),
+    QualityLevel(0.2, 640, 1.5, 200, 0.6),
+    QualityLevel(0.4, 480, 2.5, 300, 0.5),
+    QualityLevel(0.8, 320, 4.0, 500, 0.4),
+]
+
+
+class CpuMonitor:
+    """
+    Server CPU utilisation in [0, 1], sampled at most every `min_period`
+    seconds. Uses the 1-minute load average where the OS has one and this
+    process' own CPU time otherwise, whichever is higher.
+    """
+
+    def __init__(self, min_period: float = 0.5):
+        self.min_period = min_period
+        self.cpus = os.cpu_count() or 1
+        self._lock = threading.Lock()
+        self._last_wall = time.monotonic()
+        self._last_cpu = time.process_time()
+        self._value = 0.0
+
+    def utilization(self) -> float:
+        with self._lock:
+            wall = time.monotonic()
+            elapsed = wall - self._last_wall
+            if elapsed >= self.min_period:
+                cpu = time.process_time()
+                process_load = (cpu - self._last_cpu) / (elapsed * self.cpus)
+                self._last_wall, self._last_cpu = wall, cpu
+                system_load = 0.0
+                if hasattr(os, "getloadavg"):
+                    system_load = os.getloadavg()[0] / self.cpus
+                self._value = min(1.0, max(process_load, system_load))
+            return self._value
+
+
+cpu_monitor = CpuMonitor()
+
+
+class RateController:
+    """
+    Per-stream controller that picks a QualityLevel from measured latency.
+
+    Stages report their duration with `record`; every `eval_period` seconds
+    the smoothed per-frame latency and the server CPU load are compared with
+    the target. Overload degrades one level at once; recovery needs
+    `recover_after` consecutive healthy evaluations, to avoid oscillating.
+    """
+
+    def __init__(self, target_latency_ms: float = 250.0, start_level: int = 2,
+                 cpu_high: float = 0.85, cpu_low: float = 0.6, eval_period: float = 1.0,
+                 recover_after: int = 3, smoothing: float = 0.2, enabled: bool = True,
+                 levels: Optional[List[QualityLevel]] = None):
+        self.enabled = enabled
+        self.levels = levels or QUALITY_LEVELS
+        self.target_latency = target_latency_ms / 1000.0
+        self.cpu_high = cpu_high
+        self.cpu_low = cpu_low
+        self.eval_period = eval_period
+        self.recover_after = recover_after
+        self.smoothing = smoothing
+        self.level_index = min(max(start_level, 0), len(self.levels) - 1)
+        self.stage_latency: Dict[str, float] = {}
+        self.frame_latency: Optional[float] = None
+        self._healthy_evaluations = 0
+        self._last_eval = time.monotonic()
+        # Floor set by the server-wide LoadScheduler when it sheds this stream
+        self.min_level = 0
+
+    @property
+    def level(self) -> QualityLevel:
+        return self.levels[max(self.level_index, self.min_level)]
+
+    def record(self, stage: str, seconds: float):
+        previous = self.stage_latency.get(stage)
+        self.stage_latency[stage] = seconds if previous is None else previous + self.smoothing * (seconds - previous)
+
+    def record_frame(self, seconds: float):
+        previous = self.frame_latency
+        self.frame_latency = seconds if previous is None else previous + self.smoothing * (seconds - previous)
+
+    def update(self, now: Optional[float] = None) -> bool:
+        """Re-evaluates the level; returns True when the effective level changed."""
+        if not self.enabled:
+            return False
+        now = time.monotonic() if now is None else now
+        if now - self._last_eval < self.eval_period or self.frame_latency is None:
+            return False
+        self._last_eval = now
+
+        before = self.level
+        cpu = cpu_monitor.utilization()
+        if self.frame_latency > self.target_latency or cpu > self.cpu_high:
+            self._healthy_evaluations = 0
+            self.level_index = min(self.level_index + 1, len(self.levels) - 1)
+        elif self.frame_latency < 0.6 * self.target_latency and cpu < self.cpu_low:
+            self._healthy_evaluations += 1
+            if self._healthy_evaluations >= self.recover_after:
+                self._healthy_evaluations = 0
+                self.level_index = max(self.level_index - 1, 0)
+        else:
+            self._healthy_evaluations = 0
+        return self.level != before
+
+    def client_message(self) -> dict:
+        """Control message pushed to the client over the WebSocket."""
+        level = self.level
+        return {
+            "type": "control",
+            "send_interval_ms": level.send_interval_ms,
+            "jpeg_quality": level.jpeg_quality
+        }
+
+    def stats(self) -> dict:
+        return {
+            "level": max(self.level_index, self.min_level),
+            "min_level": self.min_level,
+            "settings": asdict(self.level),
+            "frame_latency_ms": None if self.frame_latency is None else round(self.frame_latency * 1000, 1),
+            "stage_latency_ms": {k: round(v * 1000, 1) for k, v in self.stage_latency.items()},
+            "cpu": round(cpu_monitor.utilization(), 2)
+        }
@@ -0,0 +1,228 @@
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from src.metrics import time_stage
+
+LOG_DIR = "logs"
+
+
+@dataclass
+class LogEntry:
+    name: str
+    frame: np.ndarray
+    face: np.ndarray
+    timestamp: float
+
+
+class RecognitionLogWriter:
+    """
+    Writes recognition snapshots (full frame + face crop) off the event loop.
+
+    `submit` only crops the face and puts the entry on a bounded queue; a
+    worker thread JPEG-encodes entries in batches and writes them to
+    `logs/<name>/full|face/`. An identity is logged again once `dedup_minutes`
+    have passed since its last snapshot. Every `prune_interval` seconds files
+    older than `max_age_days` are deleted, then the oldest ones until the
+    folder is under `max_total_mb`.
+    """
+
+    def __init__(self, log_dir: str = LOG_DIR, queue_size: int = 64, jpeg_quality: int = 85,
+                 full_frame_max_width: Optional[int] = None, dedup_minutes: float = 10.0,
+                 batch_size: int = 8, flush_interval: float = 0.5, max_total_mb: Optional[float] = 500,
+                 max_age_days: Optional[float] = 30, prune_interval: float = 300.0, enabled: bool = True):
+        self.enabled = enabled
+        self.log_dir = Path(log_dir)
+        self.jpeg_quality = int(jpeg_quality)
+        self.full_frame_max_width = full_frame_max_width
+        self.dedup_seconds = dedup_minutes * 60
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_total_bytes = None if max_total_mb is None else int(max_total_mb * 1024 * 1024)
+        self.max_age_seconds = None if max_age_days is None else max_age_days * 86400
+        self.prune_interval = prune_interval
+
+        self._queue: "queue.Queue[Optional[LogEntry]]" = queue.Queue(maxsize=queue_size)
+        self._last_logged: Dict[str, float] = {}
+        self._created_dirs = set()
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.pruned = 0
+        self.errors = 0
+        self._last_prune = 0.0
+        self._thread = None
+        if self.enabled:
+            self._thread = threading.Thread(target=self._run, name="recognition-log", daemon=True)
+            self._thread.start()
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, frame: np.ndarray, name: str, location, now: Optional[float] = None) -> bool:
+        """Queues a snapshot of `name` unless it was logged recently; never blocks."""
+        if not self.enabled:
+            return False
+        now = time.time() if now is None else now
+        last = self._last_logged.get(name)
+        if last is not None and now - last < self.dedup_seconds:
+            return False
+
+        top, right, bottom, left = location
+        # The crop is copied now; the full frame is not modified after decoding
+        face = frame[max(top, 0):bottom, max(left, 0):right].copy()
+        if face.size == 0:
+            return False
+        try:
+            self._queue.put_nowait(LogEntry(name, frame, face, now))
+        except queue.Full:
+            # Not marked as logged, so a later frame of the same person retries
+            self.dropped += 1
+            return False
+        self._last_logged[name] = now
+        self.submitted += 1
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                entry = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._maybe_prune()
+                continue
+            if entry is None:
+                return
+
+            batch = [entry]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stop = True
+                    break
+                batch.append(entry)
+
+            self._write_batch(batch)
+            self._maybe_prune()
+            if stop:
+                return
+
+    def _encode(self, image: np.ndarray) -> bytes:
+        ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+        return buffer.tobytes()
+
+    def _write_batch(self, batch: List[LogEntry]):
+        with time_stage("log_write"):
+            self._encode_and_write(batch)
+
+    def _encode_and_write(self, batch: List[LogEntry]):
+        # Encode everything first, then write the files in one go
+        files = []
+        for entry in batch:
+            try:
+                frame = entry.frame
+                height, width = frame.shape[:2]
+                if self.full_frame_max_width and width > self.full_frame_max_width:
+                    scale = self.full_frame_max_width / width
+                    frame = cv2.resize(frame, (self.full_frame_max_width, int(height * scale)),
+                                       interpolation=cv2.INTER_AREA)
+                stamp = datetime.fromtimestamp(entry.timestamp).strftime("%Y-%m-%d_%H-%M-%S")
+                user_dir = self.log_dir / entry.name
+                files.append((user_dir / "full" / f"{stamp}_full.jpg", self._encode(frame)))
+                files.append((user_dir / "face" / f"{stamp}_face.jpg", self._encode(entry.face)))
+            except Exception as e:
+                self.errors += 1
+                print(f"Error encoding log for {entry.name}: {e}")
+
+        for path, data in files:
+            try:
+                if path.parent not in self._created_dirs:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    self._created_dirs.add(path.parent)
+                path.write_bytes(data)
+                self.written += 1
+            except Exception as e:
+                self.errors += 1
+                self._created_dirs.discard(path.parent)
+                print(f"Error writing log {path}: {e}")
+        if files:
+            print(f"Logged {len(batch)} recognition(s): {', '.join(sorted({e.name for e in batch}))}")
+
+    def _maybe_prune(self):
+        now = time.time()
+        if now - self._last_prune >= self.prune_interval:
+            self._last_prune = now
+            try:
+                self.prune(now)
+            except Exception as e:
+                print(f"Error pruning {self.log_dir}: {e}")
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Applies the age and size limits to the log folder; returns the files removed."""
+        if self.max_age_seconds is None and self.max_total_bytes is None:
+            return 0
+        now = time.time() if now is None else now
+        files = []
+        for root, _, names in os.walk(self.log_dir):
+            for file_name in names:
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+
+        removed = 0
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            too_old = self.max_age_seconds is not None and now - mtime > self.max_age_seconds
+            too_big = self.max_total_bytes is not None and total > self.max_total_bytes
+            if not (too_old or too_big):
+                break  # sorted oldest first: the rest is newer and fits
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self.pruned += removed
+        return removed
+
+    def close(self, timeout: float = 5.0):
+        """Flushes what is queued and stops the worker."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "queued": self._queue.qsize(),
+            "submitted": self.submitted,
+            "written_files": self.written,
+            "dropped": self.dropped,
+            "pruned_files": self.pruned,
+            "errors": self.errors,
+            "identities_seen": len(self._last_logged)
+        }
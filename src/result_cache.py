@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+def dhash(gray: np.ndarray, hash_size: int = 8) -> int:
+    """
+    Difference hash of a gray image: shrunk to (hash_size + 1) x hash_size,
+    one bit per pair of horizontally adjacent pixels (is the left one
+    brighter). Robust to JPEG noise, brightness shifts and small resizes;
+    a different face or scene changes many bits.
+    """
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, :-1] > small[:, 1:]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class ResultCache:
+    """
+    Bounded LRU of model results keyed by what the model was shown:
+    (namespace, model id, perceptual hash of the input). The namespace is
+    the stream, so results never leak between clients, and an entry is
+    only reused for `ttl` seconds. With `max_distance` > 0 a hash within
+    that many bits of a cached one is a hit too, which absorbs the jitter
+    of a tracked box around a still face. A disabled cache never hits.
+    """
+
+    def __init__(self, enabled: bool = True, capacity: int = 1024, ttl: float = 30.0, max_distance: int = 0):
+        self.enabled = enabled
+        self.capacity = max(1, capacity)
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._entries: "OrderedDict[Tuple[Hashable, str, int], Tuple[Any, float]]" = OrderedDict()
+        # Hashes per (namespace, model id), for the near-match scan
+        self._scopes: Dict[Tuple[Hashable, str], Dict[int, None]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _find(self, namespace: Hashable, model_id: str, content_hash: int) -> Optional[Tuple]:
+        key = (namespace, model_id, content_hash)
+        if key in self._entries or self.max_distance <= 0:
+            return key if key in self._entries else None
+        hashes = self._scopes.get((namespace, model_id), ())
+        best, best_distance = None, self.max_distance + 1
+        for other in hashes:
+            distance = hamming(content_hash, other)
+            if distance < best_distance:
+                best, best_distance = other, distance
+        return (namespace, model_id, best) if best is not None else None
+
+    def get(self, namespace: Hashable, model_id: str, content_hash: Optional[int]) -> Optional[Any]:
+        """Cached result for this input, or None (counted as a miss)."""
+        if not self.enabled or content_hash is None:
+            return None
+        with self._lock:
+            key = self._find(namespace, model_id, content_hash)
+            if key is not None:
+                result, stored_at = self._entries[key]
+                if time.monotonic() - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                self._remove(key)
+                self.expired += 1
+            self.misses += 1
+            return None
+
+    def put(self, namespace: Hashable, model_id: str, content_hash: Optional[int], result: Any):
+        if not self.enabled or content_hash is None or result is None:
+            return
+        key = (namespace, model_id, content_hash)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._entries[key] = (result, time.monotonic())
+            self._scopes.setdefault(key[:2], {})[content_hash] = None
+            while len(self._entries) > self.capacity:
+                self._remove(next(iter(self._entries)))
+                self.evicted += 1
+
+    def _remove(self, key: Tuple):
+        del self._entries[key]
+        hashes = self._scopes.get(key[:2])
+        if hashes is not None:
+            hashes.pop(key[2], None)
+            if not hashes:
+                del self._scopes[key[:2]]
+
+    def drop_namespace(self, namespace: Hashable) -> int:
+        """Forgets a closed stream's entries; returns how many there were."""
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == namespace]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "capacity": self.capacity,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,25 @@
+"""
+Starts uvicorn with the `server` section of pipeline_config.yml:
+    python -m src.server
+
+The app is passed as the import string "src.main:app" and never imported
+here, so this process and every uvicorn worker (and every detection worker
+process they spawn) build the server objects exactly once.
+"""
+import uvicorn
+
+from src.utils.config import load_pipeline_config
+
+
+def main():
+    server_config = load_pipeline_config().get("server", {})
+    uvicorn.run(
+        "src.main:app",
+        host=server_config.get("host", "127.0.0.1"),
+        port=server_config.get("port", 8000),
+        workers=server_config.get("workers", 1)
+    )
+
+
+if __name__ == "__main__":
+    main()
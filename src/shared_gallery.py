@@ -0,0 +1,152 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from src.face_gallery import ENCODING_SIZE
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = "lock"
+
+
+class SharedGalleryStore:
+    """
+    Gallery shared by the uvicorn workers of one host.
+
+    Every version of the gallery is written once as a read-only segment,
+    `gen-<n>.npy` (float32 encodings) plus `gen-<n>.json` (names), and the
+    `CURRENT` file holds the generation in use. Workers memory-map the
+    segment, so the encodings are in memory once per host however many
+    workers attach to them, and poll `CURRENT` to pick up enrollments made
+    by other workers. Writers serialize on a file lock; a generation is only
+    made current after its files are complete, so readers never see a
+    partial gallery.
+    """
+
+    def __init__(self, path="cache/gallery", poll_interval: float = 1.0, keep_generations: int = 3,
+                 lock_timeout: float = 60.0):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.poll_interval = poll_interval
+        self.lock_timeout = lock_timeout
+        # Old segments are unlinked; workers still mapping one keep reading it until they move on
+        self.keep_generations = max(1, keep_generations)
+
+    @contextmanager
+    def lock(self):
+        """Exclusive across processes and threads (every call locks its own file descriptor)."""
+        with open(self.path / LOCK_FILE, "a") as f:
+            _lock_file(f, self.lock_timeout)
+            try:
+                yield
+            finally:
+                _unlock_file(f)
+
+    def _segment(self, generation: int) -> Path:
+        return self.path / f"gen-{generation:08d}"
+
+    def generation(self) -> int:
+        """Current generation, 0 when nothing was published yet. Cheap enough to poll."""
+        try:
+            return int((self.path / CURRENT_FILE).read_text(encoding="utf-8").strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def load(self, generation: Optional[int] = None) -> Tuple[int, np.ndarray, List[str]]:
+        """(generation, memory-mapped read-only encodings, names) of the given or current generation."""
+        for _ in range(3):
+            current = self.generation() if generation is None else generation
+            if current == 0:
+                return 0, np.empty((0, ENCODING_SIZE), dtype=np.float32), []
+            segment = self._segment(current)
+            try:
+                with open(segment.with_suffix(".json"), "r", encoding="utf-8") as f:
+                    names = json.load(f)
+                encodings = np.load(segment.with_suffix(".npy"), mmap_mode="r")
+                return current, encodings, names
+            except FileNotFoundError:
+                if generation is not None:
+                    raise
+                # Pruned between reading CURRENT and opening it; a newer one is current by now
+        raise RuntimeError(f"Could not attach to the shared gallery in {self.path}")
+
+    def publish(self, encodings: np.ndarray, names: List[str]) -> int:
+        """Writes a new generation and makes it current. Call with lock() held."""
+        if len(encodings) != len(names):
+            raise ValueError("encodings and names must have the same length")
+        generation = self.generation() + 1
+        segment = self._segment(generation)
+
+        # Segment files first, then CURRENT, each swapped in complete
+        tmp = segment.with_suffix(".tmp.npy")
+        np.save(tmp, np.ascontiguousarray(np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)))
+        os.replace(tmp, segment.with_suffix(".npy"))
+        tmp = segment.with_suffix(".tmp.json")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump([str(name) for name in names], f)
+        os.replace(tmp, segment.with_suffix(".json"))
+        tmp = self.path / (CURRENT_FILE + ".tmp")
+        tmp.write_text(f"{generation}\n", encoding="utf-8")
+        os.replace(tmp, self.path / CURRENT_FILE)
+
+        self._prune(generation)
+        print(f"Published shared gallery generation {generation} ({len(names)} face(s))")
+        return generation
+
+    def publish_if_changed(self, encodings: np.ndarray, names: List[str]) -> int:
+        """
+        Publishes only when the contents differ from the current generation,
+        so workers starting together on the same dataset share one segment.
+        Call with lock() held.
+        """
+        generation, current, current_names = self.load()
+        if generation and list(current_names) == [str(name) for name in names] \
+                and np.array_equal(current, np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)):
+            return generation
+        return self.publish(encodings, names)
+
+    def _prune(self, generation: int):
+        oldest_kept = generation - self.keep_generations + 1
+        for path in self.path.glob("gen-*"):
+            try:
+                old = int(path.name[4:12])
+            except ValueError:
+                continue
+            if old < oldest_kept:
+                path.unlink(missing_ok=True)
+
+
+def _lock_file(f, timeout: float):
+    if fcntl is not None:
+        # flock is released by the kernel when its holder dies
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return
+    f.seek(0)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            # LK_LOCK itself gives up after about 10 seconds
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Could not lock {f.name} within {timeout:g} s; "
+                                   f"a worker may have stopped while holding it")
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        return
+    f.seek(0)
+    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,213 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional, Set, Union
+
+from src.face_processor import FaceProcessor
+from src.frame_context import DEFAULT_BUFFER_DEPTH, FrameBuffers
+from src.change_detector import ChangeGate
+from src.rate_controller import QualityLevel, RateController
+from src.frame_recorder import FrameRecorder
+
+_session_ids = itertools.count(1)
+
+
+@dataclass
+class ModelState:
+    """Per-session throttling and cache state of one BaseVisionModel."""
+    last_result: Optional[Any] = None
+    last_process_time: float = 0
+    # Per-face results and when they were computed, keyed by track id (or face index when faces are not tracked)
+    face_results: Dict[Any, Any] = field(default_factory=dict)
+    face_times: Dict[Any, float] = field(default_factory=dict)
+    # Minimum seconds between classifications of a changing face; None keeps the model default
+    refresh_interval: Optional[float] = None
+    # Result cache namespace: the stream's session id
+    namespace: Any = None
+    # Keys (track ids, or the whole frame) with an inference still running
+    in_flight: Set[Any] = field(default_factory=set)
+
+
+@dataclass
+class IncomingFrame:
+    """Encoded frame as received; decoding waits until the processor picks it."""
+    payload: Union[bytes, memoryview]
+    frame_id: int
+    received_at: float
+    capture_ts: Optional[float] = None
+
+
+class LatestSlot:
+    """
+    Single-item mailbox: putting an item replaces the unread one, so the
+    reader always gets the newest. `replaced` counts the items that were
+    overwritten before anyone read them.
+    """
+
+    def __init__(self):
+        self._item = None
+        self._has_item = False
+        self._event = asyncio.Event()
+        self.replaced = 0
+
+    def put(self, item) -> bool:
+        replaced = self._has_item
+        if replaced:
+            self.replaced += 1
+        self._item = item
+        self._has_item = True
+        self._event.set()
+        return replaced
+
+    @property
+    def depth(self) -> int:
+        return 1 if self._has_item else 0
+
+    async def get(self):
+        while not self._has_item:
+            self._event.clear()
+            await self._event.wait()
+        item, self._item, self._has_item = self._item, None, False
+        return item
+
+
+class Outbox:
+    """
+    Messages waiting for the sender task. Control messages are all
+    delivered in order; of the frame results only the newest is kept.
+    """
+
+    def __init__(self):
+        self._control = deque()
+        self._result = None
+        self._event = asyncio.Event()
+        self.results_replaced = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._control) + (self._result is not None)
+
+    def put_control(self, message: dict):
+        self._control.append(message)
+        self._event.set()
+
+    def put_result(self, message: dict):
+        if self._result is not None:
+            self.results_replaced += 1
+        self._result = message
+        self._event.set()
+
+    async def get(self) -> dict:
+        while not self._control and self._result is None:
+            self._event.clear()
+            await self._event.wait()
+        if self._control:
+            return self._control.popleft()
+        message, self._result = self._result, None
+        return message
+
+
+class StreamSession:
+    """
+    Processing state owned by a single WebSocket connection.
+
+    Heavy resources (face gallery, transformer models, executors) stay shared
+    in `app.state`; everything that depends on what one camera is seeing
+    (throttling, last results, tracks, model caches) lives here so streams
+    neither see each other's results nor block each other.
+    """
+
+    def __init__(self, client: Optional[str] = None, config: Optional[dict] = None,
+                 priority: str = "normal"):
+        config = config or {}
+        self.session_id = next(_session_ids)
+        self.client = client
+        self.priority = priority
+        self.connected_at = time.time()
+        self.face_processor = FaceProcessor()
+        self.detector: Optional[str] = None  # face detector preset, chosen with ?detector=
+        # Reused arrays for the views (RGB, small, gray, 224 px) of this stream's frames
+        self.frame_buffers = FrameBuffers(config.get("frame_buffer_depth", DEFAULT_BUFFER_DEPTH))
+        self.current_analysis_type: Optional[str] = None
+        self.model_states: Dict[str, ModelState] = {}
+        self.frames_received = 0
+        self.frames_processed = 0
+        # Processing time spent on this stream, read by the LoadScheduler
+        self.busy_seconds = 0.0
+        # Set by the LoadScheduler: optional analyses (emotion/mask) are skipped
+        self.analyses_shed = False
+        # Receiver -> processor -> sender handoff, newest frame wins at each step
+        self.inbox = LatestSlot()
+        self.outbox = Outbox()
+        # Skips duplicate and static frames before they are decoded
+        self.change_gate = ChangeGate(**config.get("change_detection", {}))
+        self.last_response: Optional[dict] = None
+        # Adapts detection rate, input size and classifier rate to the measured latency
+        self.rate_controller = RateController(**config.get("rate_control", {}))
+        self.classify_interval: Optional[float] = None
+        if self.rate_controller.enabled:
+            self.face_processor.frame_skip = 1  # the controller sets the rate through the interval
+            self.apply_quality(self.rate_controller.level)
+        # Optional capture of the received frames, for tools/replay_benchmark.py
+        self.recorder: Optional[FrameRecorder] = None
+        recording = config.get("recording", {})
+        if recording.get("enabled", False):
+            name = f"{time.strftime('%Y%m%d_%H%M%S')}_stream{self.session_id}"
+            self.recorder = FrameRecorder(Path(recording.get("dir", "recordings")) / name,
+                                          recording.get("max_frames"))
+
+    def apply_quality(self, level: QualityLevel):
+        processor = self.face_processor
+        processor.processing_interval = level.detection_interval
+        processor.tracking_detection_interval = max(1.0, 5 * level.detection_interval)
+        processor.max_width = level.max_width
+        self.classify_interval = level.classify_interval
+        for state in self.model_states.values():
+            state.refresh_interval = level.classify_interval
+
+    @property
+    def frames_dropped(self) -> int:
+        """Frames overwritten by a newer one before the processor got to them."""
+        return self.inbox.replaced
+
+    def next_frame_id(self) -> int:
+        """Counts a text-mode frame and gives it a server-side id; binary frames carry their own."""
+        self.frames_received += 1
+        return self.frames_received
+
+    def model_state(self, model_name: str) -> ModelState:
+        state = self.model_states.get(model_name)
+        if state is None:
+            state = self.model_states[model_name] = ModelState(
+                refresh_interval=self.classify_interval, namespace=self.session_id
+            )
+        return state
+
+    def stats(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "client": self.client,
+            "priority": self.priority,
+            "detector": self.detector,
+            "connected_for_s": round(time.time() - self.connected_at, 1),
+            "analysis_type": self.current_analysis_type,
+            "frames_received": self.frames_received,
+            "frames_processed": self.frames_processed,
+            "frames_dropped": self.frames_dropped,
+            "results_replaced": self.outbox.results_replaced,
+            "busy_seconds": round(self.busy_seconds, 2),
+            "analyses_shed": self.analyses_shed,
+            "change_gate": self.change_gate.stats(),
+            "frame_buffers": self.frame_buffers.stats(),
+            "rate_control": self.rate_controller.stats()
+        }
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def __repr__(self):
+        return f"StreamSession(id={self.session_id}, client={self.client})"
@@ -0,0 +1,13 @@
+from pathlib import Path
+import yaml
+
+CONFIG_PATH = Path(__file__).resolve().parent.parent / "pipeline_config.yml"
+
+
+def load_pipeline_config(path=CONFIG_PATH) -> dict:
+    """Lee src/pipeline_config.yml. Devuelve un dict vacío si no existe."""
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
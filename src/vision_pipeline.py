@@ -1,14 +1,20 @@
-from typing import Dict, Optional, Any
+from typing import Awaitable, Callable, Dict, List, Optional, Any, Tuple
 import time
-import cv2
 import numpy as np
 from dataclasses import dataclass, field
-from transformers import pipeline
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import io
 
+from src.stream_session import ModelState
+from src.frame_context import FrameContext, as_context
+from src.result_cache import ResultCache
+from src.batching import MicroBatcher
+from src.model_registry import ModelRegistry, register_model
+from src.inference_backends import create_backend
+from src.metrics import observe_stage
+
 @dataclass
 class ProcessingResult:
     processing_time: float
@@ -52,188 +58,430 @@ class MaskResult:
             'timestamp': self.timestamp
         }
 
+@dataclass
+class Stage:
+    """
+    One step of a frame's processing graph. `run` is called with the results
+    of the stages listed in `after`, in that order, once they have all
+    succeeded. `deadline` is in seconds from the start of the frame.
+    """
+    name: str
+    run: Callable[..., Awaitable[Any]]
+    after: Tuple[str, ...] = ()
+    deadline: Optional[float] = None
+    optional: bool = True
+
+
+def _ordered(stages: List[Stage]) -> List[Stage]:
+    # Topological order; also rejects unknown dependencies and cycles
+    by_name = {stage.name: stage for stage in stages}
+    ordered, visiting, done = [], set(), set()
+
+    def visit(stage):
+        if stage.name in done:
+            return
+        if stage.name in visiting:
+            raise ValueError(f"Stage '{stage.name}' is part of a dependency cycle")
+        visiting.add(stage.name)
+        for name in stage.after:
+            if name not in by_name:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{name}'")
+            visit(by_name[name])
+        visiting.discard(stage.name)
+        done.add(stage.name)
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return ordered
+
+
+async def run_stages(stages: List[Stage]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Runs a frame's stages as soon as their dependencies are done, so
+    independent stages overlap instead of adding up. Returns the results of
+    the stages that succeeded and the status of every stage: ok, timeout,
+    error or skipped (a dependency did not succeed). An optional stage that
+    misses its deadline only leaves its result out; a required one raises
+    asyncio.TimeoutError, or its own exception.
+    """
+    start = time.perf_counter()
+    results: Dict[str, Any] = {}
+    status: Dict[str, str] = {}
+    errors: Dict[str, BaseException] = {}
+    tasks: Dict[str, asyncio.Future] = {}
+
+    async def run(stage: Stage):
+        if stage.after:
+            await asyncio.gather(*(tasks[name] for name in stage.after))
+            if any(status[name] != "ok" for name in stage.after):
+                status[stage.name] = "skipped"
+                return
+        timeout = None
+        if stage.deadline is not None:
+            timeout = max(0.0, stage.deadline - (time.perf_counter() - start))
+        try:
+            results[stage.name] = await asyncio.wait_for(
+                stage.run(*(results[name] for name in stage.after)), timeout
+            )
+            status[stage.name] = "ok"
+        except asyncio.TimeoutError as e:
+            status[stage.name] = "timeout"
+            errors[stage.name] = e
+        except Exception as e:
+            status[stage.name] = "error"
+            errors[stage.name] = e
+            if stage.optional:
+                print(f"Stage {stage.name} failed: {e}")
+
+    ordered = _ordered(stages)
+    for stage in ordered:
+        tasks[stage.name] = asyncio.ensure_future(run(stage))
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+    for stage in ordered:
+        if not stage.optional and status[stage.name] != "ok":
+            raise errors.get(stage.name) or RuntimeError(f"Stage {stage.name} was {status[stage.name]}")
+    return results, status
+
+
+# ModelState.in_flight key of a whole-frame inference (faces use their track id or index)
+FRAME_KEY = "frame"
+
+
 class BaseVisionModel:
-    def __init__(self):
+    name = "base"
+    # Classifier input (width, height) taken from the FrameContext; None keeps the crop's own size
+    input_size: Optional[Tuple[int, int]] = None
+
+    def __init__(self, max_batch_size: int = 8, max_wait_ms: float = 10.0, scope: str = "faces",
+                 deadline_ms: Optional[float] = None, result_cache: Optional[Dict[str, Any]] = None):
+        if scope not in ("faces", "frame"):
+            raise ValueError(f"Unknown scope '{scope}', expected 'faces' or 'frame'")
+        # faces: classifies the crops of the detected faces, after detection.
+        # frame: classifies the whole frame, alongside detection.
+        self.scope = scope
+        # Past this (from the start of the frame) the frame is answered without this analysis
+        self.deadline = deadline_ms / 1000.0 if deadline_ms is not None else None
         self.executor = ThreadPoolExecutor(max_workers=1)
-        self._last_result: Optional[Any] = None
-        self._cache_duration = 5.0  # Default cache duration in seconds
-        self.last_process_time = 0
-        self.process_interval = 1.0  # Process every 1 second
+        # Results are reused for inputs that look the same as an earlier one of the stream
+        self.result_cache = ResultCache(**(result_cache or {}))
+        self.model_id = self.name
+        # Minimum seconds between classifications of a changing face (or frame) of one stream
+        self.refresh_interval = 1.0
+        # Used when no session is given; streams pass their own ModelState
+        self._default_state = ModelState()
+        # Requests from every stream are grouped into one forward pass
+        self.batcher = MicroBatcher(
+            self._process_batch,
+            self.executor,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            name=self.name
+        )
 
-    def should_process_frame(self) -> bool:
-        current_time = time.time()
-        return (current_time - self.last_process_time) >= self.process_interval
+    def min_interval(self, state: ModelState) -> float:
+        # The stream's rate controller may ask for fresher or fewer results
+        return state.refresh_interval if state.refresh_interval is not None else self.refresh_interval
 
-    def get_cached_result(self) -> Optional[Any]:
-        if self._last_result is None:
-            return None
-        
-        if time.time() - self._last_result.timestamp <= self._cache_duration:
-            return self._last_result
-        return None
+    def get_cached_result(self, frame, state: Optional[ModelState] = None, location=None) -> Optional[Any]:
+        """Result of an earlier input of the stream that looks like this face crop (or whole frame)."""
+        state = state or self._default_state
+        return self.result_cache.get(state.namespace, self.model_id, as_context(frame).content_hash(location))
 
-    async def process(self, frame) -> Optional[Any]:
-        raise NotImplementedError
+    def cache_result(self, frame, state: ModelState, result, location=None):
+        self.result_cache.put(state.namespace, self.model_id, as_context(frame).content_hash(location), result)
 
-class EmotionDetector(BaseVisionModel):
-    def __init__(self):
-        super().__init__()
-        print("Initializing Emotion Detector...")
-        self.classifier = pipeline(
-            "image-classification",
-            model="dima806/facial_emotions_image_detection",
-            top_k=7
-        )
-        self._cache_duration = 1.5  # Cache results for 1.5 seconds
-        print("Emotion Detector initialized")
-    
-    async def process(self, frame) -> Optional[EmotionResult]:
-        cached_result = self.get_cached_result()
+    async def process(self, frame, state: Optional[ModelState] = None) -> Optional[Any]:
+        state = state or self._default_state
+        frame = as_context(frame)
+        cached_result = self.get_cached_result(frame, state)
         if cached_result is not None:
+            state.last_result = cached_result
             return cached_result
-            
-        if not self.should_process_frame():
-            return self._last_result
-        
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(self.executor, self._process_frame, frame)
-        
-        if result is not None:
-            self._last_result = result
-            self.last_process_time = time.time()
-            
-        return result or self._last_result
-    
-    def _process_frame(self, frame) -> Optional[EmotionResult]:
+
+        # The scene changed, but a changing scene is only re-classified so often
+        if state.last_result is not None and time.time() - state.last_process_time < self.min_interval(state):
+            return state.last_result
+        # The previous frame's inference is still running
+        if FRAME_KEY in state.in_flight:
+            return state.last_result
+
+        # The whole frame, with views of its own: the inference may outlive the
+        # stream's FrameBuffers rotation. Built (or reused) on the batch thread.
+        await asyncio.shield(self._classify(frame, state, [(FRAME_KEY, None)], FrameContext(frame.bgr)))
+        return state.last_result
+
+    async def process_faces(self, frame, face_results, state: Optional[ModelState] = None) -> List[Optional[Any]]:
+        """
+        Classifies every face crop of the frame; returns one result per entry
+        of `face_results`. A crop that looks like one classified before (same
+        still face) reuses that result; a new face is classified right away,
+        and a known face whose crop changed at most every `min_interval(state)`.
+        Crops of the same frame are submitted together so they share one batch.
+        """
+        state = state or self._default_state
+        frame = as_context(frame)
+        now = time.time()
+        results: List[Optional[Any]] = [None] * len(face_results)
+        pending = []
+        live_keys = set()
+
+        for index, face in enumerate(face_results):
+            key = face.get("track_id", index)
+            live_keys.add(key)
+            previous = state.face_results.get(key)
+            if frame.crop(face["location"]) is None:
+                results[index] = previous
+                continue
+            cached = self.get_cached_result(frame, state, face["location"])
+            if cached is not None:
+                state.face_results[key] = results[index] = cached
+                continue
+            if key in state.in_flight or (previous is not None
+                                          and now - state.face_times.get(key, 0) < self.min_interval(state)):
+                results[index] = previous
+                continue
+            pending.append((index, key, face["location"]))
+
+        if pending:
+            await asyncio.shield(self._classify(frame, state, [(key, location) for _, key, location in pending]))
+            for index, key, _ in pending:
+                results[index] = state.face_results.get(key)
+
+        # Forget the faces that left the scene
+        for key in list(state.face_results):
+            if key not in live_keys:
+                del state.face_results[key]
+                state.face_times.pop(key, None)
+        return results
+
+    async def _classify(self, frame, state: ModelState, inputs, source=None):
+        """
+        Classifies (key, face location or None) inputs of the frame and keeps
+        the results in the stream's state and the result cache. Callers shield
+        it: when the frame's deadline cancels them the inference still
+        finishes and its results serve the next frames, instead of the same
+        crops being sent again on every frame.
+        """
+        keys = [key for key, _ in inputs]
+        state.in_flight.update(keys)
+        try:
+            fresh = await asyncio.gather(*(self.batcher.submit((source or frame, location)) for _, location in inputs))
+        finally:
+            state.in_flight.difference_update(keys)
+        now = time.time()
+        for (key, location), result in zip(inputs, fresh):
+            if result is None:
+                continue
+            if key == FRAME_KEY:
+                state.last_result, state.last_process_time = result, now
+            else:
+                state.face_results[key] = result
+                state.face_times[key] = now
+            self.cache_result(frame, state, result, location)
+
+    def _process_batch(self, items) -> List[Optional[Any]]:
+        """
+        Runs one batched forward pass over (FrameContext, face location or
+        None) items; returns one result (or None) per item.
+        """
         try:
             start_time = time.time()
-            
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(rgb_frame)
-            predictions = self.classifier(pil_image)
-            top_prediction = max(predictions, key=lambda x: x['score'])
-            
+            images = [self._prepare(*item) for item in items]
+            predictions = self.classifier(images, batch_size=len(images))
+            # Every item of the batch shares the cost of the forward pass
             processing_time = time.time() - start_time
-            
-            return EmotionResult(
-                emotion=top_prediction['label'],
-                confidence=float(top_prediction['score']),
-                processing_time=processing_time
-            )
-            
+            observe_stage("classify", processing_time)
+            return [self._build_result(prediction, processing_time) for prediction in predictions]
         except Exception as e:
-            print(f"Error in emotion detection: {e}")
-            return None
+            print(f"Error in {self.name} detection: {e}")
+            return [None] * len(items)
+
+    def _prepare(self, frame, location=None) -> Image.Image:
+        # RGB conversion and resizing are shared with every other consumer of the frame
+        if location is None:
+            return Image.fromarray(frame.rgb_resized(self.input_size))
+        return Image.fromarray(frame.crop_rgb(location, size=self.input_size))
+
+    def _build_result(self, predictions, processing_time: float) -> Any:
+        raise NotImplementedError
+
+@register_model("emotion")
+class EmotionDetector(BaseVisionModel):
+    name = "emotion"
+
+    def __init__(self, model: str = "dima806/facial_emotions_image_detection",
+                 backend: str = "transformers", backend_options: Optional[Dict[str, Any]] = None, **kwargs):
+        super().__init__(**kwargs)
+        print("Initializing Emotion Detector...")
+        # transformers/torch or onnxruntime are only imported when the model is built
+        self.classifier = create_backend(model, backend, top_k=7, **(backend_options or {}))
+        self.model_id = model
+        self.refresh_interval = 1.5
+        print("Emotion Detector initialized")
+
+    def _build_result(self, predictions, processing_time: float) -> EmotionResult:
+        top_prediction = max(predictions, key=lambda x: x['score'])
+        return EmotionResult(
+            emotion=top_prediction['label'],
+            confidence=float(top_prediction['score']),
+            processing_time=processing_time
+        )
 
 
 
+@register_model("mask")
 class MaskDetector(BaseVisionModel):
-    def __init__(self):
-        super().__init__()
+    name = "mask"
+    input_size = (224, 224)  # common input size for ViT models
+
+    def __init__(self, model: str = "Hemg/Face-Mask-Detection",
+                 backend: str = "transformers", backend_options: Optional[Dict[str, Any]] = None, **kwargs):
+        super().__init__(**kwargs)
         print("Initializing Mask Detector...")
-        self.classifier = pipeline(
-            "image-classification",
-            model="Hemg/Face-Mask-Detection"
-        )
-        self._cache_duration = 1.5  # Cache results for 1.5 seconds
+        self.classifier = create_backend(model, backend, **(backend_options or {}))
+        self.model_id = model
+        self.refresh_interval = 1.5
         print("Mask Detector initialized")
-    
-    async def process(self, frame) -> Optional[MaskResult]:
-        cached_result = self.get_cached_result()
-        if cached_result is not None:
-            return cached_result
-            
-        if not self.should_process_frame():
-            return self._last_result
-        
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(self.executor, self._process_frame, frame)
+
+    def _build_result(self, predictions, processing_time: float) -> MaskResult:
+        # Predictions come sorted by score
+        prediction = predictions[0]
         
-        if result is not None:
-            self._last_result = result
-            self.last_process_time = time.time()
-            
-        return result or self._last_result
-    
-    def _process_frame(self, frame) -> Optional[MaskResult]:
-        try:
-            start_time = time.time()
-            
-            # Convert BGR to RGB and resize to 224x224 (common input size for ViT models)
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            resized_frame = cv2.resize(rgb_frame, (224, 224))
-            
-            # Convert to PIL Image
-            pil_image = Image.fromarray(resized_frame)
-            
-            # Get prediction
-            prediction = self.classifier(pil_image)[0]
-            print(prediction)
-            
-            # Check the label and confidence
-            wearing_mask = prediction['label'] == "with_mask"
-            confidence = prediction['score']
-            
-            processing_time = time.time() - start_time
-            
-            return MaskResult(
-                wearing_mask=wearing_mask,
-                confidence=float(confidence),
-                processing_time=processing_time
-            )
-            
-        except Exception as e:
-            print(f"Error in mask detection: {e}")
-            return None
+        # Check the label and confidence
+        wearing_mask = prediction['label'] == "with_mask"
+        return MaskResult(
+            wearing_mask=wearing_mask,
+            confidence=float(prediction['score']),
+            processing_time=processing_time
+        )
 
 class VisionPipeline:
-    def __init__(self):
-        self.models = {
-            'emotion': EmotionDetector(),
-            'mask': MaskDetector()
-        }
+    def __init__(self, registry: Optional[ModelRegistry] = None):
+        # Models are built lazily by the registry, from pipeline_config.yml
+        self.registry = registry if registry is not None else ModelRegistry()
         self.current_analysis_type = None
+
+    @property
+    def models(self) -> Dict[str, BaseVisionModel]:
+        """Models loaded so far."""
+        return self.registry.loaded()
+
+    def stats(self) -> Dict[str, Any]:
+        """Batching, latency and result cache statistics of every loaded model."""
+        return {
+            name: dict(model.batcher.stats.to_dict(), result_cache=model.result_cache.stats())
+            for name, model in self.models.items()
+        }
+
+    def forget_session(self, session):
+        """Drops a closed stream's cached results from every model."""
+        for model in self.models.values():
+            model.result_cache.drop_namespace(session.session_id)
     
-    async def process_frame(self, frame, analysis_type: str = None) -> Dict[str, Dict[str, Any]]:
+    async def process_frame(self, frame, analysis_type: str = None, session=None,
+                            face_results: Optional[List[dict]] = None) -> Dict[str, Any]:
+        """
+        Runs the current analysis. With `face_results` (the output of the face
+        system for the same frame) every face crop is classified and the result
+        is a list with one entry per face, carrying its `face_index` and
+        `track_id`. Without it the whole frame is classified as before.
+        """
         results = {}
-        
-        # Update analysis type if provided
-        if analysis_type is not None:
-            self.set_analysis_type(analysis_type)
-        
-        # If analysis type is "none" or not set, return empty results
-        if not self.current_analysis_type or self.current_analysis_type == "none":
+        active = self._active_model(analysis_type, session)
+        if active is None:
             return results
-        
-        # Process with the current model if it exists
-        if self.current_analysis_type in self.models:
-            model = self.models[self.current_analysis_type]
-            result = await model.process(frame)
+        name, model, state = active
+        if face_results is not None:
+            results[name] = await self._analyze_faces(model, state, frame, face_results)
+        else:
+            result = await self._analyze_frame(model, state, frame)
             if result:
-                results[self.current_analysis_type] = result.to_dict()
-        
+                results[name] = result
         return results
 
-    def set_analysis_type(self, analysis_type: str):
+    def _active_model(self, analysis_type: Optional[str], session=None):
+        """(name, model, state) of the stream's current analysis, or None when there is nothing to run."""
+        # The analysis type and model caches are per stream when a session is given
+        target = session if session is not None else self
+
+        # Update analysis type if provided
+        if analysis_type is not None:
+            self.set_analysis_type(analysis_type, session)
+
+        # If analysis type is "none" or not set, there is nothing to run
+        current_analysis_type = target.current_analysis_type
+        if not current_analysis_type or current_analysis_type == "none":
+            return None
+
+        # While the model is still loading there are no results
+        if current_analysis_type not in self.registry.available():
+            return None
+        model = self.registry.get_if_loaded(current_analysis_type)
+        if model is None:
+            return None
+        state = session.model_state(current_analysis_type) if session is not None else None
+        return current_analysis_type, model, state
+
+    @staticmethod
+    async def _analyze_faces(model, state, frame, face_results) -> List[dict]:
+        face_analysis = await model.process_faces(frame, face_results, state)
+        return [
+            dict(result.to_dict(), face_index=index, track_id=face.get("track_id"))
+            for index, (face, result) in enumerate(zip(face_results, face_analysis))
+            if result is not None
+        ]
+
+    @staticmethod
+    async def _analyze_frame(model, state, frame) -> Optional[dict]:
+        result = await model.process(frame, state)
+        return result.to_dict() if result else None
+
+    def analysis_stages(self, frame, analysis_type: str = None, session=None,
+                        faces_stage: str = "faces") -> List[Stage]:
+        """
+        Stages of the current analysis for run_stages: per-face models run
+        after `faces_stage` on its results, whole-frame models (scope: frame)
+        have no dependency and run alongside face recognition. Both are
+        optional, bounded by the model's deadline_ms.
         """
-        Set the current analysis type for the pipeline.
+        active = self._active_model(analysis_type, session)
+        if active is None:
+            return []
+        name, model, state = active
+        if model.scope == "frame":
+            return [Stage(name, lambda: self._analyze_frame(model, state, frame), deadline=model.deadline)]
+        return [Stage(name, lambda faces: self._analyze_faces(model, state, frame, faces),
+                      after=(faces_stage,), deadline=model.deadline)]
+
+    def set_analysis_type(self, analysis_type: str, session=None):
+        """
+        Set the current analysis type for the pipeline, or for one stream
+        when a session is given.
         If 'none' is provided, clears the current analysis type.
         """
+        target = session if session is not None else self
+
         # Convert to lowercase for case-insensitive comparison
         analysis_type = analysis_type.lower() if analysis_type else 'none'
         
         # Clear analysis type if 'none' is selected
         if analysis_type == 'none':
-            if self.current_analysis_type is not None:
+            if target.current_analysis_type is not None:
                 print("Disabling vision pipeline processing")
-                self.current_analysis_type = None
+                target.current_analysis_type = None
             return True
             
         # Set new analysis type if valid
-        if analysis_type in self.models:
-            if analysis_type != self.current_analysis_type:
+        if analysis_type in self.registry.available():
+            if analysis_type != target.current_analysis_type:
                 print(f"Switching analysis type to: {analysis_type}")
-                self.current_analysis_type = analysis_type
+                target.current_analysis_type = analysis_type
                 return True
                 
-        return False
\ No newline at end of file
+        return False
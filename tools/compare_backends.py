@@ -0,0 +1,119 @@
+"""
+Compara la precisión y la latencia de los backends de inferencia de un
+clasificador sobre un conjunto local de imágenes.
+
+Uso:
+    python -m tools.compare_backends --model emotion --images dataset/
+    python -m tools.compare_backends --model Hemg/Face-Mask-Detection --images faces/ --threads 4 --json out.json
+
+Las etiquetas de PyTorch (backend transformers) son la referencia; para cada
+variante ONNX se informa el acuerdo top-1, la diferencia media de score de la
+etiqueta de referencia y la latencia por imagen y por lote.
+"""
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from src.inference_backends import create_backend
+
+MODEL_ALIASES = {
+    "emotion": "dima806/facial_emotions_image_detection",
+    "mask": "Hemg/Face-Mask-Detection",
+}
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def load_images(folder: Path, limit: int):
+    paths = sorted(p for p in folder.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)[:limit]
+    return paths, [Image.open(p).convert("RGB") for p in paths]
+
+
+def run_backend(classifier, images, batch_size):
+    single = []
+    predictions = []
+    for image in images:
+        start = time.perf_counter()
+        predictions.append(classifier([image], batch_size=1)[0])
+        single.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        classifier(images[i:i + batch_size], batch_size=batch_size)
+    batched = (time.perf_counter() - start) / max(1, len(images))
+    return predictions, single, batched
+
+
+def compare(reference, candidate):
+    agree = 0
+    score_diffs = []
+    for ref, cand in zip(reference, candidate):
+        ref_top = ref[0]
+        agree += cand[0]["label"] == ref_top["label"]
+        cand_score = next((p["score"] for p in cand if p["label"] == ref_top["label"]), 0.0)
+        score_diffs.append(abs(cand_score - ref_top["score"]))
+    return agree / max(1, len(reference)), statistics.mean(score_diffs) if score_diffs else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", required=True, help="emotion, mask or a Hugging Face model id")
+    parser.add_argument("--images", required=True, type=Path, help="Folder with test images (searched recursively)")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=2, help="ONNX Runtime intra-op threads")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--cache-dir", default="cache/onnx")
+    parser.add_argument("--json", type=Path, help="Also write the report to this file")
+    args = parser.parse_args()
+
+    model_id = MODEL_ALIASES.get(args.model, args.model)
+    paths, images = load_images(args.images, args.limit)
+    if not images:
+        raise SystemExit(f"No images found in {args.images}")
+    print(f"{len(images)} image(s), model {model_id}")
+
+    variants = {
+        "transformers": dict(backend="transformers"),
+        "onnx-fp32": dict(backend="onnx", quantize=False, threads=args.threads, cache_dir=args.cache_dir),
+        "onnx-int8": dict(backend="onnx", quantize=True, threads=args.threads, cache_dir=args.cache_dir),
+    }
+
+    report = {"model": model_id, "images": len(images), "variants": {}}
+    reference = None
+    for name, options in variants.items():
+        classifier = create_backend(model_id, top_k=None, **options)
+        predictions, single, batched = run_backend(classifier, images, args.batch_size)
+        entry = {
+            "latency_ms_p50": round(1000 * statistics.median(single), 2),
+            "latency_ms_mean": round(1000 * statistics.mean(single), 2),
+            "batched_ms_per_image": round(1000 * batched, 2),
+        }
+        if reference is None:
+            reference = predictions
+        else:
+            agreement, score_diff = compare(reference, predictions)
+            entry["top1_agreement"] = round(agreement, 4)
+            entry["mean_score_diff"] = round(score_diff, 4)
+            entry["disagreements"] = [
+                str(path) for path, ref, cand in zip(paths, reference, predictions)
+                if ref[0]["label"] != cand[0]["label"]
+            ][:20]
+        report["variants"][name] = entry
+
+    print(f"\n{'variant':<14}{'p50 ms':>10}{'batched ms':>12}{'top-1 agree':>13}{'score diff':>12}")
+    for name, entry in report["variants"].items():
+        agree = entry.get("top1_agreement")
+        diff = entry.get("mean_score_diff")
+        print(f"{name:<14}{entry['latency_ms_p50']:>10}{entry['batched_ms_per_image']:>12}"
+              f"{'-' if agree is None else f'{agree:.2%}':>13}{'-' if diff is None else f'{diff:.4f}':>12}")
+
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Compara los detectores de caras (src/face_detectors.py): milisegundos por
+frame y recall frente a un detector de referencia (por defecto HOG con dos
+upsamplings sobre la imagen completa, el más exhaustivo de los disponibles).
+
+Las imágenes se reducen a --max-width como hace FaceProcessor antes de
+detectar. Una detección acierta una cara de referencia cuando el centro de
+cada caja cae dentro de la otra, lo que tolera que cada detector dibuje la
+caja a su manera. "extra/frame" son detecciones sin cara de referencia
+(falsos positivos o caras que la referencia no encontró).
+
+Uso:
+    python -m tools.detector_benchmark --images dataset
+    python -m tools.detector_benchmark --recording recordings/20261017_101500_stream1 --detectors hog haar
+    python -m tools.detector_benchmark --images dataset --extra-detector yunet '{"type": "yunet", "model_path": "models/face_detection_yunet_2023mar.onnx"}' --json detectors.json
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from src.face_detectors import create_detector
+from src.utils.config import load_pipeline_config
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp"}
+DEFAULT_REFERENCE = {"type": "hog", "upsample": 2}
+
+
+def image_frames(folder: Path, limit: int):
+    for path in sorted(p for p in folder.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)[:limit]:
+        frame = cv2.imread(str(path))
+        if frame is not None:
+            yield frame
+
+
+def downscale(frame, max_width: int):
+    scale = 1.0
+    if frame.shape[1] > max_width:
+        scale = max_width / frame.shape[1]
+        frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale)
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), scale
+
+
+def _contains(box, point) -> bool:
+    top, right, bottom, left = box
+    return top <= point[0] <= bottom and left <= point[1] <= right
+
+
+def same_face(a, b) -> bool:
+    centre_a = ((a[0] + a[2]) / 2, (a[1] + a[3]) / 2)
+    centre_b = ((b[0] + b[2]) / 2, (b[1] + b[3]) / 2)
+    return _contains(a, centre_b) and _contains(b, centre_a)
+
+
+def score(detections, references):
+    """(matched references, unmatched detections), greedy one-to-one."""
+    free = list(detections)
+    matched = 0
+    for reference in references:
+        for i, detection in enumerate(free):
+            if same_face(detection, reference):
+                matched += 1
+                del free[i]
+                break
+    return matched, len(free)
+
+
+def bench_detector(name, spec, frames, references, max_width, warmup):
+    detector = create_detector(**spec)
+    inputs = [downscale(frame, max_width) for frame in frames]
+    for rgb, _ in inputs[:warmup]:
+        detector.detect(rgb)
+
+    latencies = []
+    matched = extra = detected = 0
+    for (rgb, scale), frame_references in zip(inputs, references):
+        start = time.perf_counter()
+        boxes = detector.detect(rgb)
+        latencies.append(time.perf_counter() - start)
+        # Back to full-frame coordinates, where the references are
+        boxes = [tuple(v / scale for v in box) for box in boxes]
+        hits, misses = score(boxes, frame_references)
+        matched += hits
+        extra += misses
+        detected += len(boxes)
+
+    total = sum(len(r) for r in references)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "detector": name,
+        "spec": spec,
+        "frames": len(inputs),
+        "reference_faces": total,
+        "detections": detected,
+        "recall": round(matched / total, 4) if total else None,
+        "extra_per_frame": round(extra / len(inputs), 3),
+        "ms_mean": round(float(latencies_ms.mean()), 2),
+        "ms_p50": round(float(np.percentile(latencies_ms, 50)), 2),
+        "ms_p95": round(float(np.percentile(latencies_ms, 95)), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--images", type=Path, help="Folder of images (searched recursively)")
+    source.add_argument("--recording", type=Path, help="Recording made with streams.recording (path without suffix)")
+    parser.add_argument("--limit", type=int, default=200, help="Frames used at most")
+    parser.add_argument("--detectors", nargs="+", help="Presets of face_recognition.detectors (all by default)")
+    parser.add_argument("--extra-detector", nargs=2, action="append", default=[], metavar=("NAME", "SPEC"),
+                        help="Additional detector given as a JSON spec")
+    parser.add_argument("--reference", default=json.dumps(DEFAULT_REFERENCE), help="JSON spec of the reference detector")
+    parser.add_argument("--max-width", type=int, default=640, help="Detection width, as FaceProcessor.max_width")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--json", type=Path, help="Write the results to this file")
+    args = parser.parse_args()
+
+    if args.images:
+        frames = list(image_frames(args.images, args.limit))
+    else:
+        from tools.replay_benchmark import recorded_frames
+        frames = list(recorded_frames(args.recording, args.limit))
+    if not frames:
+        raise SystemExit("No frames to run the detectors on")
+
+    presets = load_pipeline_config().get("face_recognition", {}).get("detectors", {})
+    names = args.detectors or list(presets)
+    unknown = [name for name in names if name not in presets]
+    if unknown:
+        raise SystemExit(f"Unknown detector preset(s): {', '.join(unknown)}")
+    candidates = [(name, presets[name]) for name in names]
+    candidates += [(name, json.loads(spec)) for name, spec in args.extra_detector]
+
+    reference_spec = json.loads(args.reference)
+    reference = create_detector(**reference_spec)
+    print(f"Reference {reference_spec} on {len(frames)} full-size frame(s)...")
+    references = [reference.detect(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)) for frame in frames]
+    print(f"{sum(map(len, references))} reference face(s)\n")
+
+    print(f"{'detector':<18}{'recall':>8}{'extra/frame':>13}{'ms mean':>9}{'ms p50':>9}{'ms p95':>9}")
+    results = []
+    for name, spec in candidates:
+        try:
+            result = bench_detector(name, spec, frames, references, args.max_width, args.warmup)
+        except Exception as e:
+            print(f"{name:<18}unavailable: {e}")
+            continue
+        results.append(result)
+        recall = "-" if result["recall"] is None else f"{result['recall']:.3f}"
+        print(f"{name:<18}{recall:>8}{result['extra_per_frame']:>13}{result['ms_mean']:>9}"
+              f"{result['ms_p50']:>9}{result['ms_p95']:>9}")
+
+    if args.json:
+        report = {"reference": reference_spec, "max_width": args.max_width, "frames": len(frames), "results": results}
+        args.json.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Generador de carga para /ws/video: abre N conexiones concurrentes contra un
+servidor local y envía frames JPEG pre-codificados a un ritmo fijo, en modo
+texto (data URL) o binario (src/frame_protocol.py).
+
+Para cada cliente mide la latencia de ida y vuelta de cada frame respondido,
+la fracción de frames respondidos y los frames saltados por el servidor; entre
+clientes calcula el índice de equidad de Jain sobre los resultados por
+segundo. Con --sweep repite la prueba con N creciente hasta encontrar el punto
+de saturación (p95 por encima del SLO, pocos frames respondidos o conexiones
+rechazadas).
+
+Uso:
+    python -m tools.load_generator --clients 4 --fps 5 --duration 20
+    python -m tools.load_generator --mode text --clients 8 --images dataset/
+    python -m tools.load_generator --sweep --max-clients 64 --slo-ms 500 --json sweep.json
+"""
+import argparse
+import asyncio
+import base64
+import json
+import statistics
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+import websockets
+
+from src.frame_protocol import PROTOCOL_BINARY, PROTOCOL_VERSION, FrameHeader, encode_binary_frame
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp"}
+
+
+def load_frames(folder: Optional[Path], count: int, width: int, height: int, quality: int) -> List[bytes]:
+    """JPEG payloads cycled by every client; synthetic frames change every time so none is skipped."""
+    images = []
+    if folder is not None:
+        for path in sorted(p for p in folder.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)[:count]:
+            image = cv2.imread(str(path))
+            if image is not None:
+                images.append(cv2.resize(image, (width, height)))
+    if not images:
+        rng = np.random.default_rng(0)
+        # Large smooth blobs, so a shift is visible even on the server's small thumbnail
+        coarse = rng.integers(0, 255, (height // 40 + 1, width // 40 + 1, 3), dtype=np.uint8)
+        background = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+        side = height // 4
+        for i in range(count):
+            # The whole picture moves, otherwise the server's change detection skips most frames
+            image = np.roll(background, i * 24, axis=1)
+            x = (i * width // count) % (width - side)
+            cv2.rectangle(image, (x, height // 3), (x + side, height // 3 + side), (200, 180, 160), -1)
+            images.append(image)
+    return [cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes() for image in images]
+
+
+class ClientStats:
+    def __init__(self, client_id: int):
+        self.client_id = client_id
+        self.sent = 0
+        self.answered = 0
+        self.skipped = 0
+        self.latencies: List[float] = []
+        self.refused = False
+        self.error: Optional[str] = None
+        self.started = 0.0
+        self.finished = 0.0
+
+    @property
+    def results_per_second(self) -> float:
+        elapsed = self.finished - self.started
+        return self.answered / elapsed if elapsed > 0 else 0.0
+
+
+async def run_client(client_id: int, args, frames: List[bytes], stop_at: float) -> ClientStats:
+    stats = ClientStats(client_id)
+    uri = f"{args.url}?priority={args.priority}"
+    sent_at: Dict[int, float] = {}
+    interval = 1.0 / args.fps
+    try:
+        async with websockets.connect(uri, max_size=None, open_timeout=10) as ws:
+            binary = False
+            if args.mode == "binary":
+                await ws.send(json.dumps({"type": "hello", "protocol": PROTOCOL_BINARY, "version": PROTOCOL_VERSION}))
+
+            async def receive():
+                nonlocal binary, interval
+                async for message in ws:
+                    data = json.loads(message)
+                    if data.get("type") == "hello":
+                        binary = data.get("protocol") == PROTOCOL_BINARY
+                        continue
+                    if data.get("type") == "control":
+                        if args.obey_control:
+                            interval = data["send_interval_ms"] / 1000.0
+                        continue
+                    sent = sent_at.pop(data.get("frame_id"), None)
+                    if sent is None:
+                        continue
+                    stats.answered += 1
+                    stats.latencies.append(time.perf_counter() - sent)
+                    if data.get("skipped"):
+                        stats.skipped += 1
+
+            receiver = asyncio.ensure_future(receive())
+            if args.mode == "binary":
+                # Wait for the server to agree before sending binary frames
+                deadline = time.perf_counter() + 2.0
+                while not binary and time.perf_counter() < deadline and not receiver.done():
+                    await asyncio.sleep(0.01)
+            data_urls = None if binary else [
+                "data:image/jpeg;base64," + base64.b64encode(payload).decode("ascii") for payload in frames
+            ]
+
+            stats.started = time.perf_counter()
+            next_send = stats.started
+            # Spread the clients over one interval so they do not all send at the same instant
+            await asyncio.sleep((client_id % 10) * interval / 10)
+            while time.perf_counter() < stop_at and not receiver.done():
+                index = stats.sent % len(frames)
+                # Text frames get server-side ids 1, 2, 3...; binary ones carry ours
+                frame_id = stats.sent + 1
+                sent_at[frame_id] = time.perf_counter()
+                if binary:
+                    header = FrameHeader(frame_id, time.time() * 1000, args.width, args.height, "jpeg")
+                    await ws.send(encode_binary_frame(header, frames[index]))
+                else:
+                    await ws.send(data_urls[index])
+                stats.sent += 1
+                next_send += interval
+                await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+
+            # Give the last results a moment to arrive
+            await asyncio.sleep(args.drain)
+            stats.finished = time.perf_counter()
+            receiver.cancel()
+            await asyncio.gather(receiver, return_exceptions=True)
+    except websockets.ConnectionClosed as e:
+        code = e.rcvd.code if getattr(e, "rcvd", None) is not None else None
+        stats.refused = code == 1013
+        stats.error = f"closed with code {code}"
+    except Exception as e:
+        stats.error = repr(e)
+    if not stats.finished:
+        stats.finished = time.perf_counter()
+    return stats
+
+
+def jain_index(values: List[float]) -> Optional[float]:
+    # 1.0 when every client gets the same rate, 1/n when one client gets everything
+    if not values or not any(values):
+        return None
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    return float(np.percentile(values, q))
+
+
+async def run_level(clients: int, args, frames: List[bytes]) -> dict:
+    stop_at = time.perf_counter() + args.duration
+    results = await asyncio.gather(*(run_client(i, args, frames, stop_at) for i in range(clients)))
+    latencies_ms = [latency * 1000 for stats in results for latency in stats.latencies]
+    sent = sum(stats.sent for stats in results)
+    answered = sum(stats.answered for stats in results)
+    connected = [stats for stats in results if not stats.refused and stats.sent]
+    rates = [stats.results_per_second for stats in connected]
+    return {
+        "clients": clients,
+        "connected": len(connected),
+        "refused": sum(stats.refused for stats in results),
+        "errors": [f"client {s.client_id}: {s.error}" for s in results if s.error and not s.refused][:10],
+        "frames_sent": sent,
+        "frames_answered": answered,
+        "answered_fraction": round(answered / sent, 4) if sent else 0.0,
+        "skipped_fraction": round(sum(s.skipped for s in results) / answered, 4) if answered else 0.0,
+        "results_per_second": round(sum(rates), 2),
+        "latency_ms": {
+            "p50": percentile(latencies_ms, 50),
+            "p95": percentile(latencies_ms, 95),
+            "p99": percentile(latencies_ms, 99),
+            "mean": statistics.mean(latencies_ms) if latencies_ms else None,
+        },
+        "fairness_jain": jain_index(rates),
+        "per_client_results_per_second": [round(rate, 2) for rate in rates],
+    }
+
+
+def saturated(level: dict, args) -> Optional[str]:
+    p95 = level["latency_ms"]["p95"]
+    if level["refused"]:
+        return f"{level['refused']} connection(s) refused"
+    if p95 is None or p95 > args.slo_ms:
+        return f"p95 {p95 if p95 is None else round(p95)} ms over the {args.slo_ms} ms SLO"
+    if level["answered_fraction"] < args.min_answered:
+        return f"only {level['answered_fraction']:.0%} of frames answered"
+    return None
+
+
+def print_level(level: dict):
+    latency = level["latency_ms"]
+    fmt = lambda v: "-" if v is None else f"{v:.0f}"
+    fairness = level["fairness_jain"]
+    print(f"{level['clients']:>7}{level['connected']:>10}{level['results_per_second']:>10}"
+          f"{level['answered_fraction']:>10.0%}{fmt(latency['p50']):>9}{fmt(latency['p95']):>9}"
+          f"{fmt(latency['p99']):>9}{'-' if fairness is None else f'{fairness:.3f}':>9}")
+
+
+async def main_async(args):
+    frames = load_frames(args.images, args.frame_count, args.width, args.height, args.quality)
+    print(f"{len(frames)} frame(s) of ~{statistics.mean(map(len, frames)) / 1024:.0f} KiB, "
+          f"{args.mode} mode, {args.fps} fps per client, {args.duration}s per level")
+    print(f"{'clients':>7}{'connected':>10}{'res/s':>10}{'answered':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'jain':>9}")
+
+    levels = []
+    if args.sweep:
+        clients = args.clients
+        while clients <= args.max_clients:
+            level = await run_level(clients, args, frames)
+            print_level(level)
+            levels.append(level)
+            reason = saturated(level, args)
+            if reason:
+                print(f"Saturated at {clients} client(s): {reason}")
+                level["saturation_reason"] = reason
+                break
+            clients *= 2
+            await asyncio.sleep(args.pause)
+        else:
+            print(f"No saturation up to {args.max_clients} client(s)")
+    else:
+        level = await run_level(args.clients, args, frames)
+        print_level(level)
+        levels.append(level)
+
+    for level in levels:
+        for error in level["errors"]:
+            print(f"  {error}")
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/ws/video")
+    parser.add_argument("--mode", choices=["binary", "text"], default="binary")
+    parser.add_argument("--clients", type=int, default=4, help="Concurrent connections (first level with --sweep)")
+    parser.add_argument("--fps", type=float, default=5.0, help="Frames per second sent by each client")
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds of streaming per level")
+    parser.add_argument("--drain", type=float, default=1.0, help="Seconds to wait for late results")
+    parser.add_argument("--priority", choices=["high", "normal", "low"], default="normal")
+    parser.add_argument("--obey-control", action="store_true", help="Follow the server's send-rate control messages")
+    parser.add_argument("--images", type=Path, help="Folder of images to stream (synthetic frames otherwise)")
+    parser.add_argument("--frame-count", type=int, default=30)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--quality", type=int, default=60, help="JPEG quality of the pre-encoded frames")
+    parser.add_argument("--sweep", action="store_true", help="Double the clients until the server saturates")
+    parser.add_argument("--max-clients", type=int, default=64)
+    parser.add_argument("--slo-ms", type=float, default=500.0, help="p95 round trip considered saturated")
+    parser.add_argument("--min-answered", type=float, default=0.5, help="Answered fraction considered saturated")
+    parser.add_argument("--pause", type=float, default=3.0, help="Seconds between sweep levels")
+    parser.add_argument("--json", type=Path, help="Write the results to this file")
+    args = parser.parse_args()
+
+    levels = asyncio.run(main_async(args))
+    if args.json:
+        report = {"settings": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+                  "levels": levels}
+        args.json.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Compara los matchers de la galería (src/face_matchers.py) con la búsqueda
+exacta: recall@k, acuerdo en la identidad top-1 y latencia por frame, sobre
+una galería sintética con varias codificaciones por persona.
+
+Uso:
+    python -m tools.matcher_recall --gallery-size 20000
+    python -m tools.matcher_recall --gallery-size 50000 --per-identity 5 --n-probe 2 4 8 16 --json recall.json
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from src.face_gallery import ENCODING_SIZE, FaceGallery
+from src.face_matchers import CentroidMatcher, ExactMatcher, IVFMatcher
+
+
+def synthetic_people(num_encodings: int, per_identity: int, rng):
+    """Identity centres about 1.0 apart, encodings of one person about 0.3 apart (dlib-like)."""
+    identities = max(1, num_encodings // per_identity)
+    centres = rng.normal(0, 0.06, (identities, ENCODING_SIZE))
+    owner = np.arange(num_encodings) % identities
+    encodings = centres[owner] + rng.normal(0, 0.02, (num_encodings, ENCODING_SIZE))
+    names = [f"user_{i:06d}" for i in owner]
+    return centres, encodings, names
+
+
+def make_queries(centres, count: int, impostor_ratio: float, rng):
+    known = rng.integers(0, len(centres), count)
+    queries = centres[known] + rng.normal(0, 0.02, (count, ENCODING_SIZE))
+    impostors = rng.random(count) < impostor_ratio
+    queries[impostors] = rng.normal(0, 0.06, (int(impostors.sum()), ENCODING_SIZE))
+    return queries.astype(np.float32)
+
+
+def measure(gallery, queries, k, faces_per_frame, exact_rows, names):
+    latencies = []
+    found = []
+    for start in range(0, len(queries), faces_per_frame):
+        batch = queries[start:start + faces_per_frame]
+        t = time.perf_counter()
+        rows, _ = gallery.search(batch, k)
+        latencies.append(time.perf_counter() - t)
+        found.append(rows)
+    rows = np.concatenate(found)
+    recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(rows, exact_rows)])
+    top1 = np.mean([a[0] >= 0 and names[a[0]] == names[e[0]] for a, e in zip(rows, exact_rows)])
+    latencies = np.array(latencies) * 1000
+    return {
+        "recall_at_k": round(float(recall), 4),
+        "top1_identity_agreement": round(float(top1), 4),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)), 4),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gallery-size", type=int, default=20000)
+    parser.add_argument("--per-identity", type=int, default=5, help="Encodings per enrolled person")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--faces-per-frame", type=int, default=4, help="Queries searched together")
+    parser.add_argument("--impostors", type=float, default=0.2, help="Fraction of queries from unknown people")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--n-probe", nargs="+", type=int, default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--n-lists", type=int, help="IVF cells (sqrt(N) by default)")
+    parser.add_argument("--shortlist", nargs="+", type=int, default=[4, 8, 16, 32])
+    parser.add_argument("--insert-batch", type=int, default=5, help="Encodings per simulated enrollment")
+    parser.add_argument("--json", type=Path, help="Write the report to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centres, encodings, names = synthetic_people(args.gallery_size, args.per_identity, rng)
+    queries = make_queries(centres, args.queries, args.impostors, rng)
+    names = np.asarray(names, dtype=object)
+
+    exact = FaceGallery(matcher=ExactMatcher())
+    exact.replace(encodings, names)
+    exact_rows, _ = exact.search(queries, args.k)
+
+    configs = [("exact", {}, ExactMatcher())]
+    configs += [("centroid", {"shortlist": s}, CentroidMatcher(shortlist=s)) for s in args.shortlist]
+    configs += [("ivf", {"n_probe": p}, IVFMatcher(n_lists=args.n_lists, n_probe=p, min_train_size=0))
+                for p in args.n_probe]
+
+    print(f"{args.gallery_size} encodings ({len(centres)} people), {args.queries} queries, "
+          f"{args.faces_per_frame} per search, k={args.k}")
+    print(f"{'matcher':<26}{'build ms':>10}{'insert ms':>11}{'recall@k':>10}{'top-1':>8}{'p50 ms':>9}{'p95 ms':>9}")
+    report = {"gallery_size": args.gallery_size, "people": len(centres), "queries": args.queries,
+              "k": args.k, "results": []}
+    for kind, options, matcher in configs:
+        gallery = FaceGallery(matcher=matcher)
+        start = time.perf_counter()
+        gallery.replace(encodings, names)
+        build_ms = (time.perf_counter() - start) * 1000
+        entry = dict(matcher=kind, options=options, build_ms=round(build_ms, 1))
+        entry.update(measure(gallery, queries, args.k, args.faces_per_frame, exact_rows, names))
+
+        # One enrollment on top of the built index, after the search measurements
+        new = centres[:1] + rng.normal(0, 0.02, (args.insert_batch, ENCODING_SIZE))
+        start = time.perf_counter()
+        gallery.append(new, ["new_user"] * args.insert_batch)
+        entry["insert_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        report["results"].append(entry)
+
+        label = kind + "".join(f" {k}={v}" for k, v in options.items())
+        print(f"{label:<26}{entry['build_ms']:>10}{entry['insert_ms']:>11}{entry['recall_at_k']:>10.3f}"
+              f"{entry['top1_identity_agreement']:>8.3f}{entry['latency_ms_p50']:>9.3f}{entry['latency_ms_p95']:>9.3f}")
+
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""
+Benchmark offline de los pipelines de reconocimiento y de visión.
+
+Reproduce secuencias de frames sintéticas o grabadas (streams.recording en
+pipeline_config.yml) a través de FaceProcessor.process_frame,
+FaceRecognitionSystem.process_frame y VisionPipeline.process_frame, y mide
+throughput, latencia p50/p95/p99 y pico de memoria para cada combinación de
+tamaño de galería, caras por frame y resolución.
+
+Con --models stand-in (por defecto) dlib y los clasificadores se sustituyen
+por modelos de prueba deterministas: no hace falta red ni descargar modelos,
+y lo que se mide es el coste del propio pipeline (redimensionado, tracking,
+matching contra la galería, batching...).
+
+Uso:
+    python -m tools.replay_benchmark --json bench.json
+    python -m tools.replay_benchmark --gallery-sizes 10 1000 10000 --faces 0 1 4 --resolutions 640x480 1280x720
+    python -m tools.replay_benchmark --recording recordings/20261017_101500_stream1 --models real
+    python -m tools.replay_benchmark --json new.json --baseline bench.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+ENCODING_SIZE = 128
+PIPELINES = ("face_processor", "face_system", "vision")
+# Synthetic faces are flat squares whose gray level encodes the gallery identity
+FACE_BASE_LEVEL = 100
+FACE_LEVELS = 150
+
+
+class StandInFaceModels:
+    """
+    Drop-in for the `face_recognition` module. Detection thresholds the
+    bright squares drawn by SyntheticFrames; encodings are the gallery entry
+    the square's gray level points to, plus a little noise, so matching
+    behaves as with real faces of enrolled users.
+    """
+
+    def __init__(self):
+        self.known = np.zeros((1, ENCODING_SIZE))
+        self._rng = np.random.default_rng(0)
+
+    def face_locations(self, img, number_of_times_to_upsample=1, model="hog"):
+        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+        _, mask = cv2.threshold(gray, FACE_BASE_LEVEL - 5, 255, cv2.THRESH_BINARY)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        locations = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if w * h >= 400:
+                locations.append((y, x + w, y + h, x))
+        return locations
+
+    def face_encodings(self, face_image, known_face_locations=None, num_jitters=1, model="small"):
+        locations = known_face_locations or self.face_locations(face_image)
+        encodings = []
+        for top, right, bottom, left in locations:
+            level = int(face_image[(top + bottom) // 2, (left + right) // 2].mean())
+            identity = (level - FACE_BASE_LEVEL) % len(self.known)
+            encodings.append(self.known[identity] + self._rng.normal(0, 0.01, ENCODING_SIZE))
+        return encodings
+
+
+class StandInClassifier:
+    """Inference backend returning fixed labels after `cost_ms` per image."""
+
+    name = "stand-in"
+    labels = ("neutral", "happy", "sad", "angry", "surprise", "fear", "disgust")
+
+    def __init__(self, model_id, top_k=None, cost_ms=2.0):
+        self.top_k = top_k
+        self.cost = cost_ms / 1000.0
+
+    def __call__(self, images, batch_size=1):
+        images = images if isinstance(images, (list, tuple)) else [images]
+        time.sleep(self.cost * len(images))
+        scores = np.linspace(0.4, 0.05, len(self.labels))
+        labels = list(self.labels)[:self.top_k] if self.top_k else list(self.labels)
+        return [[{"label": label, "score": float(score)} for label, score in zip(labels, scores)]
+                for _ in images]
+
+
+def install_stand_ins(stand_in_faces: bool):
+    """Must run before importing src modules that import face_recognition."""
+    faces = None
+    if stand_in_faces:
+        faces = StandInFaceModels()
+        module = types.ModuleType("face_recognition")
+        module.face_locations = faces.face_locations
+        module.face_encodings = faces.face_encodings
+        sys.modules["face_recognition"] = module
+    from src.inference_backends import BACKENDS
+    BACKENDS[StandInClassifier.name] = StandInClassifier
+    return faces
+
+
+def synthetic_gallery(size: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    # dlib encodings have components of roughly this spread
+    encodings = rng.normal(0, 0.1, (size, ENCODING_SIZE))
+    names = [f"user_{i:05d}" for i in range(size)]
+    return encodings, names
+
+
+def synthetic_frames(width: int, height: int, faces: int, count: int, seed: int = 0):
+    """BGR frames with `faces` slowly drifting squares over a static noisy background."""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 60, (height, width, 3), dtype=np.uint8)
+    side = max(24, height // 5)
+    columns = max(1, faces)
+    for i in range(count):
+        frame = background.copy()
+        for face in range(faces):
+            x = int((face + 0.5) * width / columns - side / 2) + (i % 20)
+            y = int(height / 2 - side / 2) + (i % 10)
+            x = min(max(x, 0), width - side)
+            level = FACE_BASE_LEVEL + face % FACE_LEVELS
+            frame[y:y + side, x:x + side] = level
+        yield frame
+
+
+def recorded_frames(path, limit: int):
+    from src.frame_recorder import FrameRecording
+    recording = FrameRecording(path)
+    try:
+        for i, (_, payload) in enumerate(recording):
+            if i >= limit:
+                break
+            frame = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR)
+            if frame is not None:
+                yield frame
+    finally:
+        recording.close()
+
+
+def unthrottle(face_processor, keep_throttling: bool):
+    # By default every frame is a keyframe: the benchmark measures detection, not the skip logic
+    if not keep_throttling:
+        face_processor.processing_interval = 0
+        face_processor.tracking_detection_interval = 0
+        face_processor.frame_skip = 1
+
+
+def close_loop(loop):
+    # Background tasks (MicroBatcher runners) are cancelled before the loop goes away
+    pending = asyncio.all_tasks(loop)
+    for task in pending:
+        task.cancel()
+
+    async def wait_cancelled():
+        await asyncio.gather(*pending, return_exceptions=True)
+    loop.run_until_complete(wait_cancelled())
+    loop.close()
+
+
+def bench_face_processor(frames, gallery, args):
+    from src.face_processor import FaceProcessor
+    from src.frame_context import FrameBuffers, FrameContext
+    processor = FaceProcessor()
+    unthrottle(processor, args.keep_throttling)
+    buffers = FrameBuffers()
+
+    def step(frame):
+        # Frames are wrapped as the server does, so view buffers are reused across frames
+        processor.process_frame(FrameContext(frame, buffers), gallery)
+    return step, None
+
+
+def bench_face_system(frames, gallery, args, workdir: Path):
+    from src.face_recontition_system import FaceRecognitionSystem
+    from src.frame_context import FrameContext
+    from src.stream_session import StreamSession
+    workdir.mkdir(parents=True, exist_ok=True)
+    system = FaceRecognitionSystem(
+        dataset_path=workdir / "dataset", cache_path=workdir / "cache", load_on_init=False,
+        log_config={"log_dir": str(workdir / "logs"), "enabled": args.log_writes}
+    )
+    encodings, names = gallery.export()[1:]
+    system.gallery.replace(encodings, names)
+    session = StreamSession(config={"rate_control": {"enabled": False}, "change_detection": {"enabled": False}})
+    unthrottle(session.face_processor, args.keep_throttling)
+    loop = asyncio.new_event_loop()
+
+    def step(frame):
+        loop.run_until_complete(system.process_frame(FrameContext(frame, session.frame_buffers), session))
+
+    def close():
+        system.close()
+        close_loop(loop)
+    return step, close
+
+
+def bench_vision(frames, gallery, args):
+    from src.face_processor import FaceProcessor
+    from src.frame_context import FrameContext
+    from src.model_registry import ModelRegistry
+    from src.stream_session import StreamSession
+    from src.vision_pipeline import VisionPipeline
+    analysis = args.analysis
+    # No result cache either: a recording of still faces would otherwise hardly reach the model
+    pipeline = VisionPipeline(ModelRegistry({analysis: {"enabled": True, "backend": args.vision_backend,
+                                                        "result_cache": {"enabled": False}}}))
+    pipeline.registry.get(analysis)
+    session = StreamSession(config={"rate_control": {"enabled": False}})
+    # Classify every face on every frame instead of reusing cached results
+    session.model_state(analysis).refresh_interval = 0
+    processor = FaceProcessor()
+    unthrottle(processor, args.keep_throttling)
+    loop = asyncio.new_event_loop()
+
+    def step(frame):
+        # Face detection feeds the crops but is not part of the measured time
+        frame = FrameContext(frame, session.frame_buffers)
+        face_results = processor.process_frame(frame, gallery)
+        start = time.perf_counter()
+        loop.run_until_complete(pipeline.process_frame(frame, analysis, session, face_results))
+        return time.perf_counter() - start
+    return step, lambda: close_loop(loop)
+
+
+def run_case(pipeline, frames, gallery, args, workdir):
+    if pipeline == "face_processor":
+        step, close = bench_face_processor(frames, gallery, args)
+    elif pipeline == "face_system":
+        step, close = bench_face_system(frames, gallery, args, workdir)
+    else:
+        step, close = bench_vision(frames, gallery, args)
+
+    try:
+        for frame in frames[:args.warmup]:
+            step(frame)
+
+        latencies = []
+        started = time.perf_counter()
+        for frame in frames:
+            start = time.perf_counter()
+            measured = step(frame)
+            latencies.append(measured if measured is not None else time.perf_counter() - start)
+        wall = time.perf_counter() - started
+
+        # Separate pass: tracemalloc slows everything down, so it is kept out of the timings
+        tracemalloc.start()
+        for frame in frames[:args.memory_frames]:
+            step(frame)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        if close is not None:
+            close()
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "frames": len(frames),
+        "throughput_fps": round(len(frames) / wall, 2) if wall else None,
+        "latency_ms": {
+            "mean": round(float(latencies_ms.mean()), 3),
+            "p50": round(float(np.percentile(latencies_ms, 50)), 3),
+            "p95": round(float(np.percentile(latencies_ms, 95)), 3),
+            "p99": round(float(np.percentile(latencies_ms, 99)), 3),
+        },
+        "peak_alloc_mb": round(peak / 2 ** 20, 2),
+    }
+
+
+def case_key(result):
+    return (result["pipeline"], result["gallery_size"], result["faces"], result["resolution"])
+
+
+def compare_with_baseline(results, baseline_path: Path, tolerance: float):
+    baseline = {case_key(r): r for r in json.loads(baseline_path.read_text(encoding="utf-8"))["results"]}
+    print(f"\nAgainst {baseline_path} (regression = p50 more than {tolerance:.0%} slower)")
+    regressions = 0
+    for result in results:
+        old = baseline.get(case_key(result))
+        if old is None:
+            continue
+        ratio = result["latency_ms"]["p50"] / max(old["latency_ms"]["p50"], 1e-9)
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{'/'.join(map(str, case_key(result))):<48} p50 {old['latency_ms']['p50']:>9.3f} -> "
+              f"{result['latency_ms']['p50']:>9.3f} ms ({ratio:>5.2f}x){flag}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument("--gallery-sizes", nargs="+", type=int, default=[10, 100, 1000, 10000])
+    parser.add_argument("--faces", nargs="+", type=int, default=[1, 4], help="Faces per synthetic frame")
+    parser.add_argument("--resolutions", nargs="+", default=["640x480", "1280x720"])
+    parser.add_argument("--recording", type=Path, help="Replay a recording (path without .frames/.idx) instead")
+    parser.add_argument("--frames", type=int, default=50, help="Measured frames per case")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--memory-frames", type=int, default=5, help="Frames of the peak memory pass")
+    parser.add_argument("--models", choices=["stand-in", "real"], default="stand-in")
+    parser.add_argument("--analysis", default="emotion", help="Model used by the vision pipeline")
+    parser.add_argument("--vision-backend", help="Inference backend (default: stand-in, or transformers with --models real)")
+    parser.add_argument("--keep-throttling", action="store_true", help="Keep FaceProcessor's detection intervals")
+    parser.add_argument("--log-writes", action="store_true", help="Let the face system write recognition logs")
+    parser.add_argument("--json", type=Path, help="Write the results to this file")
+    parser.add_argument("--baseline", type=Path, help="Earlier --json output to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+    args.vision_backend = args.vision_backend or ("stand-in" if args.models == "stand-in" else "transformers")
+
+    faces_model = install_stand_ins(args.models == "stand-in")
+    from src.face_gallery import FaceGallery
+
+    if args.recording:
+        frames = list(recorded_frames(args.recording, args.frames))
+        if not frames:
+            raise SystemExit(f"No decodable frames in {args.recording}")
+        if faces_model is not None:
+            print("Replaying real frames with the stand-in detector; use --models real for meaningful detections")
+        frame_sets = [("recorded", "recorded", frames)]
+    else:
+        frame_sets = []
+        for resolution in args.resolutions:
+            width, height = (int(v) for v in resolution.lower().split("x"))
+            for faces in args.faces:
+                frame_sets.append((resolution, faces, list(synthetic_frames(width, height, faces, args.frames))))
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="replay_bench_") as tmp:
+        for gallery_index, gallery_size in enumerate(args.gallery_sizes):
+            encodings, names = synthetic_gallery(gallery_size)
+            gallery = FaceGallery()
+            gallery.replace(encodings, names)
+            if faces_model is not None:
+                faces_model.known = encodings
+            for resolution, faces, frames in frame_sets:
+                for pipeline in args.pipelines:
+                    # The vision pipeline does not depend on the gallery size
+                    if pipeline == "vision" and gallery_index > 0:
+                        continue
+                    workdir = Path(tmp) / f"{pipeline}_{gallery_size}_{resolution}_{faces}"
+                    result = dict(pipeline=pipeline, gallery_size=gallery_size, faces=faces, resolution=resolution)
+                    result.update(run_case(pipeline, frames, gallery, args, workdir))
+                    results.append(result)
+                    print(f"{pipeline:<15}{gallery_size:>7} enc {str(faces):>9} faces {resolution:>10}"
+                          f"{result['throughput_fps']:>10} fps  p50 {result['latency_ms']['p50']:>8.3f} ms"
+                          f"  p99 {result['latency_ms']['p99']:>8.3f} ms  peak {result['peak_alloc_mb']:>7.2f} MB")
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "models": args.models,
+            "vision_backend": args.vision_backend,
+            "recording": str(args.recording) if args.recording else None,
+            "keep_throttling": args.keep_throttling,
+        },
+        "results": results,
+    }
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"\nResults written to {args.json}")
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.tolerance)
+        if regressions:
+            raise SystemExit(f"{regressions} regression(s) against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()